@@ -0,0 +1,184 @@
+"""
+Synthetic Gutenberg-style datalake for benchmarks.
+
+    python -m benchmarks.corpus --datalake bench/datalake --books 2000
+
+Books get a header with Title/Author/Release date/Language and a body drawn from a
+Zipfian vocabulary (a few very common words, a long tail of rare ones), with about a
+third of the books in Spanish, accented words included. The output is a normal datalake
+(YYYYMMDD/HH folders plus manifest.jsonl, loose or packed) that every stage can consume.
+Generation is deterministic for a given seed.
+"""
+
+import argparse
+import itertools
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from crawler.manifest import append_entry, body_hash, ensure_manifest, make_entry, make_pack_entry
+from crawler.storage import PACK_NAME, append_pack_index, append_to_pack
+
+
+ENGLISH_WORDS = [
+    "the", "of", "and", "to", "a", "in", "that", "he", "was", "it", "his", "with", "as", "for",
+    "had", "you", "not", "be", "her", "on", "at", "by", "which", "have", "or", "from", "this",
+    "whale", "sea", "ship", "captain", "night", "light", "river", "house", "love", "heart",
+    "king", "queen", "war", "peace", "letter", "garden", "window", "morning", "winter", "storm",
+]
+SPANISH_WORDS = [
+    "de", "la", "que", "el", "en", "y", "a", "los", "se", "del", "las", "un", "por", "con",
+    "no", "una", "su", "para", "es", "al", "lo", "como", "más", "pero", "sus", "le", "ya",
+    "niño", "canción", "corazón", "mañana", "camión", "pingüino", "señor", "también", "años",
+    "después", "allí", "está", "había", "qué", "aquí", "según", "jardín", "música", "razón",
+]
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ra", "so", "ta", "ve", "zu", "tri", "an", "or"]
+TAIL_SIZE = 20000
+
+FIRST_NAMES = ["Jane", "Charles", "Mark", "Emily", "Benito", "Emilia", "Miguel", "Leo", "Mary", "Herman"]
+LAST_NAMES = ["Austen", "Dickens", "Twain", "Brontë", "Pérez Galdós", "Pardo Bazán", "Cervantes", "Tolstoy", "Shelley"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+
+
+def _tail_words(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Vocabulary:
+    """
+    Language-specific Zipf-distributed word sampler: the real common words come first,
+    followed by a long tail of generated words shared by both languages.
+    """
+
+    def __init__(self, seed: int = 0, exponent: float = 1.1):
+        tail = _tail_words(TAIL_SIZE, seed)
+        self.words = {"en": ENGLISH_WORDS + tail, "es": SPANISH_WORDS + tail}
+        self.cum_weights = {}
+        for lang, words in self.words.items():
+            weights = [1.0 / (rank ** exponent) for rank in range(1, len(words) + 1)]
+            self.cum_weights[lang] = list(itertools.accumulate(weights))
+
+    def sample(self, rng: random.Random, lang: str, k: int) -> List[str]:
+        return rng.choices(self.words[lang], cum_weights=self.cum_weights[lang], k=k)
+
+
+def make_header(book_id: int, lang: str, rng: random.Random, vocab: Vocabulary) -> str:
+    title = " ".join(vocab.sample(rng, lang, rng.randint(2, 5))).title()
+    author = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    release = f"{rng.choice(MONTHS)} {rng.randint(1, 28)}, {rng.randint(1971, 2025)}"
+    language = "Spanish" if lang == "es" else "English"
+    return (
+        f"The Project Gutenberg eBook of {title}\n\n"
+        "This ebook is for the use of anyone anywhere in the United States and\n"
+        "most other parts of the world at no cost and with almost no restrictions\n"
+        "whatsoever.\n\n"
+        f"Title: {title}\n\n"
+        f"Author: {author}\n\n"
+        f"Release date: {release} [eBook #{book_id}]\n\n"
+        f"Language: {language}\n\n"
+        "Credits: Produced by volunteers\n"
+    )
+
+
+def make_body(lang: str, words: int, rng: random.Random, vocab: Vocabulary) -> str:
+    lines = []
+    sampled = vocab.sample(rng, lang, words)
+    for i in range(0, len(sampled), 12):
+        line = " ".join(sampled[i:i + 12])
+        lines.append(line[:1].upper() + line[1:] + ("." if rng.random() < 0.6 else ","))
+    return "\n".join(lines)
+
+
+def generate_corpus(
+    datalake: str,
+    books: int,
+    seed: int = 0,
+    min_words: int = 2000,
+    max_words: int = 20000,
+    spanish_ratio: float = 0.33,
+    books_per_hour: int = 500,
+    storage: str = "loose",
+    start_id: int = 1,
+    vocab: Optional[Vocabulary] = None,
+) -> dict:
+    """
+    Writes `books` synthetic books into `datalake`, spread over hour folders of
+    `books_per_hour` books each, and records them in the datalake manifest.
+    Returns {"books": n, "bytes": total header+body bytes}.
+    """
+    root = Path(datalake)
+    root.mkdir(parents=True, exist_ok=True)
+    ensure_manifest(root)
+    rng = random.Random(seed)
+    vocab = vocab or Vocabulary(seed)
+    total_bytes = 0
+
+    for n in range(books):
+        book_id = start_id + n
+        stamp = datetime(2025, 1, 1) + timedelta(hours=n // books_per_hour)
+        day, hour = stamp.strftime("%Y%m%d"), stamp.strftime("%H")
+        out_dir = root / day / hour
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        lang = "es" if rng.random() < spanish_ratio else "en"
+        header_bytes = make_header(book_id, lang, rng, vocab).encode("utf-8")
+        body_bytes = make_body(lang, rng.randint(min_words, max_words), rng, vocab).encode("utf-8")
+        size = len(header_bytes) + len(body_bytes)
+        total_bytes += size
+
+        if storage == "pack":
+            refs = append_to_pack(out_dir, header_bytes, body_bytes)
+            entry = make_pack_entry(root, book_id, day, hour, out_dir / PACK_NAME, refs, size, body_hash(body_bytes))
+            append_pack_index(out_dir, entry)
+        else:
+            header_path = out_dir / f"{book_id}_header.txt"
+            body_path = out_dir / f"{book_id}_body.txt"
+            header_path.write_bytes(header_bytes)
+            body_path.write_bytes(body_bytes)
+            entry = make_entry(root, book_id, day, hour, header_path, body_path, size, body_hash(body_bytes))
+        append_entry(root, entry)
+
+    return {"books": books, "bytes": total_bytes}
+
+
+def sample_queries(n: int, seed: int = 0, vocab: Optional[Vocabulary] = None) -> List[str]:
+    """
+    Queries of one to three words, mixing common words and the rarer head of the tail.
+    """
+    rng = random.Random(seed + 1)
+    vocab = vocab or Vocabulary(seed)
+    queries = []
+    for _ in range(n):
+        lang = "es" if rng.random() < 0.33 else "en"
+        words = vocab.words[lang]
+        picked = [words[min(len(words) - 1, int(rng.paretovariate(0.8)) + 20)] for _ in range(rng.randint(1, 3))]
+        queries.append(" ".join(picked))
+    return queries
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic Gutenberg-style datalake.")
+    ap.add_argument("--datalake", default="bench/datalake")
+    ap.add_argument("--books", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--min-words", type=int, default=2000)
+    ap.add_argument("--max-words", type=int, default=20000)
+    ap.add_argument("--spanish-ratio", type=float, default=0.33)
+    ap.add_argument("--storage", choices=["loose", "pack"], default="loose")
+    args = ap.parse_args()
+
+    result = generate_corpus(
+        args.datalake, args.books, args.seed, args.min_words, args.max_words,
+        args.spanish_ratio, storage=args.storage,
+    )
+    print(f"Generated {result['books']} books ({result['bytes'] / (1024 * 1024):.1f} MB) in {args.datalake}")
+
+
+if __name__ == "__main__":
+    main()
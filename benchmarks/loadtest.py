@@ -0,0 +1,222 @@
+"""
+HTTP load test of the search service.
+
+    python -m benchmarks.loadtest --books 2000 --concurrency 16 --duration 20
+
+Without --url, builds a synthetic corpus, index and datamart (benchmarks.corpus and the
+benchmark stages) in a temp dir, starts `service.search_service` on it in a separate
+process and load-tests that. With --url, any server with the same contract (e.g. the
+Java search-service) is tested with the synthetic query mix instead.
+
+`concurrency` keep-alive connections send /search requests back to back for
+`duration` seconds; a fraction of the queries (--repeat-ratio) are repeats, to
+exercise the result cache. Reports QPS and p50/p90/p99 latency, and the service's
+cache hit ratio from /health, as one JSON line appended to the results file.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import quote_plus, urlsplit
+
+from benchmarks.run import _git_commit, stage_datamart, stage_generate, stage_index, stage_metadata
+
+
+async def _request(reader, writer, host: str, path: str, method: str = "GET") -> Tuple[int, bytes]:
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    return status, await reader.readexactly(length)
+
+
+async def _get_json(host: str, port: int, path: str, method: str = "GET") -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        _, body = await _request(reader, writer, f"{host}:{port}", path, method)
+        return json.loads(body)
+    finally:
+        writer.close()
+
+
+async def _client(host: str, port: int, paths: List[str], deadline: float, latencies: List[float],
+                  errors: List[int], seed: int):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)
+            t0 = time.perf_counter()
+            status, _ = await _request(reader, writer, f"{host}:{port}", path)
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load_test(url: str, queries: List[str], concurrency: int, duration: float, repeat_ratio: float,
+                    mode: str, seed: int = 0) -> dict:
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    rng = random.Random(seed)
+    # A small hot set that repeats, the rest spread over the whole query list
+    hot = queries[:max(1, int(len(queries) * 0.05))]
+    paths = []
+    for i in range(max(len(queries), 1000)):
+        q = rng.choice(hot) if rng.random() < repeat_ratio else queries[i % len(queries)]
+        paths.append(f"/search?q={quote_plus(q)}&mode={mode}&pageSize=10")
+
+    before = await _get_json(host, port, "/health")
+    latencies: List[float] = []
+    errors: List[int] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, paths, start + duration, latencies, errors, seed + i) for i in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    after = await _get_json(host, port, "/health")
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3) if latencies else 0.0
+
+    result = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+    }
+    if "cache" in before and "cache" in after:
+        hits = after["cache"]["hits"] - before["cache"]["hits"]
+        misses = after["cache"]["misses"] - before["cache"]["misses"]
+        result["cache_hit_ratio"] = round(hits / (hits + misses), 3) if hits + misses else 0.0
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(host: str, port: int, proc: subprocess.Popen, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"search service exited with code {proc.returncode}")
+        try:
+            await _get_json(host, port, "/health")
+            return
+        except (OSError, ValueError):
+            await asyncio.sleep(0.2)
+    raise RuntimeError("search service did not start in time")
+
+
+def build_synthetic(work: Path, books: int, seed: int, min_words: int, max_words: int, postings_format: str):
+    datalake = str(work / "datalake")
+    print("[loadtest] Generating corpus, index and datamart ...")
+    stage_generate(datalake, books, seed, min_words, max_words, "loose")
+    stage_index(datalake, str(work), 1, postings_format, None, "none")
+    stage_metadata(datalake, str(work), 1)
+    stage_datamart(str(work))
+    return str(work / "index" / "segments"), str(work / "datamart.db")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the search service over HTTP.")
+    ap.add_argument("--url", default=None, help="Test a running server instead of starting one on a synthetic index")
+    ap.add_argument("--books", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--min-words", type=int, default=2000)
+    ap.add_argument("--max-words", type=int, default=20000)
+    ap.add_argument("--postings", choices=["docs", "freqs", "positions"], default="freqs")
+    ap.add_argument("--queries", type=int, default=500, help="Distinct synthetic queries")
+    ap.add_argument("--mode", choices=["and", "or"], default="and")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    ap.add_argument("--repeat-ratio", type=float, default=0.5, help="Share of requests drawn from a hot query set")
+    ap.add_argument("--threads", type=int, default=4, help="Service query threads")
+    ap.add_argument("--cache-size", type=int, default=1024, help="Service result cache (0 = off)")
+    ap.add_argument("--workdir", default=None, help="Where to build the synthetic index (kept afterwards)")
+    ap.add_argument("--output", type=Path, default=Path("benchmarks/loadtest_results.jsonl"))
+    args = ap.parse_args()
+
+    from benchmarks.corpus import sample_queries
+    queries = sample_queries(args.queries, args.seed)
+
+    work: Optional[Path] = None
+    proc = None
+    url = args.url
+    try:
+        if url is None:
+            work = Path(args.workdir or tempfile.mkdtemp(prefix="gutenberg-loadtest-"))
+            index, db = build_synthetic(work, args.books, args.seed, args.min_words, args.max_words, args.postings)
+            port = _free_port()
+            proc = subprocess.Popen([
+                sys.executable, "-m", "service.search_service", "--index", index, "--db", db,
+                "--host", "127.0.0.1", "--port", str(port), "--threads", str(args.threads),
+                "--cache-size", str(args.cache_size), "--reload-interval", "0",
+            ], stdout=subprocess.DEVNULL, cwd=Path(__file__).resolve().parents[1])
+            asyncio.run(_wait_ready("127.0.0.1", port, proc))
+            url = f"http://127.0.0.1:{port}"
+
+        print(f"[loadtest] {args.concurrency} connections for {args.duration}s against {url} ...")
+        result = asyncio.run(load_test(url, queries, args.concurrency, args.duration, args.repeat_ratio, args.mode,
+                                       args.seed))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if work is not None and args.workdir is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "url": args.url or "synthetic",
+        "params": {
+            "books": args.books, "seed": args.seed, "postings": args.postings, "queries": args.queries,
+            "mode": args.mode, "concurrency": args.concurrency, "duration": args.duration,
+            "repeat_ratio": args.repeat_ratio, "threads": args.threads, "cache_size": args.cache_size,
+        },
+        **result,
+    }
+    print(
+        f"\n{result['requests']} requests in {result['seconds']}s: {result['qps']} QPS, "
+        f"p50 {result['p50_ms']} ms, p90 {result['p90_ms']} ms, p99 {result['p99_ms']} ms, "
+        f"{result['errors']} errors"
+        + (f", cache hit ratio {result['cache_hit_ratio']}" if "cache_hit_ratio" in result else "")
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
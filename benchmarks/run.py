@@ -0,0 +1,317 @@
+"""
+End-to-end benchmark of the pipeline stages on a synthetic corpus.
+
+    python -m benchmarks.run --books 2000 --workers 4 --postings freqs
+
+Generates a datalake (benchmarks.corpus), then times each stage in a fresh process so
+peak RSS is per stage: indexer, metadata parser, datamart upsert, binary export,
+FTS build (optional) and queries. A summary is printed and one JSON line per run is
+appended to the results file (default benchmarks/results.jsonl) with the git commit,
+parameters and per-stage seconds, books/s, MB/s, queries/s and peak RSS, so runs can be
+compared across commits.
+
+The book_memory stage re-indexes the largest books one at a time under tracemalloc and
+reports the per-book peak of the streaming tokenizer next to that of reading the whole
+body and materializing its word list first.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from inverted_index.spimi import peak_rss_mb
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parents[1],
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _child(fn: Callable, args: tuple, quiet: bool, results):
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            extra = fn(*args) or {}
+    except Exception as e:
+        results.put({"error": repr(e)})
+        raise
+    seconds = time.perf_counter() - start
+    results.put({"seconds": seconds, "peak_rss_mb": peak_rss_mb(), **extra})
+
+
+def run_stage(fn: Callable, *args, quiet: bool = True) -> dict:
+    """
+    Runs fn(*args) in a fresh process and returns its wall time and peak RSS,
+    plus whatever dict fn returns.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(fn, args, quiet, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    if "error" in result:
+        raise RuntimeError(f"{fn.__name__} failed: {result['error']}")
+    return result
+
+
+# Stage bodies; top-level so they can run in spawned processes. Their output is
+# silenced unless --verbose, because per-book logging would dominate the timings.
+
+def stage_generate(datalake: str, books: int, seed: int, min_words: int, max_words: int, storage: str):
+    from benchmarks.corpus import generate_corpus
+    return generate_corpus(datalake, books, seed, min_words, max_words, storage=storage)
+
+
+def stage_index(datalake: str, work: str, workers: int, postings_format: str, memory_budget_mb, analysis: str):
+    from inverted_index.indexer import build_inverted_index
+    build_inverted_index(
+        datalake, f"{work}/index/inverted_index.json", f"{work}/progress_indexer.json",
+        f"{work}/index/segments", workers, postings_format, memory_budget_mb, analysis,
+    )
+    segments = Path(f"{work}/index/segments")
+    return {"bytes": sum(p.stat().st_size for p in segments.glob("seg_*.json"))}
+
+
+BOOK_MEMORY_SAMPLE = 10
+
+
+def _traced_peak_kb(fn: Callable, *args) -> float:
+    import tracemalloc
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    fn(*args)
+    return (tracemalloc.get_traced_memory()[1] - before) / 1024
+
+
+def _book_terms_peak_kb(datalake: str, entry: dict, postings_format: str, analysis: str, streamed: bool) -> float:
+    # The indexer's per-book step (_book_terms builds the same set, Counter or position
+    # arrays either way), fed the body in 64 KB chunks or as one string read up front
+    from crawler.storage import iter_text, read_part
+    from inverted_index.analysis import get_analyzer
+    from inverted_index.indexer import _book_language, _book_terms
+    language = _book_language(datalake, entry) if analysis != "none" else None
+    analyzer = get_analyzer(analysis, language)
+    if streamed:
+        return _traced_peak_kb(lambda: _book_terms(iter_text(datalake, entry, "body"), analyzer, postings_format))
+    return _traced_peak_kb(lambda: _book_terms([read_part(datalake, entry, "body")], analyzer, postings_format))
+
+
+def stage_book_memory(datalake: str, postings_format: str, analysis: str, sample: int = BOOK_MEMORY_SAMPLE):
+    import tracemalloc
+    from crawler.manifest import read_entries
+
+    entries = sorted((entry for entry, _ in read_entries(datalake, 0)), key=lambda e: -e.get("size", 0))[:sample]
+    streamed, materialized = [], []
+    tracemalloc.start()
+    try:
+        for entry in entries:
+            streamed.append(_book_terms_peak_kb(datalake, entry, postings_format, analysis, True))
+            materialized.append(_book_terms_peak_kb(datalake, entry, postings_format, analysis, False))
+    finally:
+        tracemalloc.stop()
+    if not entries:
+        return {"books": 0}
+    return {
+        "books": len(entries),
+        "postings": postings_format,
+        "largest_book_mb": round(entries[0].get("size", 0) / (1024 * 1024), 2),
+        "peak_kb_max": round(max(streamed), 1),
+        "peak_kb_avg": round(sum(streamed) / len(streamed), 1),
+        "materialized_peak_kb_max": round(max(materialized), 1),
+        "materialized_peak_kb_avg": round(sum(materialized) / len(materialized), 1),
+    }
+
+
+def stage_metadata(datalake: str, work: str, workers: int):
+    from inverted_index.metadata_parser import build_metadata_catalog
+    changed = build_metadata_catalog(datalake, f"{work}/catalog.jsonl", f"{work}/progress_parser.json", workers)
+    return {"records": len(changed)}
+
+
+def stage_datamart(work: str):
+    from inverted_index.datamart_initializer_sqlite import init_datamart
+    from inverted_index.metadata_store import run
+    init_datamart(f"{work}/datamart.db")
+    return run(f"{work}/catalog.jsonl", f"{work}/datamart.db", full=True)
+
+
+def stage_binary(work: str):
+    from inverted_index.binary_index import export_binary
+    export_binary(f"{work}/index/segments", f"{work}/index/inverted_index.bin")
+    return {"bytes": Path(f"{work}/index/inverted_index.bin").stat().st_size}
+
+
+def stage_fts(datalake: str, work: str):
+    from inverted_index.fts_index import build_fts_index
+    return {"books": build_fts_index(datalake, f"{work}/datamart.db", f"{work}/progress_fts.json")}
+
+
+def stage_queries(index_path: str, queries: List[str], k: int, mode: str, repeat: int):
+    from inverted_index.query import QueryEngine, benchmark, load_index
+    start = time.perf_counter()
+    engine = QueryEngine(load_index(index_path))
+    load_seconds = time.perf_counter() - start
+    result = benchmark(engine, queries, k, mode, repeat)
+    result["query_seconds"] = result.pop("seconds")
+    return {"load_seconds": round(load_seconds, 4), **result}
+
+
+def _throughput(stage: dict, books: int, corpus_bytes: int) -> dict:
+    seconds = stage["seconds"]
+    stage["seconds"] = round(seconds, 4)
+    if stage.get("peak_rss_mb") is not None:
+        stage["peak_rss_mb"] = round(stage["peak_rss_mb"], 1)
+    if seconds > 0:
+        stage["books_per_s"] = round(books / seconds, 2)
+        stage["mb_per_s"] = round(corpus_bytes / (1024 * 1024) / seconds, 2)
+    return stage
+
+
+def run_benchmarks(
+    books: int = 1000,
+    seed: int = 0,
+    min_words: int = 2000,
+    max_words: int = 20000,
+    storage: str = "loose",
+    workers: int = 1,
+    postings_format: str = "freqs",
+    memory_budget_mb: Optional[float] = None,
+    analysis: str = "none",
+    queries: int = 200,
+    k: int = 10,
+    mode: str = "and",
+    repeat: int = 3,
+    fts: bool = False,
+    workdir: Optional[str] = None,
+    keep: bool = False,
+    verbose: bool = False,
+) -> Dict:
+    from benchmarks.corpus import sample_queries
+
+    work = Path(workdir or tempfile.mkdtemp(prefix="gutenberg-bench-"))
+    datalake = str(work / "datalake")
+    if Path(datalake).exists():
+        raise SystemExit(f"{datalake} already exists; pass an empty --workdir")
+    stages: Dict[str, dict] = {}
+
+    def timed(name: str, fn: Callable, *args):
+        print(f"[bench] {name} ...")
+        stages[name] = run_stage(fn, *args, quiet=not verbose)
+
+    try:
+        timed("generate", stage_generate, datalake, books, seed, min_words, max_words, storage)
+        corpus_bytes = stages["generate"]["bytes"]
+
+        timed("index", stage_index, datalake, str(work), workers, postings_format, memory_budget_mb, analysis)
+        timed("metadata", stage_metadata, datalake, str(work), workers)
+        timed("datamart", stage_datamart, str(work))
+        timed("binary_export", stage_binary, str(work))
+        if fts:
+            timed("fts", stage_fts, datalake, str(work))
+
+        for name in list(stages):
+            _throughput(stages[name], books, corpus_bytes)
+
+        timed("book_memory", stage_book_memory, datalake, postings_format, analysis)
+        query_list = sample_queries(queries, seed)
+        for label, path in (("query_segments", work / "index" / "segments"),
+                            ("query_binary", work / "index" / "inverted_index.bin")):
+            timed(label, stage_queries, str(path), query_list, k, mode, repeat)
+
+        for label in ("book_memory", "query_segments", "query_binary"):
+            stages[label]["seconds"] = round(stages[label]["seconds"], 4)
+            if stages[label].get("peak_rss_mb") is not None:
+                stages[label]["peak_rss_mb"] = round(stages[label]["peak_rss_mb"], 1)
+    finally:
+        if workdir is None and not keep:
+            shutil.rmtree(work, ignore_errors=True)
+        else:
+            print(f"[bench] Corpus and indexes kept in {work}")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "books": books, "seed": seed, "min_words": min_words, "max_words": max_words,
+            "storage": storage, "workers": workers, "postings": postings_format,
+            "memory_budget_mb": memory_budget_mb, "analysis": analysis, "queries": queries, "k": k, "mode": mode,
+            "repeat": repeat,
+        },
+        "corpus_mb": round(corpus_bytes / (1024 * 1024), 2),
+        "stages": stages,
+    }
+
+
+def print_summary(result: dict):
+    print(f"\nCorpus: {result['params']['books']} books, {result['corpus_mb']} MB (commit {result['commit']})")
+    print(f"{'stage':<16}{'seconds':>10}{'books/s':>12}{'MB/s':>10}{'qps':>12}{'p99 ms':>10}{'peak MB':>10}")
+    for name, s in result["stages"].items():
+        print(
+            f"{name:<16}{s['seconds']:>10}{s.get('books_per_s', ''):>12}{s.get('mb_per_s', ''):>10}"
+            f"{s.get('qps', ''):>12}{s.get('p99_ms', ''):>10}{s.get('peak_rss_mb') or '':>10}"
+        )
+    memory = result["stages"].get("book_memory")
+    if memory and memory.get("books"):
+        print(
+            f"Per-book tokenizer peak ({memory['postings']}) over the {memory['books']} largest books: "
+            f"{memory['peak_kb_max']} KB max, {memory['peak_kb_avg']} KB avg (whole body read first: "
+            f"{memory['materialized_peak_kb_max']} KB max, {memory['materialized_peak_kb_avg']} KB avg)"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the indexing pipeline on a synthetic corpus.")
+    ap.add_argument("--books", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--min-words", type=int, default=2000)
+    ap.add_argument("--max-words", type=int, default=20000)
+    ap.add_argument("--storage", choices=["loose", "pack"], default="loose")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--postings", choices=["docs", "freqs", "positions"], default="freqs")
+    ap.add_argument("--memory-budget-mb", type=float, default=None)
+    ap.add_argument("--analysis", choices=["none", "light"], default="none")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--mode", choices=["and", "or"], default="and")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--fts", action="store_true", help="Also time the SQLite FTS5 build")
+    ap.add_argument("--workdir", default=None, help="Where to build the corpus (kept afterwards; default: a temp dir)")
+    ap.add_argument("--keep", action="store_true", help="Keep the temp dir with the corpus and indexes")
+    ap.add_argument("--verbose", action="store_true", help="Show the stages' own output")
+    ap.add_argument("--output", type=Path, default=Path("benchmarks/results.jsonl"))
+    args = ap.parse_args()
+
+    result = run_benchmarks(
+        args.books, args.seed, args.min_words, args.max_words, args.storage, args.workers,
+        args.postings, args.memory_budget_mb, args.analysis, args.queries, args.k, args.mode, args.repeat,
+        args.fts, args.workdir, args.keep, args.verbose,
+    )
+    print_summary(result)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(f"\nResults appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Build and query throughput of the sharded index as the number of shards grows.
+
+    python -m benchmarks.shards --books 4000 --shards 1 2 4
+
+Generates one synthetic datalake, then for every shard count builds a fresh sharded
+index (all shards in parallel) and runs the query mix through the scatter-gather
+coordinator. Prints books/s and queries/s per shard count with the speed-up over the
+first one, and appends one JSON line per run to the results file.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from benchmarks.run import _git_commit
+
+
+def run(
+    books: int = 2000,
+    shard_counts: List[int] = (1, 2, 4),
+    seed: int = 0,
+    min_words: int = 2000,
+    max_words: int = 20000,
+    postings_format: str = "freqs",
+    scheme: str = "hash",
+    queries: int = 500,
+    k: int = 10,
+    mode: str = "and",
+    repeat: int = 3,
+    workdir: Optional[str] = None,
+) -> dict:
+    from benchmarks.corpus import generate_corpus, sample_queries
+    from inverted_index.shards import ShardedSearcher, build_shards
+
+    work = Path(workdir or tempfile.mkdtemp(prefix="gutenberg-shards-"))
+    datalake = str(work / "datalake")
+    results = []
+    try:
+        print(f"[shards] Generating {books} books ...")
+        corpus_bytes = generate_corpus(datalake, books, seed, min_words, max_words)["bytes"]
+        query_list = sample_queries(queries, seed) * repeat
+
+        for count in shard_counts:
+            root = work / f"shards_{count}"
+            print(f"[shards] {count} shard(s): building ...")
+            start = time.perf_counter()
+            build_shards(datalake, str(root), count, scheme, postings_format=postings_format)
+            build_seconds = time.perf_counter() - start
+
+            print(f"[shards] {count} shard(s): querying ...")
+            with ShardedSearcher(str(root)) as searcher:
+                start = time.perf_counter()
+                searcher.search_batch(query_list, k, mode)
+                query_seconds = time.perf_counter() - start
+                sizes = searcher.shard_sizes
+            results.append({
+                "shards": count,
+                "shard_books": sizes,
+                "build_seconds": round(build_seconds, 3),
+                "books_per_s": round(books / build_seconds, 2),
+                "mb_per_s": round(corpus_bytes / (1024 * 1024) / build_seconds, 2),
+                "query_seconds": round(query_seconds, 3),
+                "qps": round(len(query_list) / query_seconds, 2),
+            })
+    finally:
+        if workdir is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "params": {
+            "books": books, "seed": seed, "min_words": min_words, "max_words": max_words,
+            "postings": postings_format, "scheme": scheme, "queries": queries, "k": k, "mode": mode,
+            "repeat": repeat,
+        },
+        "corpus_mb": round(corpus_bytes / (1024 * 1024), 2),
+        "runs": results,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark build and query throughput against the number of shards.")
+    ap.add_argument("--books", type=int, default=2000)
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--min-words", type=int, default=2000)
+    ap.add_argument("--max-words", type=int, default=20000)
+    ap.add_argument("--postings", choices=["docs", "freqs", "positions"], default="freqs")
+    ap.add_argument("--scheme", choices=["hash", "range"], default="hash")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--mode", choices=["and", "or"], default="and")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workdir", default=None, help="Where to build (kept afterwards; default: a temp dir)")
+    ap.add_argument("--output", type=Path, default=Path("benchmarks/shards_results.jsonl"))
+    args = ap.parse_args()
+
+    result = run(
+        args.books, args.shards, args.seed, args.min_words, args.max_words, args.postings, args.scheme,
+        args.queries, args.k, args.mode, args.repeat, args.workdir,
+    )
+
+    print(f"\nCorpus: {args.books} books, {result['corpus_mb']} MB (commit {result['commit']})")
+    print(f"{'shards':>6}{'build s':>10}{'books/s':>10}{'speed-up':>10}{'qps':>10}{'speed-up':>10}")
+    base = result["runs"][0]
+    for r in result["runs"]:
+        print(
+            f"{r['shards']:>6}{r['build_seconds']:>10}{r['books_per_s']:>10}"
+            f"{r['books_per_s'] / base['books_per_s']:>10.2f}{r['qps']:>10}{r['qps'] / base['qps']:>10.2f}"
+        )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(f"\nResults appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
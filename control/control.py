@@ -1,81 +1,349 @@
-import time
-import sys
 import os
-import json
-from pathlib import Path
+import time
+import threading
 
 from inverted_index.metadata_store import run as store_catalog
-from crawler.cli import main as crawler_main
+from crawler.cli import url_template_for
+from crawler.engine import DownloadEngine
+from crawler.scheduler import CrawlScheduler
+from crawler.state import CrawlState
 from inverted_index import metadata_parser
 from inverted_index.datamart_initializer_sqlite import init_datamart
+from inverted_index.dedup import SignatureStore, build_signatures
+from inverted_index.index_stats import export_stats
 from inverted_index.indexer import build_inverted_index
+from inverted_index.segments import export_json, manifest_generation, start_background_merge
+from inverted_index.shards import build_shards, shard_paths
+from inverted_index.binary_index import export_binary
+from inverted_index.fts_index import build_fts_index
+from control.metrics import METRICS, log, set_verbosity
+from control.pipeline import Pipeline
+from control.watch import Watcher
 
 
 class Control:
     def __init__(
         self,
         datalake="datalake",
-        catalog="metadata/catalog.json",
+        catalog="metadata/catalog.jsonl",
         progress_parser="metadata/progress_parser.json",
         db="datamart/datamart.db",
         index_output="index/inverted_index.json",
+        index_segments="index/segments",
+        json_export=False,
+        binary_output=None,
         progress_indexer="indexer/progress.json",
         progress_crawler="crawler/progress.json",
         batch_size=10,
         sleep_seconds=120,
+        crawl_schedule="adaptive",
+        max_batch_size=200,
+        min_sleep_seconds=1.0,
+        target_latency=5.0,
+        gap_limit=100,
+        workers=1,
+        postings_format="docs",
+        memory_budget_mb=None,
+        analysis="none",
+        shards=1,
+        shard_scheme="hash",
+        shard_range_size=25000,
+        shards_dir="index/shards",
+        crawler_concurrency=4,
+        crawl_rate=5.0,
+        base_url=None,
+        pipelined=False,
+        queue_size=64,
+        watch=False,
+        crawl_only=False,
+        watch_window=2.0,
+        watch_max_batch=256,
+        full_rebuild=False,
+        fts=False,
+        progress_fts="indexer/progress_fts.json",
+        dedup=False,
+        skip_duplicates=False,
+        dedup_threshold=0.8,
+        dedup_db="index/signatures.db",
+        progress_dedup="indexer/progress_dedup.json",
+        storage="loose",
+        metrics_file=None,
+        metrics_log=None,
+        verbosity=1,
+        crawler_state="crawler/state.db",
+        missing_ttl_hours=168.0,
+        refresh_batch=0,
+        refresh_after_hours=24.0,
     ):
         self.datalake = datalake
         self.catalog = catalog
         self.progress_parser = progress_parser
         self.db = db
         self.index_output = index_output
+        self.index_segments = index_segments
+        self.json_export = json_export
+        self.binary_output = binary_output
+        self._merge_threads = {}
+        # Export path -> segments manifest generation it was last written from
+        self._published = {}
         self.progress_indexer = progress_indexer
         self.progress_crawler = progress_crawler
         self.batch_size = batch_size
         self.sleep_seconds = sleep_seconds
+        self.crawl_schedule = crawl_schedule
+        self.max_batch_size = max_batch_size
+        self.min_sleep_seconds = min_sleep_seconds
+        self.target_latency = target_latency
+        self.gap_limit = gap_limit
+        self._scheduler = None
+        self.workers = workers
+        self.postings_format = postings_format
+        self.memory_budget_mb = memory_budget_mb
+        self.analysis = analysis
+        self.shards = shards
+        self.shard_scheme = shard_scheme
+        self.shard_range_size = shard_range_size
+        self.shards_dir = shards_dir
+        self.crawler_concurrency = crawler_concurrency
+        self.crawl_rate = crawl_rate
+        self.base_url = base_url
+        self.pipelined = pipelined
+        self.watch = watch
+        self.crawl_only = crawl_only
+        self.watch_window = watch_window
+        self.watch_max_batch = watch_max_batch
+        self.queue_size = queue_size
+        self.full_rebuild = full_rebuild
+        self.fts = fts
+        self.progress_fts = progress_fts
+        self.dedup = dedup or skip_duplicates
+        self.skip_duplicates = skip_duplicates
+        self.dedup_threshold = dedup_threshold
+        self.dedup_db = dedup_db
+        self.progress_dedup = progress_dedup
+        self._signatures = None
+        self.storage = storage
+        self.metrics_file = metrics_file
+        self.metrics_log = metrics_log
+        self._metrics_lock = threading.Lock()
+        self.cycle = 0
+        self.crawler_state = crawler_state
+        self.missing_ttl_hours = missing_ttl_hours
+        self.refresh_batch = refresh_batch
+        self.refresh_after_hours = refresh_after_hours
+        self._state = None
+        set_verbosity(verbosity)
+
+    def _crawl_state(self) -> CrawlState:
+        if self._state is None:
+            self._state = CrawlState(self.crawler_state, self.missing_ttl_hours * 3600)
+        return self._state
+
+    @property
+    def scheduler(self) -> CrawlScheduler:
+        if self._scheduler is None:
+            self._scheduler = CrawlScheduler(
+                progress_path=self.progress_crawler,
+                state=self._crawl_state(),
+                batch_size=self.batch_size,
+                pause=self.sleep_seconds,
+                adaptive=self.crawl_schedule == "adaptive",
+                max_batch=self.max_batch_size,
+                min_pause=self.min_sleep_seconds,
+                target_latency=self.target_latency,
+                gap_limit=self.gap_limit,
+                refresh_batch=self.refresh_batch,
+                refresh_after=self.refresh_after_hours * 3600,
+            )
+        return self._scheduler
+
+    def make_engine(self) -> DownloadEngine:
+        return DownloadEngine(
+            concurrency=self.crawler_concurrency,
+            rate=self.crawl_rate,
+            datalake=self.datalake,
+            url_template=url_template_for(self.base_url),
+            storage=self.storage,
+            state=self._crawl_state(),
+        )
+
+    def crawl_batch(self, engine: DownloadEngine, on_result=None):
+        """
+        Downloads the next batch chosen by the crawl scheduler (retries due, new IDs and
+        stale books to refresh) and feeds the outcome back to it.
+        """
+        ids, recheck = self.scheduler.next_batch()
+        if not ids:
+            log(1, "Nothing to crawl: end of the catalog reached and no retries due.")
+            return []
+        start = time.perf_counter()
+        with METRICS.stage("crawler"):
+            results = engine.download_many(ids, on_result=on_result, recheck=recheck)
+        self._log_results(f"Crawled {self.scheduler.describe(ids)}", results)
+        self.scheduler.record(results, engine.last_stats, time.perf_counter() - start)
+        return results
+
+    def _log_results(self, title: str, results):
+        for res in results:
+            outcome = res.get("header_path") or res.get("reason") or "unchanged"
+            log(2, f"[{'OK' if res.get('ok') else 'FAIL'}] {res['book_id']} -> {outcome}")
+        stored = sum(1 for res in results if res.get("ok") and not res.get("unchanged"))
+        unchanged = sum(1 for res in results if res.get("unchanged"))
+        skipped = sum(1 for res in results if res.get("skipped"))
+        failed = len(results) - stored - unchanged - skipped
+        log(1, f"{title}: {stored} stored, {unchanged} unchanged, {skipped} known missing, {failed} failed")
+
+    def index_step(self):
+        if self.dedup:
+            # Before the indexer, so it already knows which of the new books are duplicates
+            with METRICS.stage("dedup"):
+                build_signatures(
+                    self.datalake, self.dedup_db, self.progress_dedup, self.dedup_threshold, self.workers,
+                    store=self.signatures,
+                )
+        with METRICS.stage("indexer"):
+            self._build_index()
+        if self.fts:
+            with METRICS.stage("fts"):
+                build_fts_index(self.datalake, self.db, self.progress_fts)
+
+    @property
+    def signatures(self) -> SignatureStore:
+        if self._signatures is None:
+            self._signatures = SignatureStore(self.dedup_db, self.dedup_threshold)
+        return self._signatures
+
+    def _build_index(self):
+        if self.shards > 1:
+            build_shards(
+                self.datalake, self.shards_dir, self.shards, self.shard_scheme, self.shard_range_size,
+                self.workers, self.postings_format, self.memory_budget_mb, self.analysis,
+                self.dedup_db if self.skip_duplicates else None,
+            )
+            return
+        build_inverted_index(
+            datalake_path=self.datalake,
+            output_path=self.index_output,
+            progress_path=self.progress_indexer,
+            segments_path=self.index_segments,
+            workers=self.workers,
+            postings_format=self.postings_format,
+            memory_budget_mb=self.memory_budget_mb,
+            analysis=self.analysis,
+            book_filter=self.signatures.should_index if self.skip_duplicates else None,
+        )
+
+    def publish_index(self):
+        with METRICS.stage("publish"):
+            self._publish_index()
+
+    def _publish_index(self):
+        if self.shards > 1:
+            # Each shard is searched in place (inverted_index.shards); a single export would mix them
+            for i in range(self.shards):
+                self._merge(str(shard_paths(self.shards_dir, i)["segments"]))
+            return
+        self._merge(self.index_segments)
+        generation = manifest_generation(self.index_segments)
+        if self.json_export:
+            self._export(export_json, self.index_output, generation)
+            # The Java service reads N and document frequencies from stats.json next to it
+            self._export(export_stats, os.path.join(os.path.dirname(self.index_output), "stats.json"), generation)
+        if self.binary_output:
+            self._export(export_binary, self.binary_output, generation)
+
+    def _export(self, export, output: str, generation):
+        # The same segments give the same export; rewriting it would only cost a full pass
+        if self._published.get(output) == generation and os.path.exists(output):
+            log(2, f"Index unchanged, {output} is up to date")
+            return
+        words = export(self.index_segments, output)
+        self._published[output] = generation
+        log(1, f"Exported {words} words to {output}")
 
-    def load_crawler_progress(self):
-        if os.path.exists(self.progress_crawler):
-            with open(self.progress_crawler, "r", encoding="utf-8") as f:
-                return json.load(f).get("last_id", 0)
-        return 0
+    def _merge(self, segments_dir: str):
+        thread = self._merge_threads.get(segments_dir)
+        if thread is None or not thread.is_alive():
+            self._merge_threads[segments_dir] = start_background_merge(segments_dir)
 
-    def save_crawler_progress(self, last_id: int):
-        progress_file = Path(self.progress_crawler)
-        progress_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(progress_file, "w", encoding="utf-8") as f:
-            json.dump({"last_id": last_id}, f, indent=2)
+    def metadata_step(self):
+        full, self.full_rebuild = self.full_rebuild, False
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        def store(records):
+            # Called for each parsed batch before the parser commits it, so rows that
+            # fail to reach 'books' are parsed and offered again next cycle
+            with METRICS.stage("datamart"):
+                for result, n in store_catalog(self.catalog, self.db, records=records).items():
+                    counts[result] += n
+
+        with METRICS.stage("metadata"):
+            changed = metadata_parser.build_metadata_catalog(
+                datalake_path=self.datalake,
+                output_path=self.catalog,
+                progress_path=self.progress_parser,
+                workers=self.workers,
+                store=store,
+            )
+        if full:
+            with METRICS.stage("datamart"):
+                counts = store_catalog(self.catalog, self.db, full=True)
+        elif not changed:
+            log(1, "No new or changed metadata for 'books'.")
+            return
+        log(
+            1,
+            f"Stored 'books': {counts['inserted']} inserted, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged{' (full rebuild)' if full else ''}."
+        )
+
+    def export_metrics(self):
+        """
+        Ends a cycle: writes the Prometheus text file and/or appends a JSON line with the
+        cumulative metrics, if configured.
+        """
+        with self._metrics_lock:
+            self.cycle += 1
+            METRICS.inc("cycles_total")
+            if self.metrics_file:
+                METRICS.write_prometheus(self.metrics_file)
+            if self.metrics_log:
+                METRICS.append_jsonl(self.metrics_log, cycle=self.cycle)
 
     def run(self):
         print("[Initializing datamart...]")
         init_datamart(self.db)
 
+        if self.pipelined:
+            Pipeline(self, queue_size=self.queue_size).run()
+            return
+        if self.watch:
+            Watcher(self, batch_window=self.watch_window, max_batch=self.watch_max_batch).run()
+            return
+
+        engine = self.make_engine()
+
         while True:
             print("\n[Cycle] Starting new processing cycle...\n")
 
-            print("[1/3] Running crawler (batch of 10 books)...")
-            last_id = self.load_crawler_progress()
-            start_id = last_id + 1
-            end_id = start_id + self.batch_size - 1
-            sys.argv = ["crawler.py", "--range", str(start_id), str(end_id)]
-            crawler_main()
-            self.save_crawler_progress(end_id)
+            print(f"[1/3] Running crawler (batch of {self.scheduler.batch_size} books)...")
+            self.crawl_batch(engine)
+            if self.crawl_only:
+                # Indexing is left to a `--watch` process following the manifest
+                self.export_metrics()
+                pause = self.scheduler.next_pause()
+                print(f"Batch completed. Sleeping {pause:.1f} seconds...\n")
+                time.sleep(pause)
+                continue
 
             print("[2/3] Running indexer...")
-            build_inverted_index(
-                datalake_path=self.datalake,
-                output_path=self.index_output,
-                progress_path=self.progress_indexer
-            )
+            self.index_step()
+            self.publish_index()
 
             print("[3/3] Running metadata parser...")
-            metadata_parser.build_metadata_catalog(
-                datalake_path=self.datalake,
-                output_path=self.catalog,
-                progress_path=self.progress_parser,
-            )
-            affected = store_catalog(self.catalog, self.db)
-            print(f"Stored ~{affected} rows in 'books'.")
+            self.metadata_step()
 
-            print(f"Cycle completed. Sleeping {self.sleep_seconds // 60} minutes...\n")
-            time.sleep(self.sleep_seconds)
\ No newline at end of file
+            self.export_metrics()
+            pause = self.scheduler.next_pause()
+            print(f"Cycle completed. Sleeping {pause:.1f} seconds...\n")
+            time.sleep(pause)
@@ -0,0 +1,189 @@
+"""
+Process-wide metrics for the pipeline and the verbosity switch for progress output.
+
+Stages record into the shared METRICS registry (counters, gauges and histograms with
+labels); Control exports it every cycle as a Prometheus text file (atomically replaced,
+for node_exporter's textfile collector or any scraper) and/or as one JSON line per cycle.
+
+Verbosity levels for `log`:
+  0  errors and cycle summaries only
+  1  per-batch progress (default)
+  2  per-book lines ("Indexed book with ID ...")
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+PREFIX = "gutenberg_"
+
+HTTP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "stage_seconds_total": ("counter", "Wall time spent in each stage"),
+    "stage_last_seconds": ("gauge", "Wall time of the last run of each stage"),
+    "stage_runs_total": ("counter", "Number of runs of each stage"),
+    "books_processed_total": ("counter", "Books handled by each stage"),
+    "bytes_read_total": ("counter", "Bytes read by each stage"),
+    "bytes_written_total": ("counter", "Bytes written by each stage"),
+    "books_skipped_total": ("counter", "Books skipped without storing (unchanged, known missing)"),
+    "failures_total": ("counter", "Failed books by stage and reason"),
+    "http_request_seconds": ("histogram", "Latency of crawler HTTP requests"),
+    "http_retries_total": ("counter", "Crawler HTTP retries by host"),
+    "datamart_rows_total": ("counter", "Datamart upserts by result"),
+    "cycles_total": ("counter", "Completed Control cycles"),
+    "peak_rss_mb": ("gauge", "Peak resident set size of the process since it started, in MB, as of the stage's last run"),
+    "crawl_batch_size": ("gauge", "Size of the next crawler batch (adaptive scheduler)"),
+    "crawl_pause_seconds": ("gauge", "Pause before the next crawler batch"),
+    "crawl_retry_queue": ("gauge", "IDs waiting to be retried by the crawler"),
+    "index_lag_seconds": ("histogram", "Seconds from a book being stored to its segment being published (watch mode)"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+VERBOSITY = 1
+
+
+def set_verbosity(level: int) -> None:
+    global VERBOSITY
+    VERBOSITY = level
+
+
+def log(level: int, message: str) -> None:
+    if level <= VERBOSITY:
+        print(message)
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def failure_reason(reason: str) -> str:
+    """
+    Collapses a result's reason into a low-cardinality label:
+    "http_error:404" stays as is, exception messages keep only their prefix.
+    """
+    head, _, tail = (reason or "unknown").partition(":")
+    return f"{head}:{tail}" if tail.isdigit() else head
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], dict] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, buckets=HTTP_BUCKETS, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            i = bisect_left(h["buckets"], value)
+            if i < len(h["counts"]):
+                h["counts"][i] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a block as one run of stage `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.inc("stage_seconds_total", seconds, stage=name)
+            self.inc("stage_runs_total", stage=name)
+            self.set("stage_last_seconds", seconds, stage=name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            def flat(d):
+                return [{"name": n, "labels": dict(lb), "value": v} for (n, lb), v in sorted(d.items())]
+            return {
+                "counters": flat(self.counters),
+                "gauges": flat(self.gauges),
+                "histograms": [
+                    {"name": n, "labels": dict(lb), "buckets": list(h["buckets"]), "counts": list(h["counts"]),
+                     "sum": h["sum"], "count": h["count"]}
+                    for (n, lb), h in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            series = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                series.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                series.setdefault(name, []).append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                lines = series.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(h["buckets"], h["counts"]):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {h['count']}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {h['sum']:g}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {h['count']}")
+
+        out = []
+        for name in sorted(series):
+            kind, text = HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {PREFIX}{name} {text}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        p = Path(path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + ".tmp")
+        tmp.write_text(self.to_prometheus(), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def append_jsonl(self, path: str, **fields) -> None:
+        p = Path(path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        record = {"time": time.time(), **fields, **self.snapshot()}
+        with open(p, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+METRICS = Metrics()
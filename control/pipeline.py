@@ -0,0 +1,133 @@
+import queue
+import signal
+import threading
+import time
+
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs the Control stages concurrently instead of one after another:
+
+        crawler --(index_q)--> indexer
+                --(meta_q)---> metadata parser + datamart store
+
+    Every successfully downloaded book is pushed onto both bounded queues as soon as it is
+    stored. When a consumer falls behind its queue fills up and the download threads block
+    (backpressure). Consumers micro-batch what is queued and then run their usual incremental
+    step, which picks the new books up from the datalake manifest, so progress files and
+    resume behave exactly as in the sequential loop.
+
+    Metrics are exported after every crawler batch, which counts as a cycle. The pause between
+    crawler batches and their size come from the crawl scheduler (crawler/scheduler.py).
+
+    Ctrl+C / SIGTERM stops the crawler after its current batch; the consumers then drain
+    their queues and exit.
+    """
+
+    def __init__(self, control, queue_size: int = 64, batch_window: float = 2.0, max_batch: int = 256):
+        self.control = control
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.stop = threading.Event()
+        self.index_q = queue.Queue(maxsize=queue_size)
+        self.meta_q = queue.Queue(maxsize=queue_size)
+
+    def _publish(self, res: dict):
+        if not res.get("ok") or res.get("unchanged"):
+            return
+        self.index_q.put(res)
+        self.meta_q.put(res)
+
+    def crawl_stage(self):
+        engine = self.control.make_engine()
+        try:
+            while not self.stop.is_set():
+                print(f"[crawler] Downloading batch of {self.control.scheduler.batch_size} books...")
+                self.control.crawl_batch(engine, on_result=self._publish)
+                self.control.export_metrics()
+                self.stop.wait(self.control.scheduler.next_pause())
+        finally:
+            engine.close()
+            self.index_q.put(_DONE)
+            self.meta_q.put(_DONE)
+
+    def _next_batch(self, q: queue.Queue):
+        """
+        Blocks for one item, then collects more for up to `batch_window` seconds.
+        Returns (items, done).
+        """
+        first = q.get()
+        if first is _DONE:
+            return [], True
+        items = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def consume_stage(self, name: str, q: queue.Queue, step, when_idle=None):
+        done = False
+        while not done:
+            items, done = self._next_batch(q)
+            if not items:
+                continue
+            print(f"[{name}] Processing {len(items)} new books...")
+            try:
+                step()
+                if when_idle and (done or q.empty()):
+                    when_idle()
+            except Exception as e:
+                # Keep consuming so the crawler is never blocked on a dead stage. Each
+                # stage commits its cursor only after its output is written, so the
+                # failed books are picked up again when the next batch runs the step.
+                print(f"[{name}] Error: {e!r}")
+        print(f"[{name}] Stopped.")
+
+    def _request_stop(self, *_args):
+        if not self.stop.is_set():
+            print("\n[Pipeline] Stopping after the current batch...")
+        self.stop.set()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.crawl_stage, name="crawler"),
+            threading.Thread(
+                target=self.consume_stage,
+                args=("indexer", self.index_q, self.control.index_step, self.control.publish_index),
+                name="indexer",
+            ),
+            threading.Thread(
+                target=self.consume_stage,
+                args=("metadata", self.meta_q, self.control.metadata_step),
+                name="metadata",
+            ),
+        ]
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._request_stop)
+
+        print("[Pipeline] Starting crawler, indexer and metadata stages...")
+        for t in threads:
+            t.start()
+
+        while any(t.is_alive() for t in threads):
+            try:
+                for t in threads:
+                    t.join(timeout=0.5)
+            except KeyboardInterrupt:
+                self._request_stop()
+        self.control.export_metrics()
+        print("[Pipeline] All stages stopped.")
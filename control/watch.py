@@ -0,0 +1,105 @@
+"""
+Watch mode: index books as soon as the crawler stores them.
+
+The crawler appends one line per stored book to datalake/manifest.jsonl, so the
+manifest already is an event log that works across processes (and on Windows, unlike
+Unix sockets). The watcher follows it with a cheap size check every `poll_interval`
+seconds; when lines appear it keeps collecting for up to `batch_window` seconds or
+`max_batch` books, then runs the usual incremental index, publish and metadata steps.
+Those read the new entries from their own saved cursors, so resume and crash recovery
+behave exactly as in the polling loop.
+
+    python main.py --watch                 # this process only indexes
+    python main.py --crawl-only            # in another process: only downloads
+
+The time from a book being stored ("stored_at" in its manifest entry) to its segment
+being published is recorded in the index_lag_seconds histogram.
+"""
+
+import signal
+import threading
+import time
+from typing import List, Tuple
+
+from crawler.manifest import complete_size, manifest_path, read_entries
+from control.metrics import METRICS, log
+
+LAG_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Watcher:
+    def __init__(self, control, batch_window: float = 2.0, max_batch: int = 256, poll_interval: float = 0.25):
+        self.control = control
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.stop = threading.Event()
+        self.manifest = manifest_path(control.datalake)
+
+    def _size(self) -> int:
+        try:
+            return self.manifest.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def collect(self, offset: int) -> Tuple[List[dict], int]:
+        """
+        Blocks until entries are appended after byte `offset`, then gathers more for up
+        to `batch_window` seconds or `max_batch` entries. Returns (entries, new offset);
+        no entries if stopped first.
+        """
+        entries: List[dict] = []
+        deadline = None
+        while not self.stop.is_set():
+            if self._size() > offset:
+                new = read_entries(self.control.datalake, offset)
+                if new:
+                    entries.extend(entry for entry, _ in new)
+                    offset = new[-1][1]
+                    if deadline is None:
+                        deadline = time.monotonic() + self.batch_window
+            if entries and (len(entries) >= self.max_batch or time.monotonic() >= deadline):
+                break
+            self.stop.wait(self.poll_interval)
+        return entries, offset
+
+    def process(self, entries: List[dict]):
+        start = time.perf_counter()
+        try:
+            self.control.index_step()
+            self.control.publish_index()
+            now = time.time()
+            for entry in entries:
+                if "stored_at" in entry:
+                    METRICS.observe("index_lag_seconds", max(0.0, now - entry["stored_at"]), buckets=LAG_BUCKETS)
+            self.control.metadata_step()
+        except Exception as e:
+            # The books stay in the manifest; the next batch picks them up again
+            print(f"[watch] Error: {e!r}")
+        self.control.export_metrics()
+        log(1, f"[watch] Indexed and published in {time.perf_counter() - start:.2f}s")
+
+    def _request_stop(self, *_args):
+        if not self.stop.is_set():
+            print("\n[watch] Stopping...")
+        self.stop.set()
+
+    def run(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._request_stop)
+
+        # Whatever was stored while nobody was watching
+        offset = complete_size(self.control.datalake)
+        print("[watch] Catching up with the datalake...")
+        self.process([])
+
+        print(f"[watch] Following {self.manifest} (window {self.batch_window}s, up to {self.max_batch} books)")
+        try:
+            while not self.stop.is_set():
+                entries, offset = self.collect(offset)
+                if entries:
+                    print(f"[watch] {len(entries)} new books")
+                    self.process(entries)
+        except KeyboardInterrupt:
+            self._request_stop()
+        print("[watch] Stopped.")
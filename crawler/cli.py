@@ -1,8 +1,21 @@
 import argparse
 from pathlib import Path
+from .config import DATALAKE, GUT_URL, MISSING_TTL_S, STORAGE
+from .storage import STORAGE_MODES
 from .downloader import download_book_to_datalake
+from .engine import DownloadEngine
+from .scheduler import CrawlScheduler
+from .state import CrawlState
 import time
 
+def url_template_for(base_url: str) -> str:
+    if not base_url:
+        return GUT_URL
+    return base_url.rstrip("/") + "/cache/epub/{id}/pg{id}.txt"
+
+def print_result(res: dict):
+    print(f"[{'OK' if res.get('ok') else 'FAIL'}] {res['book_id']} -> {res.get('header_path') or res.get('reason') or 'unchanged'}")
+
 def main():
     ap = argparse.ArgumentParser(description="Crawler Stage 1.")
     g = ap.add_mutually_exclusive_group(required=True)
@@ -10,27 +23,51 @@ def main():
     g.add_argument("--range", nargs=2, type=int, metavar=("INICIO", "FIN"), help="Rango inclusivo de IDs (ej. 100 110)")
     g.add_argument("--list", type=Path, help="Fichero con un ID por línea")
     g.add_argument("--continuous", action="store_true", help="Run continuously downloading batches of books")
+    g.add_argument("--refresh", type=int, metavar="N", help="Revisar los N libros guardados más antiguos (requiere --state)")
+    ap.add_argument("--concurrency", type=int, default=1, help="Descargas simultáneas (>1 usa el motor concurrente)")
+    ap.add_argument("--rate", type=float, default=5.0, help="Máximo de peticiones por segundo (modo concurrente)")
+    ap.add_argument("--retry-budget", type=int, default=20, help="Reintentos máximos por host y lote (modo concurrente)")
+    ap.add_argument("--base-url", default=None, help="Servidor alternativo (ej. http://127.0.0.1:8000)")
+    ap.add_argument("--datalake", type=Path, default=DATALAKE, help="Directorio raíz del datalake")
+    ap.add_argument("--state", type=Path, default=None, help="Base de datos de estado por ID (peticiones condicionales, 404 conocidos)")
+    ap.add_argument("--missing-ttl-hours", type=float, default=MISSING_TTL_S / 3600, help="Horas sin volver a pedir IDs con 404")
+    ap.add_argument("--storage", choices=STORAGE_MODES, default=STORAGE, help="Ficheros sueltos o un pack comprimido por hora")
+    ap.add_argument("--progress", type=Path, default=None, help="Cursor y cola de reintentos de --continuous (para reanudar)")
+    ap.add_argument("--batch-size", type=int, default=10, help="Tamaño inicial del lote en --continuous")
+    ap.add_argument("--sleep-seconds", type=float, default=120, help="Pausa máxima entre lotes en --continuous")
 
     args = ap.parse_args()
+    if args.refresh and not args.state:
+        ap.error("--refresh requiere --state")
+    state = CrawlState(args.state, args.missing_ttl_hours * 3600) if args.state else None
     ok, ko = 0, 0
     ids = []
 
     if args.continuous:
-        book_id = 1
-        consecutive_fails = 0
-        while True:
-            for _ in range(10):
-                res = download_book_to_datalake(book_id)
-                print(f"[{'OK' if res.get('ok') else 'FAIL'}] {book_id} -> {res.get('header_path', res.get('reason'))}")
-                ok += res.get("ok", False)
-                ko += not res.get("ok", False)
-                consecutive_fails = 0 if res.get("ok") else consecutive_fails + 1
-                if consecutive_fails >= 10:
-                    print(f"Stopping after {consecutive_fails} consecutive failures.\nResumen: OK={ok}  FAIL={ko}")
-                    return
-                book_id += 1
-            print("Batch completed. Sleeping 2 minutes...\n")
-            time.sleep(60*2)
+        # Runs until Ctrl+C: the scheduler sizes the batches and steps over missing IDs
+        scheduler = CrawlScheduler(args.progress, state, args.batch_size, args.sleep_seconds)
+        with DownloadEngine(
+            concurrency=args.concurrency,
+            rate=args.rate,
+            retry_budget=args.retry_budget,
+            datalake=args.datalake,
+            url_template=url_template_for(args.base_url),
+            storage=args.storage,
+            state=state,
+        ) as engine:
+            try:
+                while True:
+                    ids, recheck = scheduler.next_batch()
+                    start = time.perf_counter()
+                    results = engine.download_many(ids, on_result=print_result, recheck=recheck)
+                    scheduler.record(results, engine.last_stats, time.perf_counter() - start)
+                    ok += sum(1 for res in results if res.get("ok"))
+                    ko += sum(1 for res in results if not res.get("ok"))
+                    pause = scheduler.next_pause()
+                    print(f"Batch completed. Sleeping {pause:.1f} seconds...\n")
+                    time.sleep(pause)
+            except KeyboardInterrupt:
+                print(f"\nResumen: OK={ok}  FAIL={ko}")
     else:
         if args.id is not None:
             ids = [args.id]
@@ -38,12 +75,29 @@ def main():
             ids = list(range(args.range[0], args.range[1] + 1))
         elif args.list:
             ids = [int(x) for x in args.list.read_text(encoding="utf-8").splitlines() if x.strip()]
+        elif args.refresh:
+            ids = state.stale_books(0, args.refresh)
 
-        for bid in ids:
-            res = download_book_to_datalake(bid)
-            print(f"[{'OK' if res.get('ok') else 'FAIL'}] {bid} -> {res.get('header_path', res.get('reason'))}")
-            ok += res.get("ok", False)
-            ko += not res.get("ok", False)
+        url_template = url_template_for(args.base_url)
+        if args.concurrency > 1 or state is not None:
+            with DownloadEngine(
+                concurrency=args.concurrency,
+                rate=args.rate,
+                retry_budget=args.retry_budget,
+                datalake=args.datalake,
+                url_template=url_template,
+                storage=args.storage,
+                state=state,
+            ) as engine:
+                results = engine.download_many(ids, on_result=print_result)
+            ok = sum(1 for res in results if res.get("ok"))
+            ko = len(results) - ok
+        else:
+            for bid in ids:
+                res = download_book_to_datalake(bid, datalake=args.datalake, url_template=url_template, storage=args.storage)
+                print_result(res)
+                ok += res.get("ok", False)
+                ko += not res.get("ok", False)
 
         print(f"\nResumen: OK={ok}  FAIL={ko}")
 
@@ -4,6 +4,9 @@ ROOT = Path(__file__).resolve().parents[1]
 
 DATALAKE = ROOT / "datalake"
 
+# "loose" (two .txt files per book) or "pack" (one compressed pack per hour folder)
+STORAGE = "loose"
+
 GUT_URL = "https://www.gutenberg.org/cache/epub/{id}/pg{id}.txt"
 
 START_MARKERS = [
@@ -15,5 +18,17 @@ END_MARKERS = [
     "***END OF THE PROJECT GUTENBERG EBOOK",
 ]
 
+# Per-ID crawl state; IDs that answered 404 are not asked again for MISSING_TTL_S
+STATE_DB = ROOT / "crawler" / "state.db"
+MISSING_TTL_S = 7 * 24 * 3600
+
 MAX_RETRIES = 4
 TIMEOUT_S = 30
+
+# Crawl scheduler (crawler/scheduler.py)
+MAX_BATCH_SIZE = 200
+TARGET_LATENCY_S = 5.0
+# This many missing IDs in a row past the highest stored book mark the end of the catalog
+GAP_LIMIT = 100
+# How often the end of the catalog is probed again for new releases
+FRONTIER_RECHECK_S = 3600
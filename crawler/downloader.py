@@ -1,48 +1,97 @@
 from pathlib import Path
 import requests
 
-from .config import DATALAKE, GUT_URL, MAX_RETRIES, TIMEOUT_S
+from control.metrics import METRICS
+from .config import DATALAKE, GUT_URL, MAX_RETRIES, STORAGE, TIMEOUT_S
 from .utils import now_parts_utc, ensure_parents, backoff
 from .parsing import split_gutenberg
+from .manifest import append_entry, body_hash, ensure_manifest, make_entry, make_pack_entry
+from .state import MISSING_STATUS
+from .storage import PACK_NAME, append_pack_index, append_to_pack
 
 class DownloadError(Exception):
     pass
 
-def download_book_to_datalake(book_id: int) -> dict:
-    ymd, hh = now_parts_utc()
-    out_dir = DATALAKE / ymd / hh
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    url = GUT_URL.format(id=book_id)
-
-    text = None
-    for attempt in range(MAX_RETRIES):
-        try:
-            r = requests.get(url, timeout=TIMEOUT_S)
-            r.raise_for_status()
-            text = r.text
-            break
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                return {"ok": False, "book_id": book_id, "reason": f"http_error:{e}"}
-            backoff(attempt)
-
+def store_book(book_id: int, text: str, datalake: Path = DATALAKE, storage: str = STORAGE,
+               known_hash: str = None) -> dict:
+    """
+    Splits a raw Gutenberg text, writes header/body into datalake/YYYYMMDD/HH
+    (two loose files, or appended to the hour's pack with storage="pack")
+    and records the book in the datalake manifest.
+    Nothing is written when the body's hash equals `known_hash` (the stored copy).
+    """
     split = split_gutenberg(text)
     if not split:
         return {"ok": False, "book_id": book_id, "reason": "markers_not_found"}
 
     header, body, _footer = split
+    body_bytes = body.encode("utf-8")
+    digest = body_hash(body_bytes)
+    if digest == known_hash:
+        return {"ok": True, "book_id": book_id, "unchanged": True, "hash": digest}
+
+    # Existing loose books must be in the manifest before this one is appended
+    ensure_manifest(datalake)
+
+    ymd, hh = now_parts_utc()
+    out_dir = Path(datalake) / ymd / hh
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    header_bytes = header.encode("utf-8")
+    size = len(body_bytes) + len(header_bytes)
+    METRICS.inc("bytes_written_total", size, stage="crawler")
+
+    if storage == "pack":
+        pack_path = out_dir / PACK_NAME
+        refs = append_to_pack(out_dir, header_bytes, body_bytes)
+        entry = make_pack_entry(datalake, book_id, ymd, hh, pack_path, refs, size, digest)
+        append_pack_index(out_dir, entry)
+        append_entry(datalake, entry)
+        return {
+            "ok": True,
+            "book_id": book_id,
+            "header_path": f"{pack_path}@{refs['header'][0]}",
+            "body_path": f"{pack_path}@{refs['body'][0]}",
+            "hash": digest,
+        }
 
     body_path = out_dir / f"{book_id}_body.txt"
     header_path = out_dir / f"{book_id}_header.txt"
 
     ensure_parents(body_path)
-    body_path.write_text(body, encoding="utf-8")
-    header_path.write_text(header, encoding="utf-8")
+    body_path.write_bytes(body_bytes)
+    header_path.write_bytes(header_bytes)
+
+    append_entry(datalake, make_entry(
+        datalake, book_id, ymd, hh, header_path, body_path, size, digest,
+    ))
 
     return {
         "ok": True,
         "book_id": book_id,
         "header_path": str(header_path),
         "body_path": str(body_path),
+        "hash": digest,
     }
+
+def download_book_to_datalake(book_id: int, session=None, datalake: Path = DATALAKE, url_template: str = GUT_URL,
+                              storage: str = STORAGE) -> dict:
+    url = url_template.format(id=book_id)
+    http = session or requests
+
+    text = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            r = http.get(url, timeout=TIMEOUT_S)
+            if r.status_code in MISSING_STATUS:
+                # Unused IDs are permanent; retrying them only burns time
+                return {"ok": False, "book_id": book_id, "reason": f"http_error:{r.status_code}"}
+            r.raise_for_status()
+            text = r.text
+            break
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                return {"ok": False, "book_id": book_id, "reason": f"http_error:{e}"}
+            backoff(attempt)
+
+    return store_book(book_id, text, datalake, storage)
@@ -0,0 +1,301 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Collection, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from control.metrics import METRICS, failure_reason
+from .config import DATALAKE, GUT_URL, MAX_RETRIES, STORAGE, TIMEOUT_S
+from .downloader import store_book
+from .state import MISSING_STATUS, CrawlState
+from .utils import backoff
+
+# Status codes worth retrying; anything else (e.g. 404 for unused IDs) fails at once
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# The server asking us to slow down
+THROTTLE_STATUS = {429, 503}
+# A Retry-After up to this long is waited out inside the batch; a longer one fails the
+# rest of the batch at once and is left to the scheduler's pause between batches
+MAX_INLINE_WAIT_S = 30.0
+# Cap on a server's Retry-After, so a bogus value cannot stall the crawler for days
+MAX_RETRY_AFTER_S = 3600.0
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds asked for by a Retry-After header (delta-seconds or an HTTP date),
+    capped at MAX_RETRY_AFTER_S; None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_S)
+
+
+class RateLimiter:
+    """
+    Global politeness limit shared by all download threads: at most `rate` requests per second.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Even without a rate (interval 0) a pause() still holds requests back
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Holds every thread's next request back for at least `seconds` (a Retry-After).
+        """
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+class RetryBudget:
+    """
+    Caps the number of retries spent per host, so a failing server cannot keep
+    every thread busy retrying for the whole batch.
+    """
+
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._spent: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def spend(self, host: str) -> bool:
+        with self._lock:
+            spent = self._spent.get(host, 0)
+            if spent >= self.per_host:
+                return False
+            self._spent[host] = spent + 1
+            return True
+
+    def spent(self, host: str) -> int:
+        with self._lock:
+            return self._spent.get(host, 0)
+
+
+class TrafficStats:
+    """
+    How the server answered during one download_many call: request latencies, errors
+    and throttling (429/503 with the longest Retry-After). Read by the crawl scheduler
+    to size the next batch.
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.throttled = 0
+        self.retry_after = 0.0
+        # monotonic time until which the rest of the batch is not sent (a long Retry-After)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, status) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            if status in THROTTLE_STATUS:
+                self.throttled += 1
+            elif status == "error" or (isinstance(status, int) and status >= 500):
+                self.errors += 1
+
+    def throttle(self, retry_after: Optional[float]) -> None:
+        if not retry_after:
+            return
+        with self._lock:
+            self.retry_after = max(self.retry_after, retry_after)
+            if retry_after > MAX_INLINE_WAIT_S:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def blocked(self) -> bool:
+        return self.blocked_until > time.monotonic()
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies)
+
+    def median_latency(self) -> float:
+        with self._lock:
+            ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2] if ordered else 0.0
+
+
+class DownloadEngine:
+    """
+    Downloads books concurrently with a thread pool sharing one pooled HTTP session
+    (keep-alive connections are reused across books), a global rate limit and a
+    per-host retry budget. A 429/503 with Retry-After holds back all threads.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        rate: float = 5.0,
+        retry_budget: int = 20,
+        datalake: Path = DATALAKE,
+        url_template: str = GUT_URL,
+        timeout: float = TIMEOUT_S,
+        max_retries: int = MAX_RETRIES,
+        storage: str = STORAGE,
+        state: Optional[CrawlState] = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.datalake = Path(datalake)
+        self.url_template = url_template
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.storage = storage
+        self.state = state
+        self.limiter = RateLimiter(rate)
+        self.retry_budget_per_host = retry_budget
+        # TrafficStats of the last download_many call
+        self.last_stats = TrafficStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fetch(self, book_id: int, budget: RetryBudget, headers: Optional[dict] = None,
+              stats: Optional[TrafficStats] = None) -> dict:
+        """
+        GETs one book, retrying transient failures. `headers` may carry validators for a
+        conditional request; a 304 comes back as {"ok": True, "not_modified": True}.
+        A Retry-After longer than MAX_INLINE_WAIT_S fails the book (and every book of the
+        batch not requested yet) with reason "throttled" instead of waiting.
+        """
+        url = self.url_template.format(id=book_id)
+        host = urlsplit(url).netloc
+        stats = stats or TrafficStats()
+
+        for attempt in range(self.max_retries):
+            if stats.blocked():
+                return {"ok": False, "book_id": book_id, "reason": "throttled", "retry_after": stats.retry_after}
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, timeout=self.timeout, headers=headers)
+                seconds = time.perf_counter() - start
+                METRICS.observe("http_request_seconds", seconds, status=r.status_code)
+                stats.record(seconds, r.status_code)
+                retry_after = None
+                if r.status_code in THROTTLE_STATUS:
+                    retry_after = retry_after_seconds(r.headers.get("Retry-After"))
+                    stats.throttle(retry_after)
+                    if stats.blocked():
+                        return {"ok": False, "book_id": book_id, "reason": f"throttled:{r.status_code}",
+                                "status": r.status_code, "retry_after": retry_after}
+                    if retry_after:
+                        self.limiter.pause(retry_after)
+                if r.status_code in RETRYABLE_STATUS:
+                    r.raise_for_status()
+                if r.status_code >= 400:
+                    return {"ok": False, "book_id": book_id, "reason": f"http_error:{r.status_code}",
+                            "status": r.status_code}
+                validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+                if r.status_code == 304:
+                    return {"ok": True, "book_id": book_id, "not_modified": True, **validators}
+                return {"ok": True, "book_id": book_id, "text": r.text, **validators}
+            except Exception as e:
+                if not isinstance(e, requests.HTTPError):
+                    retry_after = None
+                    METRICS.observe("http_request_seconds", time.perf_counter() - start, status="error")
+                    stats.record(time.perf_counter() - start, "error")
+                if attempt == self.max_retries - 1:
+                    return {"ok": False, "book_id": book_id, "reason": f"http_error:{e}"}
+                if not budget.spend(host):
+                    return {"ok": False, "book_id": book_id, "reason": f"retry_budget_exhausted:{host}"}
+                METRICS.inc("http_retries_total", host=host)
+                if not retry_after:
+                    backoff(attempt)  # otherwise the limiter already holds the retry back
+
+    def download(self, book_id: int, budget: RetryBudget, stats: Optional[TrafficStats] = None,
+                 recheck: bool = False) -> dict:
+        """
+        Fetches and stores one book. A known-missing ID is skipped unless `recheck`.
+        """
+        if self.state is None:
+            res = self.fetch(book_id, budget, stats=stats)
+            if not res["ok"]:
+                return res
+            return store_book(book_id, res["text"], self.datalake, self.storage)
+
+        record = self.state.get(book_id)
+        if not recheck and self.state.known_missing(record):
+            return {"ok": False, "book_id": book_id, "reason": "known_missing", "skipped": True}
+
+        res = self.fetch(book_id, budget, self.state.conditional_headers(record), stats)
+        if res.get("reason") == "throttled":
+            return res  # never requested
+        if not res["ok"]:
+            missing = res.get("status") in MISSING_STATUS
+            self.state.mark_failed(book_id, "missing" if missing else "error", res["reason"])
+            return res
+        if res.get("not_modified"):
+            self.state.mark_unchanged(book_id, res["etag"], res["last_modified"])
+            return {"ok": True, "book_id": book_id, "unchanged": True}
+
+        stored = store_book(book_id, res["text"], self.datalake, self.storage,
+                            known_hash=record["hash"] if record else None)
+        if not stored["ok"]:
+            self.state.mark_failed(book_id, "error", stored["reason"])
+        elif stored.get("unchanged"):
+            self.state.mark_unchanged(book_id, res["etag"], res["last_modified"])
+        else:
+            self.state.mark_stored(book_id, res["etag"], res["last_modified"], stored["hash"])
+        return stored
+
+    def download_many(self, ids: Iterable[int], on_result: Optional[Callable[[dict], None]] = None,
+                      recheck: Collection[int] = ()) -> List[dict]:
+        """
+        Downloads all IDs and returns their results in the order given.
+        `on_result` is called from the worker threads as each book completes.
+        IDs in `recheck` are requested even if known missing.
+        The retry budget and `last_stats` are per call, i.e. per batch.
+        """
+        budget = RetryBudget(self.retry_budget_per_host)
+        stats = self.last_stats = TrafficStats()
+
+        def task(book_id):
+            res = self.download(book_id, budget, stats, book_id in recheck)
+            if res.get("unchanged") or res.get("skipped"):
+                METRICS.inc("books_skipped_total", stage="crawler", reason=res.get("reason", "unchanged"))
+            elif res.get("ok"):
+                METRICS.inc("books_processed_total", stage="crawler")
+            else:
+                METRICS.inc("failures_total", stage="crawler", reason=failure_reason(res.get("reason")))
+            if on_result:
+                on_result(res)
+            return res
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="download") as pool:
+            return list(pool.map(task, ids))
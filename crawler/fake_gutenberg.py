@@ -0,0 +1,171 @@
+"""
+Local stand-in for gutenberg.org that serves generated /cache/epub/{id}/pg{id}.txt files.
+Used to exercise the crawler without touching the real site:
+
+    python -m crawler.fake_gutenberg --port 8000
+    python -m crawler.cli --range 1 50 --concurrency 8 --base-url http://127.0.0.1:8000
+"""
+
+import argparse
+import hashlib
+import random
+import re
+from collections import deque
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config import START_MARKERS, END_MARKERS
+
+PATH_RE = re.compile(r"^/cache/epub/(\d+)/pg(\d+)\.txt$")
+
+WORDS = [
+    "the", "whale", "sea", "captain", "ship", "night", "light", "river", "house", "love",
+    "de", "la", "que", "casa", "niño", "canción", "corazón", "mañana", "camión", "pingüino",
+]
+
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+def fake_book(book_id: int, words: int = 500, revision: int = 0, text_of: int = None) -> str:
+    """
+    A generated book. With `text_of`, the body is that book's text (a re-release under a new ID)
+    with a short note of its own.
+    """
+    rng = random.Random(text_of or book_id)
+    body = " ".join(rng.choice(WORDS) for _ in range(words))
+    if text_of:
+        body += f" this edition was prepared from the text of ebook {text_of} by volunteer {book_id}"
+    if revision:
+        body += f" revision {revision}"
+    return (
+        f"The Project Gutenberg eBook of Fake Book {book_id}\n\n"
+        f"Title: Fake Book {book_id}\n"
+        f"Author: Fake Author {book_id % 17}\n"
+        f"Release date: January 1, 2000 [eBook #{book_id}]\n"
+        f"Language: {'Spanish' if book_id % 3 == 0 else 'English'}\n\n"
+        f"{START_MARKERS[0]} FAKE BOOK {book_id} ***\n\n"
+        f"{body}\n\n"
+        f"{END_MARKERS[0]} FAKE BOOK {book_id} ***\n"
+    )
+
+
+class FakeGutenbergHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        m = PATH_RE.match(self.path)
+        if not m or m.group(1) != m.group(2):
+            return self._reply(404, b"not found")
+        book_id = int(m.group(1))
+        self.server.requests_served += 1
+
+        if book_id in self.server.missing_ids or (self.server.max_id and book_id > self.server.max_id):
+            return self._reply(404, b"not found")
+        if self.server.over_rate_limit():
+            self.server.throttled += 1
+            return self._reply(429, b"slow down", retry_after=self.server.retry_after)
+        if self.server.error_rate and self.server.rng.random() < self.server.error_rate:
+            return self._reply(503, b"try again later", retry_after=self.server.retry_after)
+        payload = fake_book(
+            book_id, revision=self.server.revisions.get(book_id, 0), text_of=self.server.duplicates.get(book_id)
+        ).encode("utf-8")
+        etag = '"' + hashlib.sha1(payload).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.not_modified += 1
+            return self._reply(304, b"", etag)
+        self._reply(200, payload, etag)
+
+    def _reply(self, status: int, payload: bytes, etag: str = None, retry_after: int = 0):
+        self.send_response(status)
+        if retry_after:
+            self.send_header("Retry-After", str(retry_after))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class FakeGutenbergServer(ThreadingHTTPServer):
+    def over_rate_limit(self) -> bool:
+        """
+        True if this request goes over `rate_limit` requests in the last second.
+        """
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 1.0:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                return True
+            self.recent.append(now)
+            return False
+
+
+def serve(port: int = 0, missing_ids=(), error_rate: float = 0.0, max_id: int = 0, rate_limit: float = 0.0,
+          retry_after: int = 0, duplicates=None) -> ThreadingHTTPServer:
+    """
+    Starts the server on a background thread and returns it; `server.url_template`
+    can be passed straight to the crawler. Call `server.shutdown()` to stop it.
+    IDs above `max_id` (if set) answer 404, like the end of the real catalog; more than
+    `rate_limit` requests per second answer 429. 429s and 503s carry `retry_after` seconds.
+    `duplicates` maps IDs to the ID whose text they re-release (near-duplicates).
+    """
+    server = FakeGutenbergServer(("127.0.0.1", port), FakeGutenbergHandler)
+    server.missing_ids = set(missing_ids)
+    server.error_rate = error_rate
+    server.max_id = max_id
+    server.duplicates = dict(duplicates or {})
+    server.rate_limit = rate_limit
+    server.retry_after = retry_after
+    server.recent = deque()
+    server.lock = threading.Lock()
+    server.rng = random.Random(0)
+    server.requests_served = 0
+    server.connections = 0
+    server.not_modified = 0
+    server.throttled = 0
+    # book_id -> revision; bump one to make the server answer with a changed body
+    server.revisions = {}
+    server.url_template = f"http://127.0.0.1:{server.server_address[1]}" + "/cache/epub/{id}/pg{id}.txt"
+    threading.Thread(target=server.serve_forever, name="fake-gutenberg", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake Project Gutenberg server for local crawler runs.")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--missing-every", type=int, default=0, help="Answer 404 for every Nth ID")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    ap.add_argument("--max-id", type=int, default=0, help="Answer 404 for every ID above this one (end of the catalog)")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="Answer 429 above this many requests per second")
+    ap.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with 429 and 503 answers")
+    ap.add_argument("--duplicate-every", type=int, default=0, help="Every Nth ID re-releases the text of the ID before")
+    args = ap.parse_args()
+
+    missing = range(args.missing_every, 1_000_000, args.missing_every) if args.missing_every else ()
+    duplicates = {i: i - 1 for i in range(args.duplicate_every, 1_000_000, args.duplicate_every)} \
+        if args.duplicate_every else {}
+    server = serve(args.port, missing, args.error_rate, args.max_id, args.rate_limit, args.retry_after, duplicates)
+    print(f"Serving fake Gutenberg at {server.url_template}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
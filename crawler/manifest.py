@@ -0,0 +1,231 @@
+"""
+Append-only manifest of the datalake (datalake/manifest.jsonl).
+
+The crawler appends one line per stored book:
+  {"book_id": 1342, "day": "20250101", "hour": "09",
+   "header": "20250101/09/1342_header.txt", "body": "20250101/09/1342_body.txt",
+   "size": 712345, "hash": "<sha1 of the body>", "stored_at": 1735722000.123}
+"stored_at" (unix time of the append) is absent for entries from a datalake scan.
+Paths are relative to the datalake root. Books stored in an hour pack file have a "pack" path
+and [offset, length] pairs instead of header/body paths (see crawler/storage.py). Consumers (indexer, metadata parser) keep the
+byte offset they have read up to, so each run only reads the entries added since.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from .storage import read_pack_index
+
+MANIFEST_NAME = "manifest.jsonl"
+
+_lock = threading.Lock()
+# Manifests whose tail this process has already checked (see _repair_tail)
+_repaired = set()
+
+BOOK_FILE_RE = re.compile(r"^(\d+)_(header|body)\.txt$")
+
+
+def manifest_path(datalake) -> Path:
+    return Path(datalake) / MANIFEST_NAME
+
+
+def body_hash(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+def make_entry(datalake, book_id: int, day: str, hour: str, header_path: Path, body_path: Path,
+               size: int, digest: str) -> dict:
+    root = Path(datalake)
+    return {
+        "book_id": book_id,
+        "day": day,
+        "hour": hour,
+        "header": Path(header_path).relative_to(root).as_posix(),
+        "body": Path(body_path).relative_to(root).as_posix(),
+        "size": size,
+        "hash": digest,
+    }
+
+
+def make_pack_entry(datalake, book_id: int, day: str, hour: str, pack_path: Path, refs: dict,
+                    size: int, digest: str) -> dict:
+    return {
+        "book_id": book_id,
+        "day": day,
+        "hour": hour,
+        "pack": Path(pack_path).relative_to(Path(datalake)).as_posix(),
+        "header": refs["header"],
+        "body": refs["body"],
+        "size": size,
+        "hash": digest,
+    }
+
+
+def _sort_hour(name: str):
+    return (0, int(name), name) if name.isdigit() else (1, 0, name)
+
+
+def scan_datalake(datalake) -> Iterator[dict]:
+    """
+    Walks datalake/YYYYMMDD/HH once and yields an entry for every book with a body file
+    or a line in the hour's pack index, ordered by day, hour (numerically) and book ID.
+    """
+    root = Path(datalake)
+    if not root.exists():
+        return
+    for day_folder in sorted((p for p in root.iterdir() if p.is_dir()), key=lambda p: p.name):
+        hour_folders = sorted((p for p in day_folder.iterdir() if p.is_dir()), key=lambda p: _sort_hour(p.name))
+        for hour_folder in hour_folders:
+            book_ids = set()
+            for f in hour_folder.iterdir():
+                m = BOOK_FILE_RE.match(f.name)
+                if m:
+                    book_ids.add(int(m.group(1)))
+            found = {}
+            for book_id in book_ids:
+                header_path = hour_folder / f"{book_id}_header.txt"
+                body_path = hour_folder / f"{book_id}_body.txt"
+                if not body_path.exists():
+                    continue
+                body = body_path.read_bytes()
+                size = len(body) + (header_path.stat().st_size if header_path.exists() else 0)
+                found[book_id] = make_entry(root, book_id, day_folder.name, hour_folder.name,
+                                            header_path, body_path, size, body_hash(body))
+            for entry in read_pack_index(hour_folder):
+                found[entry["book_id"]] = entry
+            for book_id in sorted(found):
+                yield found[book_id]
+
+
+def ensure_manifest(datalake) -> Path:
+    """
+    Creates the manifest from a one-off scan of an existing datalake if it does not exist yet.
+    """
+    path = manifest_path(datalake)
+    with _lock:
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        count = 0
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in scan_datalake(datalake):
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                count += 1
+        os.replace(tmp, path)
+    if count:
+        print(f"Datalake manifest created from {count} existing books: {path}")
+    return path
+
+
+def _complete_end(f) -> Tuple[int, int]:
+    # (file size, offset just past the last complete line)
+    size = f.seek(0, os.SEEK_END)
+    pos = size
+    while pos > 0:
+        step = min(4096, pos)
+        f.seek(pos - step)
+        newline = f.read(step).rfind(b"\n")
+        if newline >= 0:
+            return size, pos - step + newline + 1
+        pos -= step
+    return size, 0
+
+
+def complete_size(datalake) -> int:
+    """
+    Byte offset just past the last complete entry (0 if there is no manifest yet).
+    """
+    try:
+        with open(manifest_path(datalake), "rb") as f:
+            return _complete_end(f)[1]
+    except FileNotFoundError:
+        return 0
+
+
+def _repair_tail(path: Path) -> None:
+    """
+    Truncates a partial last line left by a crawler killed mid-append; otherwise the
+    next entry would be glued onto it and the merged line could not be parsed.
+    """
+    with open(path, "rb+") as f:
+        size, end = _complete_end(f)
+        if end == size:
+            return
+        f.truncate(end)
+    print(f"Removed a partial entry ({size - end} bytes) from the end of {path}")
+
+
+def append_entry(datalake, entry: dict) -> None:
+    path = ensure_manifest(datalake)
+    line = json.dumps({**entry, "stored_at": round(time.time(), 3)}, ensure_ascii=False) + "\n"
+    with _lock:
+        if path not in _repaired:
+            _repair_tail(path)
+            _repaired.add(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_entries(datalake, offset: int = 0) -> List[Tuple[dict, int]]:
+    """
+    Returns the complete entries written after byte `offset`, each paired with the
+    offset just past it (the cursor to save once that entry is processed).
+    """
+    path = ensure_manifest(datalake)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+
+    entries = []
+    pos = offset
+    for raw in data.splitlines(keepends=True):
+        if not raw.endswith(b"\n"):
+            break  # a line still being written
+        pos += len(raw)
+        if raw.strip():
+            entries.append((json.loads(raw), pos))
+    return entries
+
+
+def _after_cursor(entry: dict, progress: dict) -> bool:
+    last_day = progress.get("last_day")
+    last_hour = progress.get("last_hour")
+    if not last_day:
+        return True
+    if entry["day"] != last_day:
+        return entry["day"] > last_day
+    if last_hour and entry["hour"] != last_hour:
+        return _sort_hour(entry["hour"]) > _sort_hour(last_hour)
+    return entry["book_id"] > progress.get("last_indexed_id", -1)
+
+
+def pending_batches(datalake, progress: dict) -> Iterator[Tuple[str, str, List[dict], int]]:
+    """
+    Yields (day, hour, entries, offset) for the manifest entries a consumer has not processed,
+    grouped by consecutive day/hour. Entries are sorted by book ID (a re-downloaded book keeps
+    its latest entry); `offset` is the cursor to save once the batch is done.
+
+    Progress files from before the manifest (no "manifest_offset") are honoured by
+    skipping entries up to their last day/hour/id.
+    """
+    offset = progress.get("manifest_offset")
+    legacy = offset is None
+    items = read_entries(datalake, offset or 0)
+
+    for (day, hour), group in groupby(items, key=lambda item: (item[0]["day"], item[0]["hour"])):
+        group = list(group)
+        end = group[-1][1]
+        by_id = {}
+        for entry, _ in group:
+            if legacy and not _after_cursor(entry, progress):
+                continue
+            by_id[entry["book_id"]] = entry
+        yield day, hour, [by_id[i] for i in sorted(by_id)], end
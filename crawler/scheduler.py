@@ -0,0 +1,239 @@
+"""
+Crawl scheduler: decides which IDs the next crawler batch asks for, how many, and how
+long to pause before the batch after it.
+
+Each batch is drawn, in this order, from
+  retry     IDs that failed with a transient error (5xx, timeout, 429/503), due again after
+            an exponential delay (or the server's Retry-After); dropped after MAX_ATTEMPTS.
+            IDs a long Retry-After kept from being requested at all are due again once it
+            has passed, without spending an attempt
+  new       the next IDs past the cursor, i.e. books never asked for
+  refresh   up to `refresh_batch` stored books not checked for `refresh_after` seconds
+            (crawler/state.db), on top of the batch size
+
+Batch size and pause adapt to the server (AIMD, as in TCP congestion control): a batch
+answered without throttling, with few errors and a median latency under the target grows
+the next batch by the initial batch size and halves the pause; any 429/503, an error rate
+over MAX_ERROR_RATE or a slow median halves the batch and doubles the pause. A Retry-After
+is never undercut. With adaptive=False the batch size and pause stay fixed.
+
+Missing IDs (404) do not stop the crawl: holes in the ID space are stepped over. Only
+`gap_limit` missing IDs in a row past the highest stored book mark the end of the
+catalog; then no new IDs are handed out until `frontier_recheck` seconds later, when the
+IDs past the highest stored book are asked for again (known-missing or not).
+
+The cursor, the retry queue and the current batch size and pause are saved atomically
+after every batch (crawler/progress.json); a file from older versions ({"last_id": N})
+resumes at N + 1.
+"""
+
+import heapq
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from control.metrics import METRICS, log
+from inverted_index.checkpoint import read_json, write_json_atomic
+from .config import FRONTIER_RECHECK_S, GAP_LIMIT, MAX_BATCH_SIZE, TARGET_LATENCY_S
+from .engine import TrafficStats
+from .state import MISSING_STATUS, CrawlState
+
+NEW, RETRY, REFRESH = "new", "retry", "refresh"
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY_S = 60.0
+MAX_RETRY_DELAY_S = 6 * 3600.0
+MAX_ERROR_RATE = 0.2
+
+
+class CrawlScheduler:
+    def __init__(
+        self,
+        progress_path: Optional[str] = None,
+        state: Optional[CrawlState] = None,
+        batch_size: int = 10,
+        pause: float = 120.0,
+        adaptive: bool = True,
+        max_batch: int = MAX_BATCH_SIZE,
+        min_pause: float = 1.0,
+        target_latency: float = TARGET_LATENCY_S,
+        gap_limit: int = GAP_LIMIT,
+        frontier_recheck: float = FRONTIER_RECHECK_S,
+        refresh_batch: int = 0,
+        refresh_after: float = 24 * 3600.0,
+    ):
+        self.progress_path = progress_path
+        self.state = state
+        self.initial_batch = max(1, batch_size)
+        self.max_pause = pause
+        self.adaptive = adaptive
+        self.max_batch = max(max_batch, self.initial_batch)
+        self.min_pause = min(min_pause, pause)
+        self.target_latency = target_latency
+        self.gap_limit = gap_limit
+        self.frontier_recheck = frontier_recheck
+        self.refresh_batch = refresh_batch
+        self.refresh_after = refresh_after
+
+        self.batch_size = self.initial_batch
+        self.pause = self.min_pause if adaptive else pause
+        self.next_id = 1
+        # Highest ID stored so far, and missing IDs in a row right after it
+        self.max_ok = 0
+        self.frontier_misses = 0
+        # Highest new ID ever handed out; lower new IDs are re-probes of the frontier
+        self.high_water = 0
+        # Unix time until which the end of the catalog is not probed again
+        self.frontier_wait_until = 0.0
+        # Heap of (due unix time, book_id, attempts so far)
+        self.retries: List[Tuple[float, int, int]] = []
+        # book_id -> (kind, attempts) of the batch in flight
+        self._batch: Dict[int, Tuple[str, int]] = {}
+        self.load()
+
+    def load(self):
+        if not self.progress_path:
+            return
+        try:
+            data = read_json(self.progress_path, {})
+        except ValueError:
+            # Already-stored IDs are cheap to revisit thanks to the crawl state
+            print(f"Warning: crawler progress {self.progress_path} is corrupt, starting from ID 1")
+            return
+        last_id = data.get("last_id", 0)
+        self.next_id = data.get("next_id", last_id + 1)
+        self.max_ok = data.get("max_ok", last_id)
+        self.frontier_misses = data.get("frontier_misses", 0)
+        self.high_water = data.get("high_water", last_id)
+        self.frontier_wait_until = data.get("frontier_wait_until", 0.0)
+        self.retries = [tuple(r) for r in data.get("retries", [])]
+        heapq.heapify(self.retries)
+        if self.adaptive:
+            self.batch_size = min(max(1, data.get("batch_size", self.batch_size)), self.max_batch)
+            self.pause = data.get("pause", self.pause)
+
+    def save(self):
+        if not self.progress_path:
+            return
+        write_json_atomic(self.progress_path, {
+            "last_id": self.next_id - 1,
+            "next_id": self.next_id,
+            "max_ok": self.max_ok,
+            "frontier_misses": self.frontier_misses,
+            "high_water": self.high_water,
+            "frontier_wait_until": self.frontier_wait_until,
+            "batch_size": self.batch_size,
+            "pause": self.pause,
+            "retries": sorted(self.retries),
+        }, indent=2)
+
+    def at_frontier_end(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.frontier_wait_until
+
+    def next_batch(self) -> Tuple[List[int], Set[int]]:
+        """
+        The IDs of the next batch, and those of them to request even if known missing.
+        """
+        now = time.time()
+        batch: Dict[int, Tuple[str, int]] = {}
+        while self.retries and self.retries[0][0] <= now and len(batch) < self.batch_size:
+            _, book_id, attempts = heapq.heappop(self.retries)
+            batch[book_id] = (RETRY, attempts)
+
+        recheck = set()
+        if not self.at_frontier_end(now):
+            while len(batch) < self.batch_size:
+                book_id = self.next_id
+                self.next_id += 1
+                if book_id in batch:
+                    continue
+                batch[book_id] = (NEW, 0)
+                if book_id <= self.high_water:
+                    recheck.add(book_id)
+            self.high_water = max(self.high_water, self.next_id - 1)
+
+        if self.refresh_batch and self.state is not None:
+            queued = {book_id for _, book_id, _ in self.retries}
+            for book_id in self.state.stale_books(self.refresh_after, self.refresh_batch + len(batch)):
+                if len(batch) >= self.batch_size + self.refresh_batch:
+                    break
+                if book_id not in batch and book_id not in queued:
+                    batch[book_id] = (REFRESH, 0)
+
+        self._batch = batch
+        return list(batch), recheck
+
+    def describe(self, ids: List[int]) -> str:
+        counts = {NEW: 0, RETRY: 0, REFRESH: 0}
+        for book_id in ids:
+            counts[self._batch[book_id][0]] += 1
+        new = [book_id for book_id in ids if self._batch[book_id][0] == NEW]
+        parts = [f"{counts[NEW]} new" + (f" ({min(new)}-{max(new)})" if new else "")]
+        parts += [f"{counts[kind]} {kind}" for kind in (RETRY, REFRESH) if counts[kind]]
+        return ", ".join(parts)
+
+    def record(self, results: List[dict], stats: TrafficStats, seconds: float) -> None:
+        """
+        Takes the results of the batch from next_batch: updates the frontier and the retry
+        queue, adapts batch size and pause to how the server answered, and saves progress.
+        """
+        now = time.time()
+        for res in sorted(results, key=lambda r: r["book_id"]):
+            book_id = res["book_id"]
+            kind, attempts = self._batch.get(book_id, (NEW, 0))
+            missing = res.get("skipped") or res.get("status") in MISSING_STATUS
+            if res.get("ok"):
+                if book_id > self.max_ok:
+                    self.max_ok, self.frontier_misses = book_id, 0
+            elif missing:
+                if kind == NEW and book_id > self.max_ok:
+                    self.frontier_misses += 1
+            elif res.get("reason") == "throttled":
+                # Never requested (a long Retry-After stopped the batch first): no attempt spent
+                heapq.heappush(self.retries, (now + (res.get("retry_after") or 0), book_id, attempts))
+            elif attempts + 1 < MAX_ATTEMPTS:
+                delay = max(min(RETRY_DELAY_S * 2 ** attempts, MAX_RETRY_DELAY_S), res.get("retry_after") or 0)
+                heapq.heappush(self.retries, (now + delay, book_id, attempts + 1))
+            else:
+                log(1, f"Giving up on book {book_id} after {attempts + 1} attempts ({res.get('reason')})")
+        self._batch = {}
+
+        if self.frontier_misses >= self.gap_limit and not self.at_frontier_end(now):
+            log(1, f"{self.frontier_misses} missing IDs in a row after {self.max_ok}: end of the catalog, "
+                   f"probing again in {self.frontier_recheck / 60:.0f} minutes")
+            self.frontier_wait_until = now + self.frontier_recheck
+            self.frontier_misses = 0
+            self.next_id = self.max_ok + 1
+
+        requests = stats.requests
+        latency = stats.median_latency()
+        error_rate = stats.errors / requests if requests else 0.0
+        if not self.adaptive:
+            self.pause = self.max_pause
+        elif requests:
+            if stats.throttled or error_rate > MAX_ERROR_RATE or latency > self.target_latency:
+                self.batch_size = max(1, self.batch_size // 2)
+                self.pause = min(max(self.pause * 2, self.min_pause), self.max_pause)
+            else:
+                self.batch_size = min(self.batch_size + self.initial_batch, self.max_batch)
+                self.pause = max(self.pause / 2, self.min_pause)
+        # A Retry-After is honoured in fixed mode too
+        self.pause = max(self.pause, stats.retry_after)
+
+        stored = sum(1 for res in results if res.get("ok") and not res.get("unchanged"))
+        log(1, f"Scheduler: {stored / seconds if seconds else 0:.1f} books/s, median latency {latency:.2f}s, "
+               f"{stats.throttled} throttled, {stats.errors} errors; next batch {self.batch_size}, "
+               f"pause {self.pause:.1f}s, {len(self.retries)} queued for retry")
+        METRICS.set("crawl_batch_size", self.batch_size)
+        METRICS.set("crawl_pause_seconds", self.pause)
+        METRICS.set("crawl_retry_queue", len(self.retries))
+        self.save()
+
+    def next_pause(self) -> float:
+        """
+        Seconds to wait before the next batch: the adapted pause, or the longest one
+        while there is nothing new to crawl (end of the catalog reached, no retry due).
+        """
+        now = time.time()
+        if self.at_frontier_end(now) and not (self.retries and self.retries[0][0] <= now):
+            return max(self.pause, self.max_pause)
+        return self.pause
@@ -0,0 +1,128 @@
+"""
+Persistent per-ID crawl state (crawler/state.db, SQLite).
+
+One row per Gutenberg ID the crawler has asked for:
+  status         "ok" (stored), "missing" (404/410) or "error" (anything else)
+  etag, last_modified   validators from the last 200, sent back as
+                 If-None-Match / If-Modified-Since when the book is refreshed
+  hash           sha1 of the stored body, so an unchanged re-download is not rewritten
+  checked_at     unix time of the last request; known-missing IDs are skipped until
+                 it is older than the missing TTL
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from .config import MISSING_TTL_S
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_state (
+    book_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    hash TEXT,
+    reason TEXT,
+    checked_at REAL NOT NULL,
+    stored_at REAL
+)
+"""
+
+MISSING_STATUS = {404, 410}
+
+
+class CrawlState:
+    """
+    Thread-safe store shared by the download threads; every update is committed at once
+    so the state survives a crash mid-batch.
+    """
+
+    def __init__(self, db_path: str, missing_ttl: float = MISSING_TTL_S):
+        path = Path(db_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.missing_ttl = missing_ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def get(self, book_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM crawl_state WHERE book_id = ?", (book_id,)).fetchone()
+        return dict(row) if row else None
+
+    def known_missing(self, record: Optional[dict], now: Optional[float] = None) -> bool:
+        if not record or record["status"] != "missing":
+            return False
+        return (now or time.time()) - record["checked_at"] < self.missing_ttl
+
+    def conditional_headers(self, record: Optional[dict]) -> dict:
+        headers = {}
+        if record:
+            if record["etag"]:
+                headers["If-None-Match"] = record["etag"]
+            if record["last_modified"]:
+                headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def _write(self, sql: str, params: tuple):
+        with self._lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def mark_stored(self, book_id: int, etag: Optional[str], last_modified: Optional[str], digest: str):
+        now = time.time()
+        self._write(
+            "INSERT INTO crawl_state (book_id, status, etag, last_modified, hash, reason, checked_at, stored_at) "
+            "VALUES (?, 'ok', ?, ?, ?, NULL, ?, ?) "
+            "ON CONFLICT(book_id) DO UPDATE SET status='ok', etag=excluded.etag, "
+            "last_modified=excluded.last_modified, hash=excluded.hash, reason=NULL, "
+            "checked_at=excluded.checked_at, stored_at=excluded.stored_at",
+            (book_id, etag, last_modified, digest, now, now),
+        )
+
+    def mark_unchanged(self, book_id: int, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        # A 304 may omit the validators; keep the ones we had
+        self._write(
+            "UPDATE crawl_state SET status = 'ok', reason = NULL, checked_at = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified) WHERE book_id = ?",
+            (time.time(), etag, last_modified, book_id),
+        )
+
+    def mark_failed(self, book_id: int, status: str, reason: str):
+        """
+        Records a "missing" or "error" result. A book that was stored before keeps its
+        validators and hash, so it can still be refreshed cheaply later.
+        """
+        self._write(
+            "INSERT INTO crawl_state (book_id, status, reason, checked_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(book_id) DO UPDATE SET status=excluded.status, reason=excluded.reason, "
+            "checked_at=excluded.checked_at",
+            (book_id, status, reason, time.time()),
+        )
+
+    def stale_books(self, older_than: float, limit: Optional[int] = None) -> List[int]:
+        """
+        IDs of stored books last checked more than `older_than` seconds ago, oldest first.
+        """
+        sql = "SELECT book_id FROM crawl_state WHERE status = 'ok' AND checked_at < ? ORDER BY checked_at"
+        params: tuple = (time.time() - older_than,)
+        if limit:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            return [r[0] for r in self.conn.execute(sql, params)]
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM crawl_state GROUP BY status").fetchall())
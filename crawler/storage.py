@@ -0,0 +1,173 @@
+"""
+Storage layouts of the datalake and the reader shared by every consumer.
+
+loose: datalake/YYYYMMDD/HH/{id}_header.txt and {id}_body.txt (the original layout).
+pack:  datalake/YYYYMMDD/HH/books.pack, one append-only file per hour folder. Every header
+       and body is its own gzip member, so a single part can be read back with one seek,
+       and `zcat books.pack` still prints the whole folder. books.idx next to it has one
+       JSON line per book with the offset/length of both members:
+         {"book_id": 1342, "day": "20250101", "hour": "09", "pack": "20250101/09/books.pack",
+          "header": [0, 812], "body": [812, 301455], "size": 712345, "hash": "<sha1>"}
+       The same entry is appended to the datalake manifest.
+
+Consumers never open book files directly; they call read_part(datalake, entry, "header"|"body")
+with a manifest entry and get the text back whatever the layout, or iter_text(...) to stream
+it in bounded chunks (packed members are decompressed as they are read).
+"""
+
+import argparse
+import codecs
+import gzip
+import io
+import json
+import threading
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Iterator, Optional
+
+STORAGE_MODES = ("loose", "pack")
+PACK_NAME = "books.pack"
+PACK_INDEX_NAME = "books.idx"
+COMPRESSION_LEVEL = 6
+# Bytes read per step by iter_text
+CHUNK_SIZE = 64 * 1024
+
+_pack_lock = threading.Lock()
+
+
+def is_packed(entry: dict) -> bool:
+    return "pack" in entry
+
+
+def append_to_pack(out_dir: Path, header: bytes, body: bytes) -> dict:
+    """
+    Appends header and body as two gzip members to out_dir/books.pack.
+    Returns the "header"/"body" [offset, length] pairs to store in the book entry.
+    """
+    header_gz = gzip.compress(header, COMPRESSION_LEVEL, mtime=0)
+    body_gz = gzip.compress(body, COMPRESSION_LEVEL, mtime=0)
+    with _pack_lock:
+        with open(Path(out_dir) / PACK_NAME, "ab") as f:
+            offset = f.tell()
+            f.write(header_gz)
+            f.write(body_gz)
+    return {
+        "header": [offset, len(header_gz)],
+        "body": [offset + len(header_gz), len(body_gz)],
+    }
+
+
+def append_pack_index(out_dir: Path, entry: dict) -> None:
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _pack_lock:
+        with open(Path(out_dir) / PACK_INDEX_NAME, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_pack_index(hour_folder: Path) -> Iterator[dict]:
+    path = Path(hour_folder) / PACK_INDEX_NAME
+    if not path.exists():
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n") and line.strip():
+                yield json.loads(line)
+
+
+def read_bytes(datalake, entry: dict, part: str) -> Optional[bytes]:
+    """
+    Returns the raw bytes of a book's "header" or "body", or None if it is missing.
+    """
+    root = Path(datalake)
+    if is_packed(entry):
+        offset, length = entry[part]
+        try:
+            with open(root / entry["pack"], "rb") as f:
+                f.seek(offset)
+                return gzip.decompress(f.read(length))
+        except FileNotFoundError:
+            return None
+    path = root / entry[part]
+    if not path.exists():
+        return None
+    return path.read_bytes()
+
+
+def read_part(datalake, entry: dict, part: str) -> Optional[str]:
+    data = read_bytes(datalake, entry, part)
+    return None if data is None else data.decode("utf-8")
+
+
+class _Slice(io.RawIOBase):
+    """
+    The `length` bytes at the current position of `f`: one gzip member of a pack.
+    """
+
+    def __init__(self, f, length: int):
+        self._f = f
+        self._left = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self._left)
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+
+def iter_text(datalake, entry: dict, part: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields a book's "header" or "body" as text, about `chunk_size` bytes at a time, so
+    only one chunk is in memory however large the book. Yields nothing if it is missing.
+    """
+    root = Path(datalake)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with ExitStack() as stack:
+        try:
+            if is_packed(entry):
+                offset, length = entry[part]
+                pack = stack.enter_context(open(root / entry["pack"], "rb"))
+                pack.seek(offset)
+                stream = stack.enter_context(gzip.GzipFile(fileobj=_Slice(pack, length), mode="rb"))
+            else:
+                stream = stack.enter_context(open(root / entry[part], "rb"))
+        except FileNotFoundError:
+            return
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Read one book from the datalake (loose or packed).")
+    ap.add_argument("--datalake", type=Path, default=Path("datalake"))
+    ap.add_argument("--part", choices=["header", "body"], default="header")
+    ap.add_argument("book_id", type=int)
+    args = ap.parse_args()
+
+    from .manifest import read_entries
+
+    latest = None
+    for entry, _ in read_entries(args.datalake):
+        if entry["book_id"] == args.book_id:
+            latest = entry
+    text = read_part(args.datalake, latest, args.part) if latest else None
+    if text is None:
+        raise SystemExit(f"Book {args.book_id} not found in {args.datalake}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
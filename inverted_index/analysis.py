@@ -0,0 +1,201 @@
+"""
+Text analysis shared by the indexer and the query side.
+
+An analysis scheme turns a book body (or a query word) into index terms:
+  none   lowercase + WORD_RE tokens, every word indexed (the original behaviour)
+  light  as "none", then the stopwords of the book's language are dropped and the
+         remaining words are reduced with a light stemmer ("books" -> "book",
+         "canciones" -> "cancion")
+The language comes from the header's "Language:" field; books in other languages are
+only tokenized. The scheme an index was built with is recorded in its segment manifest
+(and the binary index header), and queries must be analyzed with the same one: a query
+word is dropped if it is a stopword in any supported language and otherwise matches
+any of its per-language stems (query_alternatives).
+
+New schemes or languages register in SCHEMES / LANGUAGES.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional
+
+WORD_RE = re.compile(r"\b[a-záéíóúüñ]+\b")
+
+ENGLISH_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before
+being below between both but by can could did do does doing down during each few for
+from further had has have having he her here hers herself him himself his how i if in
+into is it its itself just me more most my myself no nor not now of off on once only or
+other our ours ourselves out over own same she should so some such than that the their
+theirs them themselves then there these they this those through to too under until up
+upon us very was we were what when where which while who whom why will with would you
+your yours yourself yourselves
+""".split())
+
+# Left out on purpose: "era", "sea", "hay", "tan" are also English content words, and
+# query words are dropped if they are a stopword in any language.
+SPANISH_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde
+durante e el ella ellas ellos en entre eran es esa esas ese eso esos esta estaba estas
+este esto estos fue fueron ha habia han hasta la las le les lo los mas me mi mis mucho
+muy nada ni no nos nosotros o os otra otras otro otros para pero poco por porque que
+quien se ser si sin sino sobre su sus tambien te tiene tu tus un una uno unos vosotros
+y ya yo él más qué sí también había está cómo cuál quién mí tú
+""".split())
+
+
+def _has_vowel(word: str) -> bool:
+    return any(c in "aeiouy" for c in word)
+
+
+@lru_cache(maxsize=200_000)
+def stem_english(word: str) -> str:
+    """
+    Light English stemmer: plurals, then -ing / -ed (undoubling "running" -> "run").
+    Only strips a suffix if at least three letters with a vowel remain.
+    """
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith(("sses", "ches", "shes", "xes", "zes")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and not word.endswith("eed"):
+            stem = word[:-len(suffix)]
+            if len(stem) >= 3 and _has_vowel(stem):
+                if len(stem) > 3 and stem[-1] == stem[-2] and stem[-1] not in "lsz":
+                    stem = stem[:-1]
+                return stem
+            break
+    return word
+
+
+_ACCENTS = str.maketrans("áéíóúü", "aeiouu")
+
+
+@lru_cache(maxsize=200_000)
+def stem_spanish(word: str) -> str:
+    """
+    Light Spanish stemmer: accents removed (ñ kept), -mente adverbs, plurals and the
+    final gender/number vowel ("niño", "niña", "niños" -> "niñ").
+    """
+    word = word.translate(_ACCENTS)
+    if len(word) > 7 and word.endswith("mente"):
+        word = word[:-5]
+    if len(word) > 4 and word.endswith("ces"):
+        return word[:-3] + "z"
+    if len(word) > 4 and word.endswith(("os", "as", "es")):
+        return word[:-2]
+    if len(word) > 3 and word[-1] in "oae":
+        return word[:-1]
+    return word
+
+
+# Language key -> (stopwords, stemmer)
+LANGUAGES: Dict[str, tuple] = {
+    "english": (ENGLISH_STOPWORDS, stem_english),
+    "spanish": (SPANISH_STOPWORDS, stem_spanish),
+}
+
+LANGUAGE_ALIASES = {"en": "english", "es": "spanish", "español": "spanish", "castellano": "spanish"}
+
+SCHEMES = ("none", "light")
+
+
+def language_key(language: Optional[str]) -> Optional[str]:
+    """
+    Maps a header "Language:" value ("English", "Spanish", "English; Spanish") to a
+    LANGUAGES key; the first listed language wins. None if unsupported.
+    """
+    if not language:
+        return None
+    first = re.split(r"[;,/]| and ", language.strip().lower())[0].strip()
+    key = LANGUAGE_ALIASES.get(first, first)
+    return key if key in LANGUAGES else None
+
+
+def _word_tail(text: str) -> int:
+    # Start of the trailing run of \w characters (what WORD_RE's \b sees as one word)
+    i = len(text)
+    while i and (text[i - 1].isalnum() or text[i - 1] == "_"):
+        i -= 1
+    return i
+
+
+class Analyzer:
+    def __init__(self, stopwords: FrozenSet[str] = frozenset(), stemmer: Optional[Callable[[str], str]] = None):
+        self.stopwords = stopwords
+        self.stemmer = stemmer
+
+    def analyze(self, text: str) -> List[str]:
+        return self._filter(WORD_RE.findall(text.lower()))
+
+    def analyze_chunks(self, chunks: Iterable[str]) -> Iterator[List[str]]:
+        """
+        Streaming analyze(): yields the terms of each text chunk in order. The word cut
+        by a chunk boundary is carried into the next chunk, so the terms are exactly
+        those of the joined text, and memory is bounded by the chunk size.
+        """
+        carry = ""
+        for chunk in chunks:
+            text = carry + chunk.lower() if carry else chunk.lower()
+            cut = _word_tail(text)
+            carry = text[cut:]
+            if cut:
+                yield self._filter(WORD_RE.findall(text, 0, cut))
+        if carry:
+            yield self._filter(WORD_RE.findall(carry))
+
+    def _filter(self, words: List[str]) -> List[str]:
+        if self.stopwords:
+            stop = self.stopwords
+            words = [w for w in words if w not in stop]
+        if self.stemmer:
+            stem = self.stemmer
+            words = [stem(w) for w in words]
+        return words
+
+
+PLAIN = Analyzer()
+
+
+def get_analyzer(scheme: str, language: Optional[str] = None) -> Analyzer:
+    """
+    Returns the analyzer for a book written in `language` (header value) under `scheme`.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown analysis scheme {scheme!r} (expected one of {', '.join(SCHEMES)})")
+    key = language_key(language) if scheme == "light" else None
+    if key is None:
+        return PLAIN
+    return _analyzer_for(key)
+
+
+@lru_cache(maxsize=None)
+def _analyzer_for(key: str) -> Analyzer:
+    stopwords, stemmer = LANGUAGES[key]
+    return Analyzer(stopwords, stemmer)
+
+
+def all_stopwords() -> FrozenSet[str]:
+    return frozenset().union(*(stop for stop, _ in LANGUAGES.values()))
+
+
+def query_alternatives(word: str, scheme: str) -> List[str]:
+    """
+    Index terms a (lowercased) query word can match under `scheme`: the word itself
+    for "none"; for "light", nothing if it is a stopword in any language, otherwise
+    its stem in each language plus the raw word (books in other languages).
+    """
+    if scheme == "none":
+        return [word]
+    if word in all_stopwords():
+        return []
+    alternatives = {word}
+    for _, stemmer in LANGUAGES.values():
+        alternatives.add(stemmer(word))
+    return sorted(alternatives)
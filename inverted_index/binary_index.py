@@ -0,0 +1,285 @@
+"""
+Binary inverted index: sorted term dictionary + delta/varint compressed postings.
+
+Layout (little-endian):
+  header       MAGIC, version u16, flags u16, n_terms u32, n_docs u32,
+               then 6 u64 section offsets (see HEADER below)
+  term_offs    (n_terms + 1) x u64   offsets into term_blob
+  post_offs    (n_terms + 1) x u64   offsets into post_blob
+  dfs          n_terms x u32         document frequency of each term
+  docs         n_docs x (u32 book_id, u32 length), sorted by book_id
+  term_blob    UTF-8 terms, sorted bytewise
+  post_blob    per term: varint(book_id delta) [varint(tf) if FLAG_FREQS], ...
+Flag bits 1-3 hold the index's analysis scheme (position in analysis.SCHEMES).
+"""
+
+import argparse
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from inverted_index.analysis import SCHEMES
+from inverted_index.checkpoint import atomic_file
+from inverted_index.segments import (
+    close_segments, common_format, iter_merged_postings, merge_doc_lengths, open_segments, union_postings,
+)
+
+
+MAGIC = b"GBIX"
+VERSION = 1
+FLAG_FREQS = 1
+ANALYSIS_SHIFT = 1
+ANALYSIS_MASK = 0x7
+HEADER = struct.Struct("<4sHHII6Q")
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _encode_postings(entries: Iterable, with_freqs: bool) -> bytes:
+    out = bytearray()
+    prev = 0
+    for entry in entries:
+        book_id = entry[0] if with_freqs else entry
+        encode_varint(book_id - prev, out)
+        if with_freqs:
+            encode_varint(entry[1], out)
+        prev = book_id
+    return bytes(out)
+
+
+def write_binary_index(
+    output_path: str,
+    postings: Dict[str, list],
+    with_freqs: bool = False,
+    doc_lengths: Optional[Dict[int, int]] = None,
+    analysis: str = "none",
+) -> int:
+    """
+    Writes postings (word -> [book_id, ...], or [[book_id, tf], ...] with_freqs) to a binary file.
+    Returns the number of terms written.
+    """
+    doc_lengths = doc_lengths or {}
+    doc_ids = sorted(set(doc_lengths) | {
+        (e[0] if with_freqs else e) for entries in postings.values() for e in entries
+    })
+    items = ((word, postings[word]) for word in sorted(postings, key=lambda w: w.encode("utf-8")))
+    return write_binary_stream(output_path, items, doc_ids, with_freqs, doc_lengths, analysis)
+
+
+def write_binary_stream(
+    output_path: str,
+    items: Iterable[Tuple[str, list]],
+    doc_ids: List[int],
+    with_freqs: bool = False,
+    doc_lengths: Optional[Dict[int, int]] = None,
+    analysis: str = "none",
+) -> int:
+    """
+    Same as write_binary_index, but consumes (word, postings) pairs one at a time, in term
+    order: terms and postings are spooled to temp files, and only the offset tables are
+    kept in memory until the header can be written.
+    """
+    doc_lengths = doc_lengths or {}
+    output = Path(output_path)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    term_offs, post_offs, dfs = array("Q", [0]), array("Q", [0]), array("I")
+    with tempfile.TemporaryFile(dir=output.parent) as term_blob, \
+            tempfile.TemporaryFile(dir=output.parent) as post_blob:
+        for word, entries in items:
+            term_offs.append(term_offs[-1] + term_blob.write(word.encode("utf-8")))
+            post_offs.append(post_offs[-1] + post_blob.write(_encode_postings(entries, with_freqs)))
+            dfs.append(len(entries))
+
+        n_terms, n_docs = len(dfs), len(doc_ids)
+        term_offs_at = HEADER.size
+        post_offs_at = term_offs_at + 8 * (n_terms + 1)
+        dfs_at = post_offs_at + 8 * (n_terms + 1)
+        docs_at = dfs_at + 4 * n_terms
+        term_blob_at = docs_at + 8 * n_docs
+        post_blob_at = term_blob_at + term_offs[-1]
+
+        flags = (FLAG_FREQS if with_freqs else 0) | (SCHEMES.index(analysis) << ANALYSIS_SHIFT)
+        with atomic_file(output, "wb") as f:
+            f.write(HEADER.pack(
+                MAGIC, VERSION, flags, n_terms, n_docs,
+                term_offs_at, post_offs_at, dfs_at, docs_at, term_blob_at, post_blob_at,
+            ))
+            f.write(struct.pack(f"<{n_terms + 1}Q", *term_offs))
+            f.write(struct.pack(f"<{n_terms + 1}Q", *post_offs))
+            f.write(struct.pack(f"<{n_terms}I", *dfs))
+            for book_id in doc_ids:
+                f.write(struct.pack("<II", book_id, doc_lengths.get(book_id, 0)))
+            for blob in (term_blob, post_blob):
+                blob.seek(0)
+                shutil.copyfileobj(blob, f)
+    return n_terms
+
+
+def export_binary(segments_dir: str, output_path: str) -> int:
+    """
+    Writes the live segments as one binary index, streamed from the segment files term
+    by term. Term frequencies and document lengths are kept when every segment has them.
+    """
+    manifest, readers = open_segments(segments_dir)
+    try:
+        headers = [reader.header() for reader in readers]
+        with_freqs = common_format(headers) != "docs"
+        doc_ids = union_postings([header["doc_ids"] for header in headers])
+        items = iter_merged_postings(readers, "freqs" if with_freqs else "docs")
+        return write_binary_stream(
+            output_path, items, doc_ids, with_freqs, merge_doc_lengths(headers), manifest.get("analysis", "none"),
+        )
+    finally:
+        close_segments(readers)
+
+
+class BinaryIndex:
+    """
+    Memory-mapped reader. Opening only parses the fixed-size header; a lookup binary-searches
+    the term dictionary and decodes just that term's postings.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.n_terms, self.n_docs,
+         self._term_offs, self._post_offs, self._dfs, self._docs,
+         self._term_blob, self._post_blob) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a binary index (or unsupported version): {path}")
+        self.with_freqs = bool(flags & FLAG_FREQS)
+        self.analysis = SCHEMES[(flags >> ANALYSIS_SHIFT) & ANALYSIS_MASK]
+
+    @property
+    def has_freqs(self) -> bool:
+        return self.with_freqs
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, table: int, i: int) -> int:
+        return struct.unpack_from("<Q", self._mm, table + 8 * i)[0]
+
+    def _term_at(self, i: int) -> bytes:
+        start = self._term_blob + self._offset(self._term_offs, i)
+        end = self._term_blob + self._offset(self._term_offs, i + 1)
+        return self._mm[start:end]
+
+    def _find(self, word: str) -> int:
+        key = word.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and self._term_at(lo) == key:
+            return lo
+        return -1
+
+    def __contains__(self, word: str) -> bool:
+        return self._find(word) != -1
+
+    def df(self, word: str) -> int:
+        i = self._find(word)
+        return struct.unpack_from("<I", self._mm, self._dfs + 4 * i)[0] if i != -1 else 0
+
+    def _decode(self, i: int) -> Tuple[List[int], List[int]]:
+        mm = self._mm
+        pos = self._post_blob + self._offset(self._post_offs, i)
+        end = self._post_blob + self._offset(self._post_offs, i + 1)
+        ids, tfs = [], []
+        book_id = 0
+        expect_tf = False
+        value, shift = 0, 0
+        while pos < end:
+            byte = mm[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+            if expect_tf:
+                tfs.append(value)
+                expect_tf = False
+            else:
+                book_id += value
+                ids.append(book_id)
+                expect_tf = self.with_freqs
+            value, shift = 0, 0
+        return ids, tfs
+
+    def postings(self, word: str) -> List[int]:
+        i = self._find(word)
+        return self._decode(i)[0] if i != -1 else []
+
+    def postings_with_freqs(self, word: str) -> List[Tuple[int, int]]:
+        i = self._find(word)
+        if i == -1:
+            return []
+        ids, tfs = self._decode(i)
+        return list(zip(ids, tfs)) if self.with_freqs else [(book_id, 1) for book_id in ids]
+
+    def doc_length(self, book_id: int) -> int:
+        lo, hi = 0, self.n_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, length = struct.unpack_from("<II", self._mm, self._docs + 8 * mid)
+            if mid_id == book_id:
+                return length
+            if mid_id < book_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return 0
+
+    def doc_ids(self) -> List[int]:
+        return [struct.unpack_from("<I", self._mm, self._docs + 8 * i)[0] for i in range(self.n_docs)]
+
+    def terms(self) -> List[str]:
+        return [self._term_at(i).decode("utf-8") for i in range(self.n_terms)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Binary inverted index tools.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Write the binary index from the segments")
+    b.add_argument("--segments", default="index/segments")
+    b.add_argument("--output", default="index/inverted_index.bin")
+
+    q = sub.add_parser("lookup", help="Print the postings of some words")
+    q.add_argument("words", nargs="+")
+    q.add_argument("--index", default="index/inverted_index.bin")
+
+    args = ap.parse_args()
+    if args.cmd == "build":
+        n = export_binary(args.segments, args.output)
+        print(f"Wrote {n} terms to {args.output}")
+    else:
+        with BinaryIndex(args.index) as index:
+            for word in args.words:
+                print(f"{word}\t{index.postings(word)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Append-only metadata catalog written by the metadata parser (default: metadata/catalog.jsonl).
+
+One record per line, the last line of a book wins:
+
+    {"book_id": 1342, "title": "Pride and Prejudice", "author": "Jane Austen", "release_date": ...,
+     "language": "English", "subjects": [...], "translator": null, "encoding": "UTF-8"}
+
+Each parser batch appends (and fsyncs) only its new or changed records, after they were
+stored in the datamart and before the cursor past them is saved, so updating the catalog
+costs as much as the new books, not the whole file, and the parser's next diff against
+it never hides a row that did not reach the datamart. A line torn by a crash is ignored by readers and cut off before the next
+append. When the file holds more than COMPACT_RATIO lines per live book it is compacted:
+rewritten atomically with the latest record per book, in book ID order.
+
+A process keeps the parsed catalog of each path in memory (open_catalog) and only
+reads what other processes appended since, so later cycles never re-parse the file.
+A pretty-printed catalog.json from older versions is imported on first use.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from inverted_index.checkpoint import read_json, write_atomic
+
+COMPACT_RATIO = 2.0
+# Files smaller than this are not worth compacting
+COMPACT_MIN_LINES = 1000
+
+_catalogs: Dict[Path, "Catalog"] = {}
+_catalogs_lock = threading.Lock()
+
+
+def _encode(book_id: str, meta: dict) -> str:
+    return json.dumps({"book_id": int(book_id), **meta}, ensure_ascii=False) + "\n"
+
+
+class Catalog:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records: Dict[str, dict] = {}
+        self.lines = 0
+        # Offset just past the last complete line read, and the file it belongs to
+        self.offset = 0
+        self._file_id = None
+
+    def _stat(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_size, (st.st_dev, st.st_ino)
+
+    def refresh(self) -> "Catalog":
+        """
+        Reads what was appended since the last call; reloads from scratch if the file was
+        replaced (compacted) or truncated. Raises ValueError on a corrupt complete line.
+        """
+        stat = self._stat()
+        if stat is None:
+            return self
+        size, file_id = stat
+        if file_id != self._file_id or size < self.offset:
+            self.records, self.lines, self.offset = {}, 0, 0
+            self._file_id = file_id
+        if size == self.offset:
+            return self
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        for raw in data.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break  # torn by a crash mid-append
+            self.offset += len(raw)
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+                book_id = str(record.pop("book_id"))
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"Corrupt catalog line at byte {self.offset - len(raw)} of {self.path}") from e
+            self.records[book_id] = record
+            self.lines += 1
+        return self
+
+    def _import_legacy(self) -> None:
+        legacy = self.path.with_suffix(".json")
+        if legacy == self.path or not legacy.exists():
+            return
+        try:
+            data = read_json(legacy, {})
+        except ValueError:
+            print(f"Warning: old catalog {legacy} is corrupt, not imported")
+            return
+        if isinstance(data, dict) and data:
+            self.records = {str(k): v for k, v in data.items()}
+            self.compact()
+            print(f"Imported {len(self.records)} records from the old catalog {legacy} into {self.path}")
+
+    def get(self, book_id) -> Optional[dict]:
+        return self.records.get(str(book_id))
+
+    def append(self, records: Dict[str, dict]) -> int:
+        """
+        Appends `records` (book_id -> metadata) and fsyncs them. Returns the bytes written.
+        """
+        if not records:
+            return 0
+        self.refresh()
+        data = "".join(_encode(book_id, meta) for book_id, meta in records.items()).encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            if f.tell() > self.offset:
+                f.truncate(self.offset)  # a line torn by a crash
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._file_id = self._stat()[1]
+        self.offset += len(data)
+        self.lines += len(records)
+        self.records.update((str(book_id), meta) for book_id, meta in records.items())
+        return len(data)
+
+    def needs_compaction(self) -> bool:
+        return self.lines >= COMPACT_MIN_LINES and self.lines > COMPACT_RATIO * len(self.records)
+
+    def compact(self) -> None:
+        """
+        Atomically rewrites the file with the latest record per book, in book ID order.
+        """
+        ordered = sorted(self.records.items(), key=lambda item: int(item[0]))
+        data = "".join(_encode(book_id, meta) for book_id, meta in ordered).encode("utf-8")
+        write_atomic(self.path, data)
+        self.records = dict(ordered)
+        self.lines = len(ordered)
+        self.offset = len(data)
+        self._file_id = self._stat()[1]
+
+
+def open_catalog(path) -> Catalog:
+    """
+    The process-wide Catalog for `path`, brought up to date with the file.
+    """
+    key = Path(path).resolve()
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = _catalogs[key] = Catalog(path)
+            if not catalog.path.exists():
+                catalog._import_legacy()
+    return catalog.refresh()
+
+
+def forget_catalog(path) -> None:
+    """
+    Drops the cached copy of `path`, e.g. before deleting the file to start over.
+    """
+    with _catalogs_lock:
+        _catalogs.pop(Path(path).resolve(), None)
+
+
+def load_catalog(path) -> Dict[str, dict]:
+    """
+    book_id -> latest metadata record of the catalog at `path` (read from scratch).
+    A ".json" path is read as an old-style catalog (one JSON object).
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Catalog not found: {path}")
+    if path.suffix == ".json":
+        data = read_json(path)
+        if not isinstance(data, dict):
+            raise ValueError("Catalog JSON must be a dict of {book_id: metadata}")
+        return data
+    return Catalog(path).refresh().records
@@ -0,0 +1,99 @@
+"""
+Crash-safe file writes shared by the indexer, the metadata parser and Control.
+
+Every checkpoint file (segments, segment manifest, progress cursors, catalog) is
+written to a temp file next to it, fsync'ed, and renamed over the old one, then the
+directory entry is fsync'ed. A crash at any point leaves either the old or the new
+file, never a truncated one. Data is always committed before the cursor that points
+past it, so after a crash the worst case is re-processing the last batch.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Optional
+
+TMP_SUFFIX = ".tmp"
+
+
+def fsync_dir(directory: Path) -> None:
+    # Persists a rename; directories cannot be opened for fsync on Windows
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data: bytes) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + TMP_SUFFIX)
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+
+
+@contextmanager
+def atomic_file(path, mode: str = "w"):
+    """
+    Like write_atomic, for files written piece by piece: yields the temp file, then
+    fsyncs and renames it over `path`. If the block raises, the temp file is removed
+    and `path` is left as it was.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + TMP_SUFFIX)
+    encoding = None if "b" in mode else "utf-8"
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+
+
+def write_json_atomic(path, data: Any, indent: Optional[int] = None) -> None:
+    separators = None if indent else (",", ":")
+    text = json.dumps(data, ensure_ascii=False, indent=indent, separators=separators)
+    write_atomic(path, text.encode("utf-8"))
+
+
+def read_json(path, default: Any = None) -> Any:
+    """
+    Returns the parsed file, `default` if it does not exist, and raises ValueError
+    if it is torn (e.g. written by an older, non-atomic version and cut short).
+    """
+    path = Path(path)
+    if not path.exists():
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def remove_stale_tmp(directory) -> int:
+    """
+    Deletes temp files left behind by writes interrupted before their rename.
+    """
+    directory = Path(directory)
+    if not directory.exists():
+        return 0
+    removed = 0
+    for tmp in directory.glob("*" + TMP_SUFFIX):
+        if tmp.is_file():
+            tmp.unlink()
+            removed += 1
+    return removed
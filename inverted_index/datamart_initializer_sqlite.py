@@ -2,6 +2,9 @@ import sqlite3
 from pathlib import Path
 import argparse
 
+# Columns added after the first release, migrated into existing datamarts
+ADDED_COLUMNS = ("subjects", "translator", "encoding")
+
 
 def init_datamart(db_path: str = "datamart/datamart.db") -> None:
     """
@@ -13,12 +16,18 @@ def init_datamart(db_path: str = "datamart/datamart.db") -> None:
       - author TEXT
       - release_date TEXT
       - language TEXT
+      - subjects TEXT ("; "-separated)
+      - translator TEXT
+      - encoding TEXT
+    Datamarts created before the last three columns existed get them added.
     """
     db_file = Path(db_path)
     db_file.parent.mkdir(parents=True, exist_ok=True)
 
     with sqlite3.connect(db_file) as conn:
         cur = conn.cursor()
+        # WAL is persistent: readers (search service) are no longer blocked by pipeline writes
+        cur.execute("PRAGMA journal_mode=WAL")
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS books (
@@ -26,10 +35,17 @@ def init_datamart(db_path: str = "datamart/datamart.db") -> None:
                 title TEXT,
                 author TEXT,
                 release_date TEXT,
-                language TEXT
+                language TEXT,
+                subjects TEXT,
+                translator TEXT,
+                encoding TEXT
             )
             """
         )
+        existing = {row[1] for row in cur.execute("PRAGMA table_info(books)")}
+        for column in ADDED_COLUMNS:
+            if column not in existing:
+                cur.execute(f"ALTER TABLE books ADD COLUMN {column} TEXT")
         conn.commit()
 
     print(f"Datamart initialized at: {db_file}")
@@ -0,0 +1,300 @@
+"""
+Full-text search backend stored next to the 'books' table of the datamart.
+
+Book bodies go into a contentless FTS5 table (content=''): SQLite keeps only the
+inverted index and uses the book_id as rowid, the text itself stays in the datalake.
+Queries rank with bm25() and join 'books' for metadata and filters in one statement.
+
+A contentless table can only forget a document given the exact text it indexed, so
+books_fts_docs records, per book, the hash of the indexed body and the manifest entry
+it was read from. When a refreshed book changes, the old body is read back from the
+datalake and removed with FTS5's 'delete' command before the new one is inserted. If
+the old body is gone (a loose file overwritten within the same hour), the table is
+rebuilt from the bodies books_fts_docs points to.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from crawler.manifest import body_hash, pending_batches, read_entries
+from crawler.storage import read_part
+from control.metrics import METRICS, log
+from inverted_index.indexer import load_progress, save_progress
+from inverted_index.metadata_store import connect_for_write
+from inverted_index.ranking import tokenize_query
+
+
+FTS_TABLE = "books_fts"
+DOCS_TABLE = "books_fts_docs"
+
+
+def init_fts(db_path: str) -> None:
+    db_file = Path(db_path)
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                body,
+                content='',
+                tokenize='unicode61 remove_diacritics 0'
+            )
+            """
+        )
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {DOCS_TABLE} (book_id INTEGER PRIMARY KEY, hash TEXT, entry TEXT NOT NULL)"
+        )
+
+
+def _indexed_versions(cur: sqlite3.Cursor, book_ids: List[int]) -> Dict[int, Tuple[Optional[str], dict]]:
+    # book_id -> (hash, manifest entry) of the body in the FTS table
+    placeholders = ",".join("?" * len(book_ids))
+    cur.execute(f"SELECT book_id, hash, entry FROM {DOCS_TABLE} WHERE book_id IN ({placeholders})", book_ids)
+    return {r[0]: (r[1], json.loads(r[2])) for r in cur.fetchall()}
+
+
+def _text_hash(body: str) -> str:
+    return body_hash(body.encode("utf-8"))
+
+
+def _adopt_legacy_rows(conn: sqlite3.Connection, datalake: Path, manifest_offset: Optional[int]) -> None:
+    """
+    Fills books_fts_docs for an FTS table built by older versions, which indexed the first
+    manifest entry of each book and skipped later ones. The hash is left unknown.
+    """
+    if conn.execute(f"SELECT 1 FROM {DOCS_TABLE} LIMIT 1").fetchone():
+        return
+    if not conn.execute(f"SELECT 1 FROM {FTS_TABLE} LIMIT 1").fetchone():
+        return
+    indexed = {r[0] for r in conn.execute(f"SELECT rowid FROM {FTS_TABLE}")}
+    first: Dict[int, dict] = {}
+    for entry, end in read_entries(datalake):
+        if manifest_offset is not None and end > manifest_offset:
+            break
+        if entry["book_id"] in indexed:
+            first.setdefault(entry["book_id"], entry)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {DOCS_TABLE}(book_id, hash, entry) VALUES (?, NULL, ?)",
+            [(book_id, json.dumps(entry)) for book_id, entry in first.items()],
+        )
+    log(1, f"FTS index: recorded the indexed version of {len(first)} books from an older version")
+
+
+def _rebuild(cur: sqlite3.Cursor, datalake: Path) -> int:
+    """
+    Re-indexes every book from the body books_fts_docs points to, in the caller's
+    transaction. Returns the number of books.
+    """
+    rows = cur.execute(f"SELECT book_id, entry FROM {DOCS_TABLE}").fetchall()
+    cur.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+    inserted = 0
+    for book_id, entry in rows:
+        body = read_part(datalake, json.loads(entry), "body")
+        if body is None:
+            cur.execute(f"DELETE FROM {DOCS_TABLE} WHERE book_id = ?", (book_id,))
+            continue
+        cur.execute(f"INSERT INTO {FTS_TABLE}(rowid, body) VALUES (?, ?)", (book_id, body))
+        cur.execute(f"UPDATE {DOCS_TABLE} SET hash = ? WHERE book_id = ?", (_text_hash(body), book_id))
+        inserted += 1
+    return inserted
+
+
+def build_fts_index(datalake_path: str, db_path: str, progress_path: str = "indexer/progress_fts.json") -> int:
+    """
+    Bulk-inserts the bodies of the books added to the datalake manifest since the last run,
+    replacing the indexed body of books whose text changed.
+    One transaction per day/hour batch; progress uses the same cursor format as the indexer.
+    Returns the number of books inserted or replaced.
+    """
+    datalake = Path(datalake_path)
+    init_fts(db_path)
+
+    progress = load_progress(progress_path)
+    last_indexed_id = progress["last_indexed_id"]
+    inserted = replaced = 0
+
+    conn = connect_for_write(Path(db_path))
+    try:
+        _adopt_legacy_rows(conn, datalake, progress.get("manifest_offset"))
+        for day_name, hour_name, entries, offset in pending_batches(datalake, progress):
+            if entries:
+                with conn:
+                    cur = conn.cursor()
+                    rebuild = False
+                    indexed = _indexed_versions(cur, sorted({e["book_id"] for e in entries}))
+                    for e in entries:
+                        book_id = e["book_id"]
+                        body = read_part(datalake, e, "body")
+                        if body is None:
+                            continue
+                        data = body.encode("utf-8")
+                        METRICS.inc("bytes_read_total", len(data), stage="fts")
+                        digest = body_hash(data)
+                        old = indexed.get(book_id)
+                        if old is not None:
+                            old_hash, old_entry = old
+                            if digest == old_hash:
+                                continue
+                            old_body = read_part(datalake, old_entry, "body")
+                            if old_body is None or (old_hash is not None and _text_hash(old_body) != old_hash):
+                                log(1, f"FTS index: the indexed text of book {book_id} is gone, rebuilding")
+                                rebuild = True
+                            else:
+                                cur.execute(
+                                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', ?, ?)",
+                                    (book_id, old_body),
+                                )
+                            replaced += 1
+                        else:
+                            inserted += 1
+                        if not rebuild:
+                            cur.execute(f"INSERT INTO {FTS_TABLE}(rowid, body) VALUES (?, ?)", (book_id, body))
+                        cur.execute(
+                            f"INSERT OR REPLACE INTO {DOCS_TABLE}(book_id, hash, entry) VALUES (?, ?, ?)",
+                            (book_id, digest, json.dumps(e)),
+                        )
+                        indexed[book_id] = (digest, e)
+                        METRICS.inc("books_processed_total", stage="fts")
+                    if rebuild:
+                        log(1, f"FTS index: rebuilt '{FTS_TABLE}' with {_rebuild(cur, datalake)} books")
+                last_indexed_id = max([last_indexed_id] + [e["book_id"] for e in entries])
+            save_progress(progress_path, day_name, hour_name, last_indexed_id, offset)
+    finally:
+        conn.close()
+
+    log(1, f"FTS index: {inserted} books added to '{FTS_TABLE}', {replaced} changed books replaced")
+    return inserted + replaced
+
+
+def to_match_query(query: str, mode: str = "and") -> Optional[str]:
+    words = tokenize_query(query)
+    if not words:
+        return None
+    joiner = " OR " if mode == "or" else " AND "
+    return joiner.join(f'"{w}"' for w in words)
+
+
+class FtsSearcher:
+    """
+    Read-only searcher over books_fts + books.
+    """
+
+    SQL = f"""
+        SELECT b.book_id, b.title, b.author, b.language, -bm25({FTS_TABLE}) AS score
+        FROM {FTS_TABLE}
+        JOIN books b ON b.book_id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+          AND (? IS NULL OR lower(b.author) LIKE '%' || lower(?) || '%')
+          AND (? IS NULL OR lower(b.language) LIKE lower(?) || '%')
+        ORDER BY bm25({FTS_TABLE}), b.book_id
+        LIMIT ? OFFSET ?
+    """
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        self.conn.close()
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        mode: str = "and",
+        author: Optional[str] = None,
+        language: Optional[str] = None,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        match = to_match_query(query, mode)
+        if match is None:
+            return []
+        rows = self.conn.execute(self.SQL, (match, author, author, language, language, k, offset)).fetchall()
+        return [
+            {"book_id": r[0], "title": r[1], "author": r[2], "language": r[3], "score": r[4]}
+            for r in rows
+        ]
+
+
+def benchmark(db_path: str, index_path: str, queries: List[str], k: int = 10, repeat: int = 3) -> dict:
+    """
+    Times the same queries against the FTS5 backend and the Python engine over the
+    JSON/segment/binary index (load time included).
+    """
+    from inverted_index.query import QueryEngine, benchmark as query_benchmark, load_index
+
+    t0 = time.perf_counter()
+    engine = QueryEngine(load_index(index_path))
+    index_load = time.perf_counter() - t0
+    index_result = query_benchmark(engine, queries, k, "and", repeat)
+    index_result["load_seconds"] = round(index_load, 4)
+
+    t0 = time.perf_counter()
+    searcher = FtsSearcher(db_path)
+    fts_load = time.perf_counter() - t0
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            t1 = time.perf_counter()
+            searcher.search(q, k)
+            latencies.append(time.perf_counter() - t1)
+    total = time.perf_counter() - start
+    searcher.close()
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    fts_result = {
+        "queries": len(latencies),
+        "seconds": round(total, 4),
+        "qps": round(len(latencies) / total, 2) if total else 0.0,
+        "p50_ms": round(pct(0.50), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "load_seconds": round(fts_load, 4),
+    }
+    return {"fts5": fts_result, "index": index_result}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="SQLite FTS5 search backend.")
+    ap.add_argument("--db", default="datamart/datamart.db")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Add new datalake books to the FTS table")
+    b.add_argument("--datalake", default="datalake")
+    b.add_argument("--progress", default="indexer/progress_fts.json")
+
+    s = sub.add_parser("search", help="Run one query")
+    s.add_argument("query")
+    s.add_argument("--k", type=int, default=10)
+    s.add_argument("--mode", choices=["and", "or"], default="and")
+    s.add_argument("--author")
+    s.add_argument("--language")
+
+    c = sub.add_parser("bench", help="Compare against the inverted index on the same queries")
+    c.add_argument("--index", default="index/segments")
+    c.add_argument("--queries", type=Path, required=True, help="File with one query per line")
+    c.add_argument("--k", type=int, default=10)
+    c.add_argument("--repeat", type=int, default=3)
+
+    args = ap.parse_args()
+    if args.cmd == "build":
+        build_fts_index(args.datalake, args.db, args.progress)
+    elif args.cmd == "search":
+        searcher = FtsSearcher(args.db)
+        for row in searcher.search(args.query, args.k, args.mode, args.author, args.language):
+            print(f"{row['book_id']}\t{row['score']:.4f}\t{row['title']}")
+        searcher.close()
+    else:
+        queries = [q.strip() for q in args.queries.read_text(encoding="utf-8").splitlines() if q.strip()]
+        print(json.dumps(benchmark(args.db, args.index, queries, args.k, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
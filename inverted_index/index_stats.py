@@ -0,0 +1,125 @@
+"""
+Collection statistics: N, document frequencies and document lengths.
+
+Every segment carries its own statistics next to it (segments.segment_stats), written
+with the segment and replaced with it by merges, so indexing never rewrites statistics
+of the whole collection. collection_stats combines them at load time; a book re-indexed
+by a newer segment is subtracted through that segment's "removed" counts.
+Document lengths are the ones the index keeps: 0 for books in docs-only segments.
+
+For the Java search service, Control writes the combined statistics as a single
+sidecar next to the JSON export (index/stats.json, with --json-export):
+
+    {"analysis": "light", "manifest_offset": 123456, "N": 70000, "total_length": ...,
+     "avgdl": ..., "terms": ..., "df": {"whale": 812, ...}, "doc_lengths": {"1342": 121533, ...},
+     "stopwords": [...]}
+
+    python -m inverted_index.index_stats --segments index/segments --output index/stats.json
+"""
+
+import argparse
+from typing import Dict
+
+from inverted_index.analysis import all_stopwords
+from inverted_index.checkpoint import read_json, write_json_atomic
+from inverted_index.segments import (
+    close_segments, iter_merged_postings, merge_doc_lengths, open_segments, segment_stats, union_postings,
+)
+
+
+def _new_stats(manifest: dict) -> dict:
+    return {
+        "analysis": manifest.get("analysis", "none"),
+        "manifest_offset": (manifest.get("checkpoint") or {}).get("manifest_offset"),
+        "df": {},
+        "doc_lengths": {},
+    }
+
+
+def collection_stats(segments_dir: str) -> dict:
+    """
+    {"analysis", "manifest_offset", "df", "doc_lengths"} of the live segments, combined
+    from their statistics sidecars.
+    """
+    manifest, sidecars = segment_stats(segments_dir)
+    stats = _new_stats(manifest)
+    df: Dict[str, int] = stats["df"]
+    lengths: Dict[str, int] = stats["doc_lengths"]
+    for sidecar in sidecars:
+        for word, n in sidecar["df"].items():
+            df[word] = df.get(word, 0) + n
+        lengths.update(sidecar["doc_lengths"])
+    for sidecar in sidecars:
+        for word, n in sidecar["removed"].items():
+            left = df.get(word, 0) - n
+            if left > 0:
+                df[word] = left
+            else:
+                df.pop(word, None)
+    return stats
+
+
+def compute_stats(segments_dir: str) -> dict:
+    """
+    Same as collection_stats, counted from the postings themselves: streamed from the
+    segment files term by term.
+    """
+    manifest, readers = open_segments(segments_dir)
+    try:
+        stats = _new_stats(manifest)
+        stats["df"] = {word: len(ids) for word, ids in iter_merged_postings(readers)}
+        headers = [reader.header() for reader in readers]
+        doc_lengths = merge_doc_lengths(headers)
+        doc_ids = union_postings([header["doc_ids"] for header in headers])
+        stats["doc_lengths"] = {str(book_id): doc_lengths.get(book_id, 0) for book_id in doc_ids}
+    finally:
+        close_segments(readers)
+    return stats
+
+
+def write_stats(path: str, stats: dict) -> None:
+    lengths = stats["doc_lengths"]
+    total = sum(lengths.values())
+    stopwords = all_stopwords() if stats["analysis"] != "none" else ()
+    write_json_atomic(path, {
+        "analysis": stats["analysis"],
+        "manifest_offset": stats["manifest_offset"],
+        "N": len(lengths),
+        "total_length": total,
+        "avgdl": round(total / len(lengths), 3) if lengths else 0.0,
+        "terms": len(stats["df"]),
+        "df": dict(sorted(stats["df"].items())),
+        "doc_lengths": dict(sorted(lengths.items(), key=lambda item: int(item[0]))),
+        "stopwords": sorted(stopwords),
+    })
+
+
+def export_stats(segments_dir: str, output_path: str) -> int:
+    """
+    Writes the single statistics sidecar of the index. Returns the number of terms.
+    """
+    stats = collection_stats(segments_dir)
+    write_stats(output_path, stats)
+    return len(stats["df"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write or inspect the collection statistics of an index.")
+    ap.add_argument("--segments", default="index/segments", help="Segments directory")
+    ap.add_argument("--output", default="index/stats.json")
+    ap.add_argument("--recount", action="store_true",
+                    help="Count from the postings instead of combining the segments' statistics")
+    ap.add_argument("--top", type=int, default=20, help="Show the N most frequent terms")
+    args = ap.parse_args()
+
+    stats = compute_stats(args.segments) if args.recount else collection_stats(args.segments)
+    write_stats(args.output, stats)
+    stats = read_json(args.output)
+    print(f"{stats['N']} books, {stats['terms']} terms, avg length {stats['avgdl']} "
+          f"(analysis: {stats['analysis']}) -> {args.output}")
+    for word, df in sorted(stats["df"].items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{df:>8}  {word}")
+
+
+if __name__ == "__main__":
+    main()
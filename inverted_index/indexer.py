@@ -1,28 +1,67 @@
-import os
-import json
 import re
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
+from inverted_index.analysis import get_analyzer
+from inverted_index.postings import TermPostings, merge_into
+from inverted_index.checkpoint import read_json, write_json_atomic
+from inverted_index.segments import load_manifest, write_segment, import_json_index, recover_segments, set_analysis
+from inverted_index.spimi import SpimiBuilder, peak_rss_mb
+from crawler.manifest import pending_batches
+from crawler.storage import iter_text, read_part
+from control.metrics import METRICS, log
 
-def load_progress(progress_path: str):
-    if os.path.exists(progress_path):
-        with open(progress_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"last_day": None, "last_hour": None, "last_indexed_id": -1}
 
+# Segment directories already checked for crash leftovers by this process
+_recovered_dirs = set()
+
+
+def load_progress(progress_path: str):
+    default = {"last_day": None, "last_hour": None, "last_indexed_id": -1}
+    try:
+        return read_json(progress_path, default)
+    except ValueError:
+        print(f"Warning: progress file {progress_path} is corrupt, starting from the beginning")
+        return default
 
-def save_progress(progress_path: str, last_day: str, last_hour: str, last_id: int):
-    progress_file = Path(progress_path)
-    progress_file.parent.mkdir(parents=True, exist_ok=True)
 
-    data = {
+def progress_record(last_day: str, last_hour: str, last_id: int, manifest_offset: int = None) -> dict:
+    return {
         "last_day": last_day,
         "last_hour": last_hour,
-        "last_indexed_id": last_id
+        "last_indexed_id": last_id,
+        "manifest_offset": manifest_offset,
     }
 
-    with open(progress_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+
+def save_progress(progress_path: str, last_day: str, last_hour: str, last_id: int, manifest_offset: int = None):
+    write_json_atomic(progress_path, progress_record(last_day, last_hour, last_id, manifest_offset), indent=2)
+
+
+def _recover(segments_dir: Path, progress_path: str, progress: dict) -> dict:
+    """
+    Startup check: removes leftovers of an interrupted run and, if the segment manifest
+    holds a newer checkpoint than the progress file (crash between committing a segment
+    and saving the cursor), continues from that checkpoint instead of re-indexing.
+    """
+    if str(segments_dir) not in _recovered_dirs:
+        _recovered_dirs.add(str(segments_dir))
+        recover_segments(str(segments_dir))
+
+    checkpoint = load_manifest(str(segments_dir)).get("checkpoint")
+    if not checkpoint:
+        return progress
+    saved = progress.get("manifest_offset")
+    if saved is None or saved < checkpoint["manifest_offset"]:
+        print(f"Recovered indexer progress from the segment manifest (last ID: {checkpoint['last_indexed_id']})")
+        write_json_atomic(progress_path, checkpoint, indent=2)
+        return checkpoint
+    return progress
 
 
 def extract_book_id(filename: str) -> int:
@@ -30,84 +69,217 @@ def extract_book_id(filename: str) -> int:
     return int(match.group(1)) if match else -1
 
 
-def build_inverted_index(datalake_path: str, output_path: str, progress_path: str = "indexer/progress.json"):
-    datalake = Path(datalake_path)
-    output = Path(output_path)
+def _book_language(datalake: str, entry: dict):
+    # Imported here: metadata_parser itself imports this module
+    from inverted_index.metadata_parser import parse_header_metadata
+    header = read_part(datalake, entry, "header")
+    return parse_header_metadata(header)["language"] if header else None
 
-    progress = load_progress(progress_path)
-    last_day = progress["last_day"]
-    last_hour = progress["last_hour"]
-    last_indexed_id = progress["last_indexed_id"]
 
-    print(f"Last progress: day={last_day}, hour={last_hour}, id={last_indexed_id}")
+def _book_terms(chunks: Iterable[str], analyzer, postings_format: str):
+    """
+    Streams one book's text chunks into its terms without building the full word list:
+    a set ("docs"), a Counter ("freqs") or word -> array of position deltas ("positions").
+    Returns (terms, number of tokens).
+    """
+    length = 0
+    if postings_format == "docs":
+        terms = set()
+        for words in analyzer.analyze_chunks(chunks):
+            terms.update(words)
+            length += len(words)
+        return terms, length
+    if postings_format == "freqs":
+        counts = Counter()
+        for words in analyzer.analyze_chunks(chunks):
+            counts.update(words)
+            length += len(words)
+        return counts, length
 
-    if output.exists():
-        with open(output, "r", encoding="utf-8") as f:
-            inverted_index = json.load(f)
-    else:
-        inverted_index = {}
+    last_pos: Dict[str, int] = {}
+    deltas: Dict[str, array] = {}
+    for words in analyzer.analyze_chunks(chunks):
+        for pos, word in enumerate(words, length):
+            prev = last_pos.get(word)
+            word_deltas = deltas.get(word)
+            if word_deltas is None:
+                word_deltas = deltas[word] = array("I")
+            word_deltas.append(pos if prev is None else pos - prev)
+            last_pos[word] = pos
+        length += len(words)
+    return deltas, length
 
-    for day_folder in sorted(datalake.iterdir()):
-        if not day_folder.is_dir():
-            continue
-        day_name = day_folder.name
 
-        if last_day and day_name < last_day:
+def index_books(books: List[Tuple[int, dict]], postings_format: str = "docs", datalake: str = "datalake",
+                analysis: str = "none"):
+    """
+    Builds partial postings for a run of (book_id, manifest entry) pairs given in ascending ID order;
+    bodies are streamed from `datalake` in bounded chunks, in whatever layout the entry points to.
+    Words come from the `analysis` scheme (see inverted_index.analysis), picked per book from
+    the header's language.
+    Returns (word -> TermPostings, indexed book IDs, book_id -> token count); books without any
+    word are skipped. Top-level so it can run in worker processes.
+    """
+    postings: Dict[str, TermPostings] = {}
+    indexed_ids: List[int] = []
+    doc_lengths: Dict[int, int] = {}
+    for book_id, entry in books:
+        language = _book_language(datalake, entry) if analysis != "none" else None
+        analyzer = get_analyzer(analysis, language)
+        terms, length = _book_terms(iter_text(datalake, entry, "body"), analyzer, postings_format)
+        if not length:
             continue
 
-        for hour_folder in sorted(day_folder.iterdir()):
-            if not hour_folder.is_dir():
-                continue
-            hour_name = hour_folder.name
+        if postings_format == "docs":
+            for word in terms:
+                p = postings.get(word)
+                if p is None:
+                    p = postings[word] = TermPostings(postings_format)
+                p.append(book_id)
+        elif postings_format == "freqs":
+            for word, tf in terms.items():
+                p = postings.get(word)
+                if p is None:
+                    p = postings[word] = TermPostings(postings_format)
+                p.append(book_id, tf)
+        else:
+            for word, word_deltas in terms.items():
+                p = postings.get(word)
+                if p is None:
+                    p = postings[word] = TermPostings(postings_format)
+                p.append(book_id, len(word_deltas), word_deltas)
 
-            if last_day == day_name and last_hour and hour_name < last_hour:
-                continue
+        indexed_ids.append(book_id)
+        doc_lengths[book_id] = length
+    return postings, indexed_ids, doc_lengths
 
-            print(f"Processed day/hour {day_name}/{hour_name} ...")
 
-            txt_files = list(hour_folder.glob("*.txt"))
-            if not txt_files:
-                continue
+def _chunks(items: list, n: int) -> List[list]:
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 
-            book_ids = sorted(set(extract_book_id(f.name) for f in txt_files if extract_book_id(f.name) != -1))
+def _index_hour(books: List[Tuple[int, dict]], executor, workers: int, postings_format: str, datalake: str,
+                analysis: str):
+    if executor is None or len(books) < 2:
+        return index_books(books, postings_format, datalake, analysis)
 
-            for book_id in book_ids:
-                if (
-                    last_day == day_name
-                    and last_hour == hour_name
-                    and book_id <= last_indexed_id
-                ):
-                    continue
+    # Chunks are contiguous ID ranges merged back in order, so postings stay
+    # sorted and the result is identical to a serial run.
+    postings: Dict[str, TermPostings] = {}
+    indexed_ids: List[int] = []
+    doc_lengths: Dict[int, int] = {}
+    task = partial(index_books, postings_format=postings_format, datalake=datalake, analysis=analysis)
+    for part, ids, lengths in executor.map(task, _chunks(books, workers * 4)):
+        merge_into(postings, part)
+        indexed_ids.extend(ids)
+        doc_lengths.update(lengths)
+    return postings, indexed_ids, doc_lengths
 
-                body_file = hour_folder / f"{book_id}_body.txt"
-                if not body_file.exists():
-                    continue
 
-                with open(body_file, "r", encoding="utf-8") as f:
-                    text = f.read().lower()
+def _record_segment(segments_dir: Path, segment: dict):
+    METRICS.inc("bytes_written_total", (Path(segments_dir) / segment["name"]).stat().st_size, stage="indexer")
+    log(1, f"Segment written: {segment['name']} ({segment['docs']} books, {segment['terms']} words)")
 
-                words = re.findall(r'\b[a-záéíóúüñ]+\b', text)
-                if not words:
-                    continue
 
-                for word in set(words):
-                    if word not in inverted_index:
-                        inverted_index[word] = [book_id]
-                    elif book_id not in inverted_index[word]:
-                        inverted_index[word].append(book_id)
+def build_inverted_index(
+    datalake_path: str,
+    output_path: str,
+    progress_path: str = "indexer/progress.json",
+    segments_path: str = None,
+    workers: int = 1,
+    postings_format: str = "docs",
+    memory_budget_mb: float = None,
+    analysis: str = "none",
+    book_filter: Optional[Callable[[int], bool]] = None,
+):
+    """
+    Indexes the books added to the datalake since the last run, reading only the
+    datalake manifest entries after the saved cursor.
+    Each day/hour batch produces a new immutable segment under `segments_path`
+    (default: a "segments" folder next to `output_path`) holding only the newly indexed books.
+    The single-file JSON at `output_path` is only read to migrate a legacy index;
+    use segments.export_json to regenerate it.
+    With `workers` > 1 the books of each batch are tokenized by a pool of processes.
+    `postings_format` selects "docs" (book IDs only), "freqs" (term frequencies and
+    document lengths, for BM25) or "positions" (also token positions, for phrase queries).
+    With `memory_budget_mb` the whole run is built SPIMI-style into a single segment:
+    postings are flushed to sorted run files whenever the budget is reached and merged
+    at the end; progress is only saved once that segment is written.
+    `analysis` is the text analysis scheme ("none" or "light": per-language stopwords and
+    stemming); it cannot change once segments exist. Each segment is written with its collection
+    statistics (document frequencies, lengths; see index_stats).
+    With `book_filter`, only the books it accepts are indexed (one shard, see inverted_index.shards);
+    the cursor still moves past the others.
+    """
+    datalake = Path(datalake_path)
+    output = Path(output_path)
+    segments_dir = Path(segments_path) if segments_path else output.parent / "segments"
+
+    progress = _recover(segments_dir, progress_path, load_progress(progress_path))
+    last_day = progress["last_day"]
+    last_hour = progress["last_hour"]
+    last_indexed_id = progress["last_indexed_id"]
 
+    log(1, f"Last progress: day={last_day}, hour={last_hour}, id={last_indexed_id}")
+
+    if output.exists() and not load_manifest(str(segments_dir))["segments"]:
+        if analysis == "none":
+            log(1, f"Migrating legacy index {output} into segments ...")
+            import_json_index(str(segments_dir), str(output))
+        else:
+            log(1, f"Not migrating legacy index {output}: it was built without analysis")
+    set_analysis(str(segments_dir), analysis)
+
+    day_name, hour_name = last_day, last_hour
+    builder = SpimiBuilder(str(segments_dir), memory_budget_mb, postings_format) if memory_budget_mb else None
+    checkpoint = None
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
+    with pool as executor:
+        for day_name, hour_name, entries, offset in pending_batches(datalake, progress):
+            log(1, f"Processed day/hour {day_name}/{hour_name} ...")
+
+            # Postings for this batch only; entries ascend by ID, so every list stays sorted
+            if book_filter is not None:
+                entries = [e for e in entries if book_filter(e["book_id"])]
+            pending = [(e["book_id"], e) for e in entries]
+            postings, indexed_ids, doc_lengths = _index_hour(
+                pending, executor, workers, postings_format, str(datalake), analysis
+            )
+            for book_id in indexed_ids:
                 last_indexed_id = max(last_indexed_id, book_id)
-                print(f"Indexed book with ID {book_id} ({day_name}/{hour_name})")
+                log(2, f"Indexed book with ID {book_id} ({day_name}/{hour_name})")
+            METRICS.inc("books_processed_total", len(indexed_ids), stage="indexer")
+            METRICS.inc("bytes_read_total", sum(e.get("size", 0) for e in entries), stage="indexer")
+            if len(indexed_ids) < len(entries):
+                METRICS.inc("failures_total", len(entries) - len(indexed_ids), stage="indexer", reason="no_words")
+
+            checkpoint = progress_record(day_name, hour_name, last_indexed_id, offset)
+            if builder:
+                builder.add(postings, indexed_ids, doc_lengths)
+                continue
+
+            # The cursor is committed with the segment; the progress file follows it
+            segment = write_segment(str(segments_dir), postings, indexed_ids, postings_format, doc_lengths, checkpoint)
+            if segment:
+                _record_segment(segments_dir, segment)
 
-            # Ordenar y limpiar duplicados antes de guardar
-            for word in inverted_index:
-                inverted_index[word] = sorted(set(inverted_index[word]))
+            write_json_atomic(progress_path, checkpoint, indent=2)
+            log(1, f"Progress saved: {day_name}/{hour_name} (last ID: {last_indexed_id})")
 
-            output.parent.mkdir(parents=True, exist_ok=True)
-            with open(output, "w", encoding="utf-8") as out:
-                json.dump(inverted_index, out, ensure_ascii=False, indent=2)
+    if builder:
+        segment = builder.finish(checkpoint)
+        if segment:
+            _record_segment(segments_dir, segment)
+        if checkpoint:
+            write_json_atomic(progress_path, checkpoint, indent=2)
+            log(1, f"Progress saved: {checkpoint['last_day']}/{checkpoint['last_hour']} "
+                   f"(last ID: {checkpoint['last_indexed_id']})")
 
-            save_progress(progress_path, day_name, hour_name, last_indexed_id)
-            print(f"Progress saved: {day_name}/{hour_name} (last ID: {last_indexed_id})")
+    peak = peak_rss_mb()
+    if peak is not None:
+        METRICS.set("peak_rss_mb", peak, stage="indexer")
+        log(1, f"Peak RSS since process start: {peak:.1f} MB")
 
-    print(f"Last indexed day {last_day or day_name}/{last_hour or hour_name}")
+    log(1, f"Last indexed day {day_name}/{hour_name}")
@@ -1,175 +1,185 @@
-import os
-import json
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from crawler.manifest import pending_batches
+from crawler.storage import read_part
+from control.metrics import METRICS, log
+from inverted_index.catalog import forget_catalog, open_catalog
+from inverted_index.indexer import load_progress, save_progress
 
-def load_progress(progress_path: str):
-    if os.path.exists(progress_path):
-        with open(progress_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"last_day": None, "last_hour": None, "last_indexed_id": -1}
 
+def extract_book_id(filename: str) -> int:
+    match = re.search(r"(\d+)(?=_)", filename)
+    return int(match.group(1)) if match else -1
 
-def save_progress(progress_path: str, last_day: str, last_hour: str, last_id: int):
-    progress_file = Path(progress_path)
-    progress_file.parent.mkdir(parents=True, exist_ok=True)
-
-    data = {
-        "last_day": last_day,
-        "last_hour": last_hour,
-        "last_indexed_id": last_id,
-    }
 
-    with open(progress_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+# One pass over the header finds every "Field: value" line; the first occurrence of a
+# field wins, except for Subject, which may repeat.
+HEADER_FIELD_RE = re.compile(
+    r"^\s*(title|author|translator|release\s+date|language|character\s+set\s+encoding|subject)\s*:\s*(.+?)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+EBOOK_SUFFIX_RE = re.compile(r"\s*\[eBook\s*#\d+\]\s*$", re.IGNORECASE)
 
+HEADER_FIELDS = {
+    "title": "title",
+    "author": "author",
+    "translator": "translator",
+    "release date": "release_date",
+    "language": "language",
+    "character set encoding": "encoding",
+    "subject": "subjects",
+}
 
-def extract_book_id(filename: str) -> int:
-    match = re.search(r"(\d+)(?=_)", filename)
-    return int(match.group(1)) if match else -1
+METADATA_FIELDS = ("title", "author", "release_date", "language", "subjects", "translator", "encoding")
 
 
-def parse_header_metadata(text: str) -> Dict[str, Optional[str]]:
+def parse_header_metadata(text: str) -> Dict[str, Any]:
     """
-    Extracts Title, Author, Release date, and Language from a header text.
-    Matches are case-insensitive and line-based. Values are stripped; may be None if not found.
+    Extracts Title, Author, Release date, Language, Subject lines, Translator and
+    Character set encoding from a header text in a single pass.
+    Matches are case-insensitive and line-based. Values are stripped; may be None if not
+    found ("subjects" is a list, empty if none).
     """
-    patterns = {
-        "title": re.compile(r"^\s*Title\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
-        "author": re.compile(r"^\s*Author\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
-        "release_date": re.compile(r"^\s*Release\s+date\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
-        "language": re.compile(r"^\s*Language\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
-    }
-
-    result: Dict[str, Optional[str]] = {k: None for k in patterns.keys()}
-
-    for key, pattern in patterns.items():
-        m = pattern.search(text)
-        if m:
-            value = m.group(1).strip()
+    result: Dict[str, Any] = {k: None for k in METADATA_FIELDS}
+    result["subjects"] = []
+
+    for m in HEADER_FIELD_RE.finditer(text):
+        key = HEADER_FIELDS[" ".join(m.group(1).lower().split())]
+        value = m.group(2).strip()
+        if key == "subjects":
+            result["subjects"].append(value)
+        elif result[key] is None:
             # For release_date, drop trailing Gutenberg bracket like "[eBook #1234]" if present
             if key == "release_date":
-                value = re.sub(r"\s*\[eBook\s*#\d+\]\s*$", "", value, flags=re.IGNORECASE)
+                value = EBOOK_SUFFIX_RE.sub("", value)
             result[key] = value
 
     return result
 
 
+def parse_entry(entry: dict, datalake: str) -> Tuple[int, Optional[dict], int]:
+    """
+    Returns (book_id, parsed header or None if it is missing, header bytes read).
+    Top-level so it can run in worker processes.
+    """
+    header_text = read_part(datalake, entry, "header")
+    if header_text is None:
+        return entry["book_id"], None, 0
+    return entry["book_id"], parse_header_metadata(header_text), len(header_text.encode("utf-8"))
+
+
+def _parse_hour(entries: List[dict], executor, workers: int, datalake: str):
+    if executor is None or len(entries) < 2:
+        return [parse_entry(entry, datalake) for entry in entries]
+    # map() keeps the manifest order, so the last entry of a re-downloaded book still wins
+    chunksize = max(1, len(entries) // (workers * 4))
+    return list(executor.map(partial(parse_entry, datalake=datalake), entries, chunksize=chunksize))
+
+
 def build_metadata_catalog(
     datalake_path: str,
     output_path: str,
     progress_path: str = "metadata/progress_parser.json",
+    workers: int = 1,
+    store: Optional[Callable[[Dict[str, Dict[str, Any]]], Any]] = None,
 ):
     """
-    Traverses the datalake like the indexer, but parses header metadata for each book.
-    Writes a JSON mapping of book_id -> {title, author, release_date, language} and persists progress.
+    Reads the new datalake manifest entries like the indexer, but parses header metadata for each book.
+    Appends book_id -> {title, author, release_date, language, subjects, translator, encoding}
+    records to the JSON-lines catalog (see inverted_index.catalog) and persists progress.
+    With `workers` > 1 the headers of each batch are parsed by a pool of processes.
+    `store` (e.g. the datamart upsert) receives each batch's new or changed records before
+    they are committed to the catalog and the cursor: if it raises, the batch is parsed
+    again next time, and still counts as changed since the catalog does not hold it yet.
+    Returns only the records that are new or changed in this run, for an incremental datamart update.
     """
     datalake = Path(datalake_path)
     output = Path(output_path)
 
     progress = load_progress(progress_path)
+
+    try:
+        catalog = open_catalog(output)
+    except ValueError:
+        # Corrupt line: the cursor points past books whose records are lost, so start over
+        print(f"Warning: catalog {output} is corrupt, re-parsing all headers")
+        forget_catalog(output)
+        output.unlink()
+        catalog = open_catalog(output)
+        progress = {"last_day": None, "last_hour": None, "last_indexed_id": -1}
+
     last_day = progress["last_day"]
     last_hour = progress["last_hour"]
     last_indexed_id = progress["last_indexed_id"]
 
-    print(f"Last progress: day={last_day}, hour={last_hour}, id={last_indexed_id}")
-
-    # Load existing catalog if present
-    if output.exists():
-        with open(output, "r", encoding="utf-8") as f:
-            catalog = json.load(f)
-            # Ensure dict type
-            if not isinstance(catalog, dict):
-                catalog = {}
-    else:
-        catalog = {}
+    log(1, f"Last progress: day={last_day}, hour={last_hour}, id={last_indexed_id}")
 
     processed_any = False
+    changed: Dict[str, Dict[str, Any]] = {}
+    day_name, hour_name = last_day, last_hour
 
-    # Sort days lexicographically (YYYYMMDD works correctly as strings)
-    for day_folder in sorted(datalake.iterdir(), key=lambda p: p.name):
-        if not day_folder.is_dir():
-            continue
-        day_name = day_folder.name
-
-        if last_day and day_name < last_day:
-            continue
-
-        # Sort hours numerically to avoid "10" < "9" lexicographic issues
-        hour_folders = [p for p in day_folder.iterdir() if p.is_dir()]
-        hour_folders.sort(key=lambda p: int(p.name) if p.name.isdigit() else p.name)
-
-        for hour_folder in hour_folders:
-            hour_name = hour_folder.name
-
-            if last_day == day_name and last_hour and hour_name.isdigit() and last_hour.isdigit():
-                if int(hour_name) < int(last_hour):
-                    continue
-            elif last_day == day_name and last_hour and hour_name < last_hour:
-                # fallback to string compare if any name isn't numeric
-                continue
-
-            print(f"Processed day/hour {day_name}/{hour_name} ...")
-
-            txt_files = list(hour_folder.glob("*.txt"))
-            if not txt_files:
-                continue
-
-            book_ids = sorted(
-                set(extract_book_id(f.name) for f in txt_files if extract_book_id(f.name) != -1)
-            )
-
-            for book_id in book_ids:
-                if (
-                    last_day == day_name
-                    and last_hour == hour_name
-                    and book_id <= last_indexed_id
-                ):
-                    continue
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
+    with pool as executor:
+        for day_name, hour_name, entries, offset in pending_batches(datalake, progress):
+            log(1, f"Processed day/hour {day_name}/{hour_name} ...")
 
-                header_file = hour_folder / f"{book_id}_header.txt"
-                if not header_file.exists():
+            batch: Dict[str, Dict[str, Any]] = {}
+            for book_id, meta, nbytes in _parse_hour(entries, executor, workers, str(datalake)):
+                last_indexed_id = max(last_indexed_id, book_id)
+                if meta is None:
+                    METRICS.inc("failures_total", stage="metadata", reason="missing_header")
                     continue
 
-                with open(header_file, "r", encoding="utf-8") as f:
-                    header_text = f.read()
-
-                meta = parse_header_metadata(header_text)
-
+                METRICS.inc("bytes_read_total", nbytes, stage="metadata")
                 # Only store if at least one field was found
                 if any(meta.values()):
-                    catalog[str(book_id)] = meta
+                    if catalog.get(book_id) != meta:
+                        batch[str(book_id)] = meta
+                    else:
+                        batch.pop(str(book_id), None)
                     processed_any = True
-                    print(
+                    METRICS.inc("books_processed_total", stage="metadata")
+                    log(
+                        2,
                         f"Parsed metadata for book ID {book_id} ({day_name}/{hour_name}): "
-                        f"title={meta.get('title')!r}, author={meta.get('author')!r}"
+                        f"title={meta.get('title')!r}, author={meta.get('author')!r}",
                     )
+                else:
+                    METRICS.inc("failures_total", stage="metadata", reason="no_metadata")
 
-                last_indexed_id = max(last_indexed_id, book_id)
+            # Persist after finishing the batch: downstream store first, then the catalog
+            # records the next run diffs against, then the cursor past them
+            if batch and store is not None:
+                store(batch)
+            written = catalog.append(batch)
+            METRICS.inc("bytes_written_total", written, stage="metadata")
+            changed.update(batch)
 
-            # Persist after finishing the hour
-            output.parent.mkdir(parents=True, exist_ok=True)
-            with open(output, "w", encoding="utf-8") as out:
-                json.dump(catalog, out, ensure_ascii=False, indent=2)
+            save_progress(progress_path, day_name, hour_name, last_indexed_id, offset)
+            log(1, f"Progress saved: {day_name}/{hour_name} (last ID: {last_indexed_id})")
 
-            save_progress(progress_path, day_name, hour_name, last_indexed_id)
-            print(
-                f"Progress saved: {day_name}/{hour_name} (last ID: {last_indexed_id})"
-            )
+    if catalog.needs_compaction():
+        lines = catalog.lines
+        catalog.compact()
+        log(1, f"Catalog compacted: {lines} lines -> {catalog.lines} books")
 
     if processed_any:
-        print(
-            f"Finished. Last indexed day {last_day or day_name}/{last_hour or hour_name}"
-        )
+        log(1, f"Finished. Last indexed day {day_name}/{hour_name}")
     else:
-        print("Finished. No headers processed.")
+        log(1, "Finished. No headers processed.")
+
+    return changed
 
 
 __all__ = [
     "build_metadata_catalog",
     "parse_header_metadata",
+    "parse_entry",
     "load_progress",
     "save_progress",
     "extract_book_id",
@@ -1,74 +1,130 @@
 import argparse
-import json
 import sqlite3
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
+from control.metrics import METRICS
+from inverted_index.catalog import load_catalog
 
-def load_catalog(catalog_path: str) -> Dict[str, Dict[str, Any]]:
-    p = Path(catalog_path)
-    if not p.exists():
-        raise FileNotFoundError(f"Catalog not found: {p}")
-    with open(p, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        if not isinstance(data, dict):
-            raise ValueError("Catalog JSON must be a dict of {book_id: metadata}")
-        return data
 
+# Applied to every write connection. WAL lets the search service keep reading while
+# the pipeline writes; synchronous=NORMAL is durable in WAL mode except on power loss.
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
 
-def upsert_books(db_path: str, catalog: Dict[str, Dict[str, Any]]) -> int:
+IN_CHUNK = 500
+
+
+def connect_for_write(db_file: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_file)
+    for pragma in WRITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def upsert_books(db_path: str, catalog: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
     """
-    Inserts or updates rows in 'books' from a catalog dict.
-    Returns the number of rows affected (inserted + updated best-effort).
+    Inserts or updates rows in 'books' from a catalog dict, in a single transaction.
+    Rows whose values did not change are not rewritten.
+    Returns {"inserted": n, "updated": n, "unchanged": n}.
     """
     db_file = Path(db_path)
     if not db_file.exists():
         raise FileNotFoundError(f"Database not found: {db_file}. Initialize it first with datamart_initializer.")
 
-    affected = 0
-    with sqlite3.connect(db_file) as conn:
-        cur = conn.cursor()
-        # Use UPSERT (SQLite 3.24+) on primary key conflict
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS books (
-                book_id INTEGER PRIMARY KEY,
-                title TEXT,
-                author TEXT,
-                release_date TEXT,
-                language TEXT
-            )
-            """
-        )
-
-        sql = (
-            "INSERT INTO books (book_id, title, author, release_date, language) "
-            "VALUES (?, ?, ?, ?, ?) "
-            "ON CONFLICT(book_id) DO UPDATE SET "
-            "title=excluded.title, author=excluded.author, release_date=excluded.release_date, language=excluded.language"
-        )
-
-        rows = []
-        for book_id_str, meta in catalog.items():
-            try:
-                book_id = int(book_id_str)
-            except (TypeError, ValueError):
-                # Skip keys that aren't numeric IDs
-                continue
-
-            title = meta.get("title")
-            author = meta.get("author")
-            release_date = meta.get("release_date")
-            language = meta.get("language")
-            rows.append((book_id, title, author, release_date, language))
-
-        cur.executemany(sql, rows)
-        affected = cur.rowcount if cur.rowcount is not None else len(rows)
-        conn.commit()
-
-    return affected
-
-
-def run(catalog_path: str = "metadata/catalog.json", db_path: str = "datamart/datamart.db") -> int:
-    catalog = load_catalog(catalog_path)
-    return upsert_books(db_path, catalog)
\ No newline at end of file
+    rows = []
+    for book_id_str, meta in catalog.items():
+        try:
+            book_id = int(book_id_str)
+        except (TypeError, ValueError):
+            # Skip keys that aren't numeric IDs
+            continue
+
+        title = meta.get("title")
+        author = meta.get("author")
+        release_date = meta.get("release_date")
+        language = meta.get("language")
+        # Several Subject lines become one "; "-separated column
+        subjects = "; ".join(meta.get("subjects") or ()) or None
+        translator = meta.get("translator")
+        encoding = meta.get("encoding")
+        rows.append((book_id, title, author, release_date, language, subjects, translator, encoding))
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not rows:
+        return counts
+
+    # Use UPSERT (SQLite 3.24+) on primary key conflict; the WHERE skips identical rows
+    sql = (
+        "INSERT INTO books (book_id, title, author, release_date, language, subjects, translator, encoding) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(book_id) DO UPDATE SET "
+        "title=excluded.title, author=excluded.author, release_date=excluded.release_date, language=excluded.language, "
+        "subjects=excluded.subjects, translator=excluded.translator, encoding=excluded.encoding "
+        "WHERE title IS NOT excluded.title OR author IS NOT excluded.author "
+        "OR release_date IS NOT excluded.release_date OR language IS NOT excluded.language "
+        "OR subjects IS NOT excluded.subjects OR translator IS NOT excluded.translator "
+        "OR encoding IS NOT excluded.encoding"
+    )
+
+    conn = connect_for_write(db_file)
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+
+            ids = [row[0] for row in rows]
+            existing = set()
+            for i in range(0, len(ids), IN_CHUNK):
+                chunk = ids[i:i + IN_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                cur.execute(f"SELECT book_id FROM books WHERE book_id IN ({placeholders})", chunk)
+                existing.update(r[0] for r in cur.fetchall())
+
+            before = conn.total_changes
+            cur.executemany(sql, rows)
+            written = conn.total_changes - before
+
+        new_ids = set(ids) - existing
+        counts["inserted"] = len(new_ids)
+        counts["updated"] = written - len(new_ids)
+        counts["unchanged"] = len(set(ids)) - written
+        for result, n in counts.items():
+            METRICS.inc("datamart_rows_total", n, result=result)
+    finally:
+        conn.close()
+
+    return counts
+
+
+def run(
+    catalog_path: str = "metadata/catalog.jsonl",
+    db_path: str = "datamart/datamart.db",
+    records: Optional[Dict[str, Dict[str, Any]]] = None,
+    full: bool = False,
+) -> Dict[str, int]:
+    """
+    Stores `records` (the new/changed entries from the metadata parser) in the datamart.
+    With `full=True`, or when no records are given, the whole catalog file is re-applied.
+    """
+    if full or records is None:
+        records = load_catalog(catalog_path)
+    return upsert_books(db_path, records)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load the metadata catalog into the SQLite datamart.")
+    ap.add_argument("--catalog", default="metadata/catalog.jsonl")
+    ap.add_argument("--db", default="datamart/datamart.db")
+    args = ap.parse_args()
+
+    counts = run(args.catalog, args.db, full=True)
+    print(f"Inserted {counts['inserted']}, updated {counts['updated']}, unchanged {counts['unchanged']} rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Compact in-memory postings used while an index is being built.
+
+A term's postings are kept in flat unsigned-int arrays instead of lists of boxed ints:
+  ids     array('I') of book IDs, appended in increasing order (O(1) amortized)
+  tfs     array('I') of term frequencies          (freqs and positions formats)
+  deltas  array('I') of every position delta, concatenated in posting order;
+          posting i owns tfs[i] of them            (positions format)
+That is 4 bytes per book ID / frequency / position instead of ~28-36 bytes per int
+object plus list slots, and arrays pickle as raw bytes when worker processes send
+their partial postings back. to_list() produces the JSON segment layout
+(segments.POSTINGS_FORMATS) directly from the arrays.
+"""
+
+from array import array
+from typing import Dict, List, Optional
+
+TYPECODE = "I"
+
+# Fixed cost of a term while building: dict slot, the word itself, the TermPostings
+# object and its (mostly empty) arrays.
+TERM_OVERHEAD = 240
+
+
+class TermPostings:
+    __slots__ = ("ids", "tfs", "deltas", "ordered")
+
+    def __init__(self, postings_format: str = "docs"):
+        # ordered: IDs strictly increasing so far, i.e. to_list() needs no sort
+        self.ordered = True
+        self.ids = array(TYPECODE)
+        self.tfs = array(TYPECODE) if postings_format != "docs" else None
+        self.deltas = array(TYPECODE) if postings_format == "positions" else None
+
+    def __reduce__(self):
+        # Raw bytes keep the pickle sent back from worker processes small
+        return (_restore, (
+            self.ids.tobytes(),
+            None if self.tfs is None else self.tfs.tobytes(),
+            None if self.deltas is None else self.deltas.tobytes(),
+            self.ordered,
+        ))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, book_id: int, tf: int = 0, deltas: Optional[List[int]] = None):
+        if self.ids and book_id <= self.ids[-1]:
+            self.ordered = False
+        self.ids.append(book_id)
+        if self.tfs is not None:
+            self.tfs.append(tf)
+        if self.deltas is not None:
+            self.deltas.extend(deltas)
+
+    def extend(self, other: "TermPostings"):
+        if not other.ordered or (self.ids and other.ids and other.ids[0] <= self.ids[-1]):
+            self.ordered = False
+        self.ids.extend(other.ids)
+        if self.tfs is not None:
+            self.tfs.extend(other.tfs)
+        if self.deltas is not None:
+            self.deltas.extend(other.deltas)
+
+    def nbytes(self) -> int:
+        n = len(self.ids)
+        if self.tfs is not None:
+            n += len(self.tfs)
+        if self.deltas is not None:
+            n += len(self.deltas)
+        return n * self.ids.itemsize
+
+    def to_list(self) -> list:
+        """
+        Postings in the JSON segment layout, sorted by book ID. If a book was added
+        more than once (re-downloaded), its last posting wins.
+        """
+        if self.tfs is None:
+            if self.ordered:
+                return self.ids.tolist()
+            return sorted(set(self.ids))
+
+        if self.deltas is None:
+            entries = [[b, tf] for b, tf in zip(self.ids, self.tfs)]
+        else:
+            entries = []
+            pos = 0
+            for b, tf in zip(self.ids, self.tfs):
+                entries.append([b, self.deltas[pos:pos + tf].tolist()])
+                pos += tf
+        if self.ordered:
+            return entries
+        by_id = {}
+        for entry in entries:
+            by_id[entry[0]] = entry
+        return [by_id[b] for b in sorted(by_id)]
+
+
+def _restore(ids: bytes, tfs: Optional[bytes], deltas: Optional[bytes], ordered: bool) -> TermPostings:
+    p = TermPostings.__new__(TermPostings)
+    p.ordered = ordered
+    p.ids = array(TYPECODE, ids)
+    p.tfs = None if tfs is None else array(TYPECODE, tfs)
+    p.deltas = None if deltas is None else array(TYPECODE, deltas)
+    return p
+
+
+def merge_into(target: Dict[str, TermPostings], partial: Dict[str, TermPostings]) -> int:
+    """
+    Appends the postings of `partial` (built from later book IDs) to `target`, term by term.
+    Returns the number of bytes added, for memory accounting.
+    """
+    added = 0
+    for word, postings in partial.items():
+        current = target.get(word)
+        if current is None:
+            target[word] = postings
+            added += TERM_OVERHEAD + len(word) + postings.nbytes()
+        else:
+            current.extend(postings)
+            added += postings.nbytes()
+    return added
@@ -0,0 +1,440 @@
+"""
+Boolean / ranked search over the indexer's output.
+
+Query syntax: words, AND, OR, NOT (uppercase) and parentheses. Adjacent words are
+joined with the default operator (the `mode`, "and" or "or"), e.g.
+    whale AND (ship OR boat) NOT captain
+Results are scored with BM25 when the index has term frequencies, otherwise with
+the smoothed IDF sum used by the Java SearchEngine.
+"""
+
+import argparse
+import heapq
+import json
+import math
+import re
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from inverted_index.analysis import SCHEMES
+from inverted_index.ranking import analyze_query, bm25_idf, bm25_weight
+
+
+class JsonIndex:
+    """
+    The single-file JSON export (word -> [book_id, ...]) as a query source.
+    """
+
+    has_freqs = False
+    analysis = "none"
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            self.index: Dict[str, List[int]] = json.load(f)
+        self._doc_ids = sorted(set(book_id for ids in self.index.values() for book_id in ids))
+
+    def postings(self, word: str) -> List[int]:
+        return self.index.get(word, [])
+
+    def postings_with_freqs(self, word: str) -> List[Tuple[int, int]]:
+        return [(book_id, 1) for book_id in self.index.get(word, [])]
+
+    def doc_ids(self) -> List[int]:
+        return self._doc_ids
+
+    def doc_length(self, book_id: int) -> int:
+        return 0
+
+
+def load_index(path: str):
+    """
+    Opens a segments directory, a binary index (.bin) or a JSON export.
+    """
+    p = Path(path)
+    if p.is_dir():
+        from inverted_index.segments import SegmentedIndex
+        return SegmentedIndex(str(p))
+    if p.suffix == ".bin":
+        from inverted_index.binary_index import BinaryIndex
+        return BinaryIndex(str(p))
+    return JsonIndex(str(p))
+
+
+# ---------------------------------------------------------------- postings ops
+
+def gallop(lst: List[int], target: int, lo: int = 0) -> int:
+    """
+    Smallest index i >= lo with lst[i] >= target, probing 1, 2, 4, ... positions ahead
+    before a binary search, so skipping is cheap when the target is close.
+    """
+    n = len(lst)
+    if lo >= n or lst[lo] >= target:
+        return lo
+    prev, step = lo, 1
+    hi = lo + 1
+    while hi < n and lst[hi] < target:
+        prev = hi
+        step *= 2
+        hi = prev + step
+    return bisect_left(lst, target, prev + 1, min(hi + 1, n))
+
+
+def intersect(lists: List[List[int]]) -> List[int]:
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        out = []
+        j = 0
+        for book_id in result:
+            j = gallop(other, book_id, j)
+            if j == len(other):
+                break
+            if other[j] == book_id:
+                out.append(book_id)
+        result = out
+        if not result:
+            break
+    return result
+
+
+def union(lists: List[List[int]]) -> List[int]:
+    out = []
+    last = None
+    for book_id in heapq.merge(*lists):
+        if book_id != last:
+            out.append(book_id)
+            last = book_id
+    return out
+
+
+def difference(base: List[int], exclude: List[int]) -> List[int]:
+    out = []
+    j = 0
+    for book_id in base:
+        j = gallop(exclude, book_id, j)
+        if j == len(exclude) or exclude[j] != book_id:
+            out.append(book_id)
+    return out
+
+
+# ---------------------------------------------------------------- parsing
+
+QUERY_TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+
+
+def parse_query(text: str, default_op: str = "and", analysis: str = "none"):
+    """
+    Parses a query into nested tuples: ("term", w), ("and", [...]), ("or", [...]), ("not", node).
+    Precedence: NOT > AND > OR. Returns None for an empty query.
+    Words are analyzed like the index (`analysis`): stopwords vanish and a word with
+    several possible stems becomes an OR of them.
+    """
+    tokens = QUERY_TOKEN_RE.findall(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() is not None and peek() != ")":
+            if peek() == "OR":
+                take()
+            elif default_op != "or":
+                break
+            nodes.append(parse_and())
+        return _group("or", nodes)
+
+    def parse_and():
+        nodes = [parse_unary()]
+        while True:
+            token = peek()
+            if token == "AND":
+                take()
+            elif token is None or token in (")", "OR") or (default_op == "or" and token != "NOT"):
+                break
+            nodes.append(parse_unary())
+        return _group("and", nodes)
+
+    def parse_unary():
+        token = peek()
+        if token is None or token in (")", "OR", "AND"):
+            return None
+        take()
+        if token == "NOT":
+            node = parse_unary()
+            return ("not", node) if node is not None else None
+        if token == "(":
+            node = parse_or()
+            if peek() == ")":
+                take()
+            return node
+        words = analyze_query(token, analysis)
+        if not words:
+            return None
+        return _group("and", [_group("or", [("term", t) for t in alternatives]) for alternatives in words])
+
+    if not tokens:
+        return None
+    return parse_or()
+
+
+def _group(op: str, nodes: list):
+    # Nested groups of the same operator are flattened, so e.g. an OR of words whose
+    # stems are ORs is still a flat disjunction of terms (and can use WAND)
+    flat = []
+    for n in nodes:
+        if n is None:
+            continue
+        flat.extend(n[1] if n[0] == op else [n])
+    if not flat:
+        return None
+    if len(flat) == 1:
+        return flat[0]
+    return (op, flat)
+
+
+def positive_terms(node) -> List[str]:
+    if node is None:
+        return []
+    if node[0] == "term":
+        return [node[1]]
+    if node[0] == "not":
+        return []
+    return [t for child in node[1] for t in positive_terms(child)]
+
+
+# ---------------------------------------------------------------- engine
+
+class QueryEngine:
+    """
+    Evaluates boolean queries over sorted postings (galloping intersection) and
+    keeps only the k best results in a bounded heap. Pure OR queries can use
+    WAND, which skips documents whose score upper bound cannot enter the top-k.
+    """
+
+    def __init__(self, index, k1: float = 1.2, b: float = 0.75, analysis: Optional[str] = None,
+                 collection: Optional[dict] = None):
+        self.index = index
+        self.k1 = k1
+        self.b = b
+        # Query words must be analyzed the way the index was built
+        self.analysis = analysis or getattr(index, "analysis", "none")
+        self.all_docs = index.doc_ids()
+        self.N = len(self.all_docs)
+        # A shard scores with the whole collection's N and avgdl ({"N": ..., "avgdl": ...}),
+        # and gets the global document frequencies with each query (search(..., df=...))
+        self.collection_size = collection["N"] if collection else self.N
+        self.bm25 = bool(getattr(index, "has_freqs", False))
+        if self.bm25:
+            if collection:
+                self.avgdl = collection["avgdl"] or 1.0
+            else:
+                lengths = [index.doc_length(book_id) for book_id in self.all_docs]
+                self.avgdl = (sum(lengths) / len(lengths)) if lengths else 1.0
+                self.avgdl = self.avgdl or 1.0
+
+    def idf(self, df: int) -> float:
+        if self.bm25:
+            return bm25_idf(self.collection_size, df)
+        return math.log((self.collection_size + 1.0) / (df + 1.0)) + 1.0
+
+    def weight(self, tf: int, book_id: int, idf: float) -> float:
+        if not self.bm25:
+            return idf
+        dl = self.index.doc_length(book_id) or self.avgdl
+        return bm25_weight(tf, dl, self.avgdl, idf, self.k1, self.b)
+
+    def upper_bound(self, idf: float) -> float:
+        # BM25 saturates at idf * (k1 + 1) as tf grows
+        return idf * (self.k1 + 1.0) if self.bm25 else idf
+
+    def _evaluate(self, node, cache: Dict[str, List[int]]) -> List[int]:
+        kind = node[0]
+        if kind == "term":
+            if node[1] not in cache:
+                cache[node[1]] = self.index.postings(node[1])
+            return cache[node[1]]
+        if kind == "not":
+            return difference(self.all_docs, self._evaluate(node[1], cache))
+        if kind == "or":
+            return union([self._evaluate(child, cache) for child in node[1]])
+
+        positives = [child for child in node[1] if child[0] != "not"]
+        negatives = [child[1] for child in node[1] if child[0] == "not"]
+        result = intersect([self._evaluate(c, cache) for c in positives]) if positives else self.all_docs
+        for neg in negatives:
+            if not result:
+                break
+            result = difference(result, self._evaluate(neg, cache))
+        return result
+
+    def _score(self, matches: List[int], terms: Iterable[str], k: int,
+               df: Optional[Dict[str, int]] = None) -> List[Tuple[int, float]]:
+        wanted = set(matches)
+        scores = dict.fromkeys(matches, 0.0)
+        for term in set(terms):
+            postings = self.index.postings_with_freqs(term)
+            if not postings:
+                continue
+            idf = self.idf(df.get(term, len(postings)) if df else len(postings))
+            for book_id, tf in postings:
+                if book_id in wanted:
+                    scores[book_id] += self.weight(tf, book_id, idf)
+        return heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def wand(self, terms: List[str], k: int, df: Optional[Dict[str, int]] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k for a disjunction of terms with WAND early termination.
+        """
+        cursors = []
+        for term in set(terms):
+            postings = self.index.postings_with_freqs(term)
+            if postings:
+                idf = self.idf(df.get(term, len(postings)) if df else len(postings))
+                ids = [book_id for book_id, _ in postings]
+                tfs = [tf for _, tf in postings]
+                cursors.append([ids, tfs, 0, idf, self.upper_bound(idf)])
+
+        heap: List[Tuple[float, int]] = []  # min-heap of (score, -book_id)
+        threshold = -1.0
+        while True:
+            cursors = [c for c in cursors if c[2] < len(c[0])]
+            if not cursors:
+                break
+            cursors.sort(key=lambda c: c[0][c[2]])
+
+            acc = 0.0
+            pivot = None
+            for i, c in enumerate(cursors):
+                acc += c[4]
+                if acc > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot][0][cursors[pivot][2]]
+
+            if cursors[0][0][cursors[0][2]] == pivot_doc:
+                score = 0.0
+                for c in cursors:
+                    if c[0][c[2]] != pivot_doc:
+                        break
+                    score += self.weight(c[1][c[2]], pivot_doc, c[3])
+                    c[2] += 1
+                item = (score, -pivot_doc)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+                if len(heap) == k:
+                    threshold = heap[0][0]
+            else:
+                for c in cursors[:pivot]:
+                    c[2] = gallop(c[0], pivot_doc, c[2])
+
+        return [(-neg_id, score) for score, neg_id in sorted(heap, reverse=True)]
+
+    def matches(self, query: str, mode: str = "and") -> List[int]:
+        """
+        IDs of every book matching the query, sorted, without scoring them.
+        """
+        node = parse_query(query, mode, self.analysis)
+        return self._evaluate(node, {}) if node is not None else []
+
+    def search(self, query: str, k: int = 10, mode: str = "and", use_wand: bool = True,
+               df: Optional[Dict[str, int]] = None) -> List[Tuple[int, float]]:
+        """
+        Returns up to k (book_id, score) pairs, best first (ties by lower ID).
+        `df` overrides the document frequencies of the query terms (global statistics).
+        """
+        node = parse_query(query, mode, self.analysis)
+        if node is None:
+            return []
+        if use_wand and k > 0 and node[0] in ("term", "or") and all(c[0] == "term" for c in _children(node)):
+            return self.wand(positive_terms(node), k, df)
+        matches = self._evaluate(node, {})
+        return self._score(matches, positive_terms(node), k, df)
+
+    def search_batch(self, queries: Iterable[str], k: int = 10, mode: str = "and") -> List[List[Tuple[int, float]]]:
+        return [self.search(q, k, mode) for q in queries]
+
+
+def _children(node) -> list:
+    return [node] if node[0] == "term" else node[1]
+
+
+def benchmark(engine: QueryEngine, queries: List[str], k: int = 10, mode: str = "and", repeat: int = 3) -> dict:
+    """
+    Runs the query list `repeat` times and returns throughput and latency percentiles.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            engine.search(q, k, mode)
+            latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        "queries": len(latencies),
+        "seconds": round(total, 4),
+        "qps": round(len(latencies) / total, 2) if total else 0.0,
+        "p50_ms": round(pct(0.50), 3),
+        "p99_ms": round(pct(0.99), 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Search the inverted index from Python.")
+    ap.add_argument("query", nargs="?", help="Query, e.g. 'whale AND (ship OR boat) NOT captain'")
+    ap.add_argument("--index", default="index/segments", help="Segments dir, binary index (.bin) or JSON export")
+    ap.add_argument("--mode", choices=["and", "or"], default="and", help="Operator between adjacent words")
+    ap.add_argument("--k", type=int, default=10, help="Number of results")
+    ap.add_argument("--batch", type=Path, help="File with one query per line")
+    ap.add_argument("--benchmark", action="store_true", help="Time the batch queries instead of printing results")
+    ap.add_argument("--repeat", type=int, default=3, help="Benchmark repetitions")
+    ap.add_argument("--analysis", choices=SCHEMES, default=None,
+                    help="Analysis scheme of the index (default: read from the index; JSON exports: none)")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    engine = QueryEngine(load_index(args.index), analysis=args.analysis)
+    print(
+        f"Index loaded in {time.perf_counter() - t0:.3f}s "
+        f"({engine.N} books, {'bm25' if engine.bm25 else 'idf'}, analysis {engine.analysis})"
+    )
+
+    if args.batch:
+        queries = [q.strip() for q in args.batch.read_text(encoding="utf-8").splitlines() if q.strip()]
+    elif args.query:
+        queries = [args.query]
+    else:
+        ap.error("give a query or --batch")
+
+    if args.benchmark:
+        print(json.dumps(benchmark(engine, queries, args.k, args.mode, args.repeat)))
+        return
+
+    for q, results in zip(queries, engine.search_batch(queries, args.k, args.mode)):
+        print(f"# {q}")
+        for book_id, score in results:
+            print(f"{book_id}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import heapq
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from inverted_index.analysis import query_alternatives
+from inverted_index.segments import SegmentedIndex
+
+
+TOKEN_RE = re.compile(r"\b[a-záéíóúüñ]+\b")
+
+
+def tokenize_query(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def analyze_query(text: str, analysis: str = "none") -> List[List[str]]:
+    """
+    One list of alternative index terms per query word, as the index was analyzed;
+    stopwords are dropped.
+    """
+    words = []
+    for word in tokenize_query(text):
+        alternatives = query_alternatives(word, analysis)
+        if alternatives:
+            words.append(alternatives)
+    return words
+
+
+def query_terms(text: str, analysis: str = "none") -> List[str]:
+    return [term for alternatives in analyze_query(text, analysis) for term in alternatives]
+
+
+def bm25_idf(n_docs: int, df: int) -> float:
+    return math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+def bm25_weight(tf: int, dl: float, avgdl: float, idf: float, k1: float = 1.2, b: float = 0.75) -> float:
+    return idf * tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * dl / avgdl))
+
+
+class BM25Ranker:
+    """
+    BM25 top-k ranking and exact phrase matching over a segmented index.
+    Needs segments built with postings_format "freqs" (BM25) or "positions" (BM25 + phrases);
+    books from docs-only segments score with tf=1 and the average document length.
+    """
+
+    def __init__(self, index: SegmentedIndex, k1: float = 1.2, b: float = 0.75):
+        self.index = index
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = index.doc_lengths
+        self.analysis = index.analysis
+        self.N = len(index.doc_ids())
+        self.avgdl = (sum(self.doc_lengths.values()) / len(self.doc_lengths)) if self.doc_lengths else 1.0
+
+    def idf(self, df: int) -> float:
+        return bm25_idf(self.N, df)
+
+    def score_terms(self, terms: List[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            postings = self.index.postings_with_freqs(term)
+            if not postings:
+                continue
+            idf = self.idf(len(postings))
+            for book_id, tf in postings:
+                dl = self.doc_lengths.get(book_id, self.avgdl)
+                weight = bm25_weight(tf, dl, self.avgdl, idf, self.k1, self.b)
+                scores[book_id] = scores.get(book_id, 0.0) + weight
+        return scores
+
+    def top_k(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """
+        Returns the k best (book_id, score) pairs, highest score first (ties by lower ID).
+        """
+        scores = self.score_terms(query_terms(query, self.analysis))
+        return heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def _positions(self, alternatives: List[str]) -> Dict[int, List[int]]:
+        if len(alternatives) == 1:
+            return self.index.positions(alternatives[0])
+        merged: Dict[int, set] = {}
+        for term in alternatives:
+            for book_id, term_positions in self.index.positions(term).items():
+                merged.setdefault(book_id, set()).update(term_positions)
+        return {book_id: sorted(p) for book_id, p in merged.items()}
+
+    def phrase_matches(self, phrase: str) -> List[int]:
+        """
+        Returns the books containing the exact word sequence, using token positions.
+        With analysis, stopwords are skipped on both sides and each word matches any of its stems.
+        """
+        words = analyze_query(phrase, self.analysis)
+        if not words:
+            return []
+
+        positions = [self._positions(alternatives) for alternatives in words]
+        candidates = set(positions[0])
+        for term_positions in positions[1:]:
+            candidates &= set(term_positions)
+            if not candidates:
+                return []
+
+        matches = []
+        for book_id in sorted(candidates):
+            starts = set(positions[0][book_id])
+            for offset, term_positions in enumerate(positions[1:], start=1):
+                starts &= {p - offset for p in term_positions[book_id]}
+                if not starts:
+                    break
+            if starts:
+                matches.append(book_id)
+        return matches
+
+    def phrase_top_k(self, phrase: str, k: int = 10) -> List[Tuple[int, float]]:
+        """
+        BM25 ranking restricted to books that contain the exact phrase.
+        """
+        matches = set(self.phrase_matches(phrase))
+        scores = self.score_terms(query_terms(phrase, self.analysis))
+        ranked = ((book_id, s) for book_id, s in scores.items() if book_id in matches)
+        return heapq.nsmallest(k, ranked, key=lambda item: (-item[1], item[0]))
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="BM25 / phrase search over the segmented index.")
+    ap.add_argument("query", help="Query text")
+    ap.add_argument("--segments", default="index/segments", help="Segments directory")
+    ap.add_argument("--k", type=int, default=10, help="Number of results")
+    ap.add_argument("--phrase", action="store_true", help="Only books containing the exact phrase")
+    args = ap.parse_args(argv)
+
+    ranker = BM25Ranker(SegmentedIndex(args.segments))
+    results = ranker.phrase_top_k(args.query, args.k) if args.phrase else ranker.top_k(args.query, args.k)
+    for book_id, score in results:
+        print(f"{book_id}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
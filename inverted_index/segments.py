@@ -0,0 +1,854 @@
+import argparse
+import heapq
+import json
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: the locks below only hold within one process
+    fcntl = None
+
+from inverted_index.checkpoint import atomic_file, read_json, remove_stale_tmp, write_json_atomic
+from inverted_index.postings import TermPostings
+
+
+MANIFEST_NAME = "manifest.json"
+# Collection statistics of a segment, next to it: seg_000001.json -> seg_000001.stats.json
+STATS_SUFFIX = ".stats.json"
+MANIFEST_LOCK = "manifest.lock"
+MERGE_LOCK = "merge.lock"
+# Segment files are read this much at a time by SegmentReader
+READ_CHUNK = 1 << 20
+
+# Postings formats, from least to most detailed:
+#   docs:      word -> [book_id, ...]
+#   freqs:     word -> [[book_id, tf], ...]
+#   positions: word -> [[book_id, [first_pos, delta, delta, ...]], ...]   (tf = number of positions)
+# freqs and positions segments also carry doc_lengths: {"book_id": token_count}.
+# Segments are written header first ("format", "doc_ids", "doc_lengths") and with their
+# terms in sorted order ("terms_sorted": true), so they can be read and merged as streams.
+# Each segment's statistics sidecar (see segment_stats) is written before the manifest lists it.
+POSTINGS_FORMATS = ("docs", "freqs", "positions")
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _dir_lock(segments_dir: str, name: str):
+    """
+    Exclusive lock `name` on a segments directory, held across threads and processes:
+    a shard's indexer process and Control's background merge thread share the directory.
+      manifest.lock  every read-modify-write of the manifest
+      merge.lock     a whole merge, and crash recovery (which must not mistake the
+                     segment a merge is writing for an orphan)
+    """
+    seg_dir = Path(segments_dir)
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    path = seg_dir / name
+    with _thread_locks_guard:
+        lock = _thread_locks.setdefault(str(path.resolve()), threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_manifest(segments_dir: str) -> dict:
+    """
+    Returns the manifest of live segments:
+      {"next_id": int, "segments": [{"name": str, "docs": int, "terms": int}, ...],
+       "generation": int, "checkpoint": {...}, "analysis": str}
+    "generation" counts the changes to the list of segments (see manifest_generation);
+    "checkpoint" is the indexer progress committed together with the newest segment;
+    "analysis" the analysis scheme every segment was built with (absent: "none").
+    """
+    manifest_file = Path(segments_dir) / MANIFEST_NAME
+    if manifest_file.exists():
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"next_id": 1, "segments": []}
+
+
+def save_manifest(segments_dir: str, manifest: dict) -> None:
+    seg_dir = Path(segments_dir)
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(seg_dir / MANIFEST_NAME, manifest)
+
+
+def set_analysis(segments_dir: str, analysis: str) -> None:
+    """
+    Records the analysis scheme of the index. Raises ValueError if segments built with
+    another scheme exist, since their terms would not match.
+    """
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        current = manifest.get("analysis", "none")
+        if current == analysis and "analysis" in manifest:
+            return
+        if manifest["segments"] and current != analysis:
+            raise ValueError(
+                f"Index in {segments_dir} was built with analysis {current!r}, not {analysis!r}; "
+                "delete the segments and the indexer progress to re-index"
+            )
+        manifest["analysis"] = analysis
+        save_manifest(segments_dir, manifest)
+
+
+def _allocate_segment_name(segments_dir: str) -> str:
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        seg_id = manifest["next_id"]
+        manifest["next_id"] = seg_id + 1
+        save_manifest(segments_dir, manifest)
+    return f"seg_{seg_id:06d}.json"
+
+
+def write_segment(
+    segments_dir: str,
+    postings: Dict[str, list],
+    doc_ids: Iterable[int],
+    postings_format: str = "docs",
+    doc_lengths: Optional[Dict[int, int]] = None,
+    checkpoint: Optional[dict] = None,
+) -> Optional[dict]:
+    """
+    Writes an immutable segment and registers it in the manifest.
+    Postings are TermPostings (from the indexer) or lists already sorted by book_id
+    and free of duplicates. `checkpoint` (the indexer progress covering these books)
+    is stored in the same manifest update, so segment and cursor commit atomically.
+    Returns the manifest entry, or None if there was nothing to write.
+    """
+    items = ((word, postings[word]) for word in sorted(postings))
+    return write_segment_stream(segments_dir, items, doc_ids, postings_format, doc_lengths, checkpoint)
+
+
+def write_segment_stream(
+    segments_dir: str,
+    items: Iterable[Tuple[str, list]],
+    doc_ids: Iterable[int],
+    postings_format: str = "docs",
+    doc_lengths: Optional[Dict[int, int]] = None,
+    checkpoint: Optional[dict] = None,
+) -> Optional[dict]:
+    """
+    Same as write_segment, but consumes (word, postings) pairs one at a time, in term
+    order, so the postings never need to be in memory all together.
+    """
+    doc_ids = sorted(set(doc_ids))
+    if not doc_ids:
+        return None
+
+    removed = _removed_by(segments_dir, doc_ids)
+    entry = _write_segment_file(segments_dir, items, doc_ids, postings_format, doc_lengths, lambda df: removed)
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        manifest["segments"].append(entry)
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        if checkpoint is not None:
+            manifest["checkpoint"] = checkpoint
+        save_manifest(segments_dir, manifest)
+    return entry
+
+
+def _write_segment_file(
+    segments_dir: str,
+    items: Iterable[Tuple[str, list]],
+    doc_ids: List[int],
+    postings_format: str,
+    doc_lengths: Optional[Dict[int, int]],
+    removed: Callable[[Dict[str, int]], Dict[str, int]],
+) -> dict:
+    # Writes a new segment file and its statistics sidecar, not yet in the manifest;
+    # returns its manifest entry. removed(df) gives the sidecar's "removed" counts.
+    name = _allocate_segment_name(segments_dir)
+    header = {"format": postings_format, "doc_ids": doc_ids}
+    if postings_format != "docs":
+        header["doc_lengths"] = {str(k): v for k, v in sorted((doc_lengths or {}).items())}
+    header["terms_sorted"] = True
+
+    df: Dict[str, int] = {}
+    last = None
+    with atomic_file(Path(segments_dir) / name) as f:
+        f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":"))[:-1])
+        f.write(',"postings":{')
+        for word, entries in items:
+            if last is not None and word <= last:
+                raise ValueError(f"Segment terms out of order: {word!r} after {last!r}")
+            if df:
+                f.write(",")
+            f.write(json.dumps(word, ensure_ascii=False))
+            f.write(":")
+            if isinstance(entries, TermPostings):
+                entries = entries.to_list()
+            f.write(json.dumps(entries, separators=(",", ":")))
+            df[word] = len(entries)
+            last = word
+        f.write("}}")
+    _write_stats(segments_dir, name, df, removed(df), doc_ids, doc_lengths if postings_format != "docs" else None)
+    return {"name": name, "docs": len(doc_ids), "terms": len(df), "format": postings_format}
+
+
+def read_segment(segments_dir: str, name: str) -> dict:
+    with open(Path(segments_dir) / name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_decoder = json.JSONDecoder()
+
+
+class SegmentReader:
+    """
+    Reads a segment file incrementally: header() returns everything before the postings,
+    items() then yields one (word, postings) pair at a time, in term order. Segments of
+    older versions, without "terms_sorted", are loaded whole and sorted instead.
+    The file is opened right away, so a segment merged away after that stays readable.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "r", encoding="utf-8")
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._header = None
+        self._unsorted = None
+
+    def _more(self, size: int = READ_CHUNK) -> bool:
+        chunk = "" if self._eof else self._file.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._more():
+                raise ValueError(f"Segment {self.path} is truncated")
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f"Segment {self.path}: expected {char!r} at {self._buf[self._pos:self._pos + 20]!r}")
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        size = READ_CHUNK
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value ending with the buffer may continue past it (e.g. a number)
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if not self._more(size):
+                if end is None:
+                    raise ValueError(f"Segment {self.path} is truncated or corrupt")
+                continue
+            size *= 2
+
+    def header(self) -> dict:
+        if self._header is not None:
+            return self._header
+        header = {}
+        self._expect("{")
+        while self._peek() != "}":
+            key = self._value()
+            self._expect(":")
+            if key == "postings":
+                break
+            header[key] = self._value()
+            if self._peek() == ",":
+                self._pos += 1
+        if header.get("terms_sorted"):
+            self._expect("{")
+        else:
+            self._file.seek(0)
+            segment = json.load(self._file)
+            self._unsorted = segment.pop("postings", {})
+            header = segment
+        self._header = header
+        return header
+
+    def items(self) -> Iterator[Tuple[str, list]]:
+        self.header()
+        if self._unsorted is not None:
+            for word in sorted(self._unsorted):
+                yield word, self._unsorted[word]
+            return
+        if self._peek() == "}":
+            return
+        while True:
+            word = self._value()
+            self._expect(":")
+            yield word, self._value()
+            if self._peek() == "}":
+                return
+            self._expect(",")
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_segments(segments_dir: str) -> Tuple[dict, List[SegmentReader]]:
+    """
+    The manifest and a reader for each of its live segments, in manifest order. The files
+    are opened under the manifest lock: a merge only deletes the segments it replaced
+    after the manifest stops listing them. The caller closes the readers.
+    """
+    readers: List[SegmentReader] = []
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        try:
+            for s in manifest["segments"]:
+                readers.append(SegmentReader(Path(segments_dir) / s["name"]))
+        except BaseException:
+            close_segments(readers)
+            raise
+    return manifest, readers
+
+
+def close_segments(readers: List[SegmentReader]) -> None:
+    for reader in readers:
+        reader.close()
+
+
+def stats_name(segment_name: str) -> str:
+    return segment_name[:-len(".json")] + STATS_SUFFIX
+
+
+def _write_stats(segments_dir: str, name: str, df: Dict[str, int], removed: Dict[str, int],
+                 doc_ids: List[int], doc_lengths: Optional[Dict[int, int]]) -> dict:
+    lengths = doc_lengths or {}
+    stats = {
+        "df": df,
+        "removed": {word: n for word, n in sorted(removed.items()) if n},
+        "doc_lengths": {str(book_id): lengths.get(book_id, 0) for book_id in doc_ids},
+    }
+    write_json_atomic(Path(segments_dir) / stats_name(name), stats)
+    return stats
+
+
+def _removed_by(segments_dir: str, doc_ids: List[int], before: Optional[str] = None) -> Dict[str, int]:
+    """
+    word -> number of live postings entries that a segment indexing `doc_ids` deletes
+    from the live segments (those listed before segment `before`, if given): for each
+    of these books, its entries in the newest segment that indexed it so far.
+    Only segments holding such a book are read past their header.
+    """
+    _, readers = open_segments(segments_dir)
+    try:
+        if before is not None:
+            names = [reader.path.name for reader in readers]
+            # A segment merged away meanwhile deletes nothing: the merged one took over its books
+            readers = readers[:names.index(before)] if before in names else []
+        new = set(doc_ids)
+        previous: Dict[int, int] = {}
+        for seg_no, reader in enumerate(readers):
+            for book_id in reader.header()["doc_ids"]:
+                if book_id in new:
+                    previous[book_id] = seg_no
+        books_in: Dict[int, set] = {}
+        for book_id, seg_no in previous.items():
+            books_in.setdefault(seg_no, set()).add(book_id)
+        removed: Dict[str, int] = {}
+        for seg_no, books in books_in.items():
+            for word, entries in readers[seg_no].items():
+                n = sum(1 for e in entries if _entry_id(e) in books)
+                if n:
+                    removed[word] = removed.get(word, 0) + n
+    finally:
+        close_segments(readers)
+    return removed
+
+
+def _backfill_stats(segments_dir: str, reader: SegmentReader) -> dict:
+    # The sidecar of a segment written before sidecars existed
+    name = reader.path.name
+    with reader:
+        header = reader.header()
+        df = {word: len(entries) for word, entries in reader.items()}
+    doc_lengths = {int(book_id): length for book_id, length in header.get("doc_lengths", {}).items()}
+    removed = _removed_by(segments_dir, header["doc_ids"], before=name)
+    print(f"Wrote missing statistics of segment {name}")
+    return _write_stats(segments_dir, name, df, removed, header["doc_ids"], doc_lengths)
+
+
+def _read_stats(segments_dir: str, name: str) -> dict:
+    stats = read_json(Path(segments_dir) / stats_name(name))
+    if stats is None:
+        stats = _backfill_stats(segments_dir, SegmentReader(Path(segments_dir) / name))
+    return stats
+
+
+def segment_stats(segments_dir: str) -> Tuple[dict, List[dict]]:
+    """
+    The manifest and the statistics sidecar of each of its live segments, in manifest order:
+      {"df": {word: entries in this segment},
+       "removed": {word: live entries of older segments this segment's books delete},
+       "doc_lengths": {"book_id": token_count (0 in docs-only segments)}}
+    Collection document frequencies are the sum of "df" minus the sum of "removed", and
+    the document lengths those of the newest segment holding each book (see
+    index_stats.collection_stats). Sidecars missing for segments from older versions
+    are rebuilt from the segment files.
+    """
+    files = []
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        # Opened under the lock, like open_segments: a merge deletes them once unlisted
+        for s in manifest["segments"]:
+            try:
+                files.append(open(Path(segments_dir) / stats_name(s["name"]), "r", encoding="utf-8"))
+            except FileNotFoundError:
+                files.append(SegmentReader(Path(segments_dir) / s["name"]))
+    stats = []
+    for f in files:
+        if isinstance(f, SegmentReader):
+            stats.append(_backfill_stats(segments_dir, f))
+            continue
+        with f:
+            stats.append(json.load(f))
+    return manifest, stats
+
+
+def manifest_generation(segments_dir: str) -> Tuple[int, int]:
+    """
+    Changes whenever a segment is added or segments are merged: (generation, next_id).
+    next_id covers manifests from before "generation" was recorded.
+    """
+    manifest = load_manifest(segments_dir)
+    return manifest.get("generation", 0), manifest["next_id"]
+
+
+def _entry_id(entry) -> int:
+    return entry if isinstance(entry, int) else entry[0]
+
+
+def union_postings(lists: List[list]) -> list:
+    """
+    Merges sorted postings lists. If a book appears in several lists, the entry
+    from the last list (the newest segment) wins.
+    """
+    if len(lists) == 1:
+        return list(lists[0])
+    merged = []
+    last = None
+    for entry in heapq.merge(*lists, key=_entry_id):
+        book_id = _entry_id(entry)
+        if book_id == last:
+            merged[-1] = entry
+        else:
+            merged.append(entry)
+            last = book_id
+    return merged
+
+
+def replaced_books(doc_id_lists: List[list]) -> Dict[int, int]:
+    """
+    For books indexed by more than one segment: book_id -> position of the newest of
+    those segments. Re-indexing a book replaces it, so its entries in the older
+    segments are deleted, including those of words the new version no longer contains.
+    """
+    seen: Dict[int, int] = {}
+    replaced: Dict[int, int] = {}
+    for seg_no, doc_ids in enumerate(doc_id_lists):
+        for book_id in doc_ids:
+            if book_id in seen:
+                replaced[book_id] = seg_no
+            seen[book_id] = seg_no
+    return replaced
+
+
+def live_postings(entries: list, seg_no: int, replaced: Dict[int, int]) -> list:
+    """
+    The entries of segment `seg_no` whose books no newer segment has re-indexed.
+    """
+    if not replaced:
+        return entries
+    return [e for e in entries if replaced.get(_entry_id(e), seg_no) == seg_no]
+
+
+def normalize_postings(entries: list) -> list:
+    """
+    Sorts a postings list by book_id, keeping only the last entry of a repeated book.
+    """
+    merged = []
+    last = None
+    for entry in sorted(entries, key=_entry_id):
+        book_id = _entry_id(entry)
+        if book_id == last:
+            merged[-1] = entry
+        else:
+            merged.append(entry)
+            last = book_id
+    return merged
+
+
+def convert_postings(entries: list, from_format: str, to_format: str) -> list:
+    """
+    Downgrades a postings list to a less detailed format (positions -> freqs -> docs).
+    """
+    if from_format == to_format:
+        return entries
+    if to_format == "docs":
+        return [_entry_id(e) for e in entries]
+    if from_format == "positions" and to_format == "freqs":
+        return [[book_id, len(deltas)] for book_id, deltas in entries]
+    raise ValueError(f"Cannot convert postings from {from_format!r} to {to_format!r}")
+
+
+def decode_positions(deltas: List[int]) -> List[int]:
+    positions = []
+    pos = 0
+    for i, d in enumerate(deltas):
+        pos = d if i == 0 else pos + d
+        positions.append(pos)
+    return positions
+
+
+def segment_format(segment: dict) -> str:
+    return segment.get("format", "docs")
+
+
+def common_format(segments: List[dict]) -> str:
+    formats = [POSTINGS_FORMATS.index(segment_format(seg)) for seg in segments]
+    return POSTINGS_FORMATS[min(formats)] if formats else "docs"
+
+
+def merge_postings(segments: List[dict], postings_format: str = "docs") -> Dict[str, list]:
+    replaced = replaced_books([seg["doc_ids"] for seg in segments])
+    by_term: Dict[str, List[list]] = {}
+    for seg_no, seg in enumerate(segments):
+        fmt = segment_format(seg)
+        for word, entries in seg["postings"].items():
+            entries = live_postings(entries, seg_no, replaced)
+            if entries:
+                by_term.setdefault(word, []).append(convert_postings(entries, fmt, postings_format))
+    return {word: union_postings(lists) for word, lists in by_term.items()}
+
+
+def merge_doc_lengths(segments: List[dict]) -> Dict[int, int]:
+    doc_lengths: Dict[int, int] = {}
+    for seg in segments:
+        for book_id, length in seg.get("doc_lengths", {}).items():
+            doc_lengths[int(book_id)] = length
+    return doc_lengths
+
+
+def iter_merged_postings(readers: List[SegmentReader], postings_format: str = "docs") -> Iterator[Tuple[str, list]]:
+    """
+    Streaming merge_postings: a k-way merge of the readers' sorted terms, yielding each
+    word's merged postings in term order. Readers are in manifest order, so a book
+    indexed twice keeps only its entries from the newest segment; words left without
+    postings are skipped.
+    """
+    replaced = replaced_books([reader.header()["doc_ids"] for reader in readers])
+
+    def stream(seg_no: int, reader: SegmentReader):
+        fmt = segment_format(reader.header())
+        for word, entries in reader.items():
+            entries = live_postings(entries, seg_no, replaced)
+            if entries:
+                yield word, seg_no, convert_postings(entries, fmt, postings_format)
+
+    # (word, seg_no) is unique per stream, so ties never compare the postings themselves
+    current_word, lists = None, []
+    for word, _seg_no, entries in heapq.merge(*(stream(i, r) for i, r in enumerate(readers))):
+        if word != current_word:
+            if current_word is not None:
+                yield current_word, union_postings(lists)
+            current_word, lists = word, []
+        lists.append(entries)
+    if current_word is not None:
+        yield current_word, union_postings(lists)
+
+
+def _small_runs(segments: List[dict], small_docs: int) -> List[List[dict]]:
+    # Maximal runs of adjacent small segments, oldest first
+    runs: List[List[dict]] = [[]]
+    for s in segments:
+        if s["docs"] < small_docs:
+            runs[-1].append(s)
+        elif runs[-1]:
+            runs.append([])
+    return [run for run in runs if run]
+
+
+def merge_segments(segments_dir: str, small_docs: int = 1000, merge_factor: int = 4) -> Optional[dict]:
+    """
+    Compacts small segments (fewer than `small_docs` books) into one larger segment
+    once at least `merge_factor` of them follow each other in the manifest.
+    Only adjacent segments are merged: the merged segment takes their place in the age
+    order, so merging across a larger segment in between would let a book's entry from
+    before it win over the newer one inside it.
+    Safe to run while the indexer keeps appending new segments; one merge at a time
+    per directory.
+    """
+    with _dir_lock(segments_dir, MERGE_LOCK):
+        return _merge_small_segments(segments_dir, small_docs, merge_factor)
+
+
+def _merge_small_segments(segments_dir: str, small_docs: int, merge_factor: int) -> Optional[dict]:
+    manifest = load_manifest(segments_dir)
+    small = next((run for run in _small_runs(manifest["segments"], small_docs) if len(run) >= merge_factor), None)
+    if small is None:
+        return None
+
+    # The merged segment deletes from older segments what its parts did, less the
+    # entries of the run that a newer part deleted (which the merge drops):
+    # removed = sum(removed) - (sum(df) - merged df)
+    offset: Dict[str, int] = {}
+    for s in small:
+        stats = _read_stats(segments_dir, s["name"])
+        for word, n in stats["removed"].items():
+            offset[word] = offset.get(word, 0) + n
+        for word, n in stats["df"].items():
+            offset[word] = offset.get(word, 0) - n
+
+    def removed(df: Dict[str, int]) -> Dict[str, int]:
+        return {word: offset.get(word, 0) + df.get(word, 0) for word in offset.keys() | df.keys()}
+
+    readers = [SegmentReader(Path(segments_dir) / s["name"]) for s in small]
+    try:
+        headers = [reader.header() for reader in readers]
+        postings_format = common_format(headers)
+        doc_ids = union_postings([header["doc_ids"] for header in headers])
+        entry = _write_segment_file(
+            segments_dir, iter_merged_postings(readers, postings_format), doc_ids, postings_format,
+            merge_doc_lengths(headers), removed,
+        )
+    finally:
+        close_segments(readers)
+    name = entry["name"]
+
+    merged_names = {s["name"] for s in small}
+    newest = small[-1]["name"]
+    with _dir_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(segments_dir)
+        # Manifest order is age order (newer segments win on conflicts), so the merged
+        # segment takes the place of the run of segments it replaces.
+        manifest["segments"] = [
+            entry if s["name"] == newest else s
+            for s in manifest["segments"]
+            if s["name"] not in merged_names or s["name"] == newest
+        ]
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        save_manifest(segments_dir, manifest)
+
+    for old in merged_names:
+        for path in (Path(segments_dir) / old, Path(segments_dir) / stats_name(old)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    print(f"Merged {len(merged_names)} segments into {name} ({len(doc_ids)} books)")
+    return entry
+
+
+def recover_segments(segments_dir: str) -> dict:
+    """
+    Cleans up after a crash: temp files of interrupted writes, SPIMI run directories,
+    and segment files and statistics sidecars that never made it into the manifest (or
+    were merged away just before the crash). The manifest is the source of truth for
+    live segments.
+    Waits for a merge in progress (in this or another process) to finish first.
+    """
+    seg_dir = Path(segments_dir)
+    summary = {"tmp": 0, "runs": 0, "orphans": 0}
+    if not seg_dir.exists():
+        return summary
+
+    with _dir_lock(segments_dir, MERGE_LOCK):
+        summary["tmp"] = remove_stale_tmp(seg_dir)
+        for run_dir in seg_dir.glob("spimi_*"):
+            if run_dir.is_dir():
+                shutil.rmtree(run_dir, ignore_errors=True)
+                summary["runs"] += 1
+        with _dir_lock(segments_dir, MANIFEST_LOCK):
+            live = {s["name"] for s in load_manifest(segments_dir)["segments"]}
+            live |= {stats_name(name) for name in live}
+            for path in seg_dir.glob("seg_*.json"):
+                if path.name not in live:
+                    path.unlink()
+                    summary["orphans"] += 1
+
+    if any(summary.values()):
+        print(
+            f"Recovered segments dir {seg_dir}: removed {summary['tmp']} temp files, "
+            f"{summary['runs']} SPIMI run dirs, {summary['orphans']} orphan segments"
+        )
+    return summary
+
+
+def start_background_merge(segments_dir: str, small_docs: int = 1000, merge_factor: int = 4) -> threading.Thread:
+    t = threading.Thread(
+        target=merge_segments,
+        args=(segments_dir, small_docs, merge_factor),
+        name="segment-merge",
+        daemon=True,
+    )
+    t.start()
+    return t
+
+
+class SegmentedIndex:
+    """
+    Read-only view over all live segments listed in the manifest.
+    Postings for a word are the sorted union of that word's postings in every segment,
+    without the entries of books a newer segment re-indexed.
+    """
+
+    def __init__(self, segments_dir: str):
+        self.segments_dir = segments_dir
+        self.manifest = load_manifest(segments_dir)
+        self.analysis = self.manifest.get("analysis", "none")
+        self.segments = [read_segment(segments_dir, s["name"]) for s in self.manifest["segments"]]
+        self.doc_lengths = merge_doc_lengths(self.segments)
+        self.replaced = replaced_books([seg["doc_ids"] for seg in self.segments])
+
+    def _live(self, word: str) -> Iterator[Tuple[dict, list]]:
+        # (segment, live entries) for the segments holding `word`
+        for seg_no, seg in enumerate(self.segments):
+            entries = live_postings(seg["postings"].get(word, []), seg_no, self.replaced)
+            if entries:
+                yield seg, entries
+
+    def _lists(self, word: str, postings_format: str) -> List[list]:
+        return [
+            convert_postings(entries, segment_format(seg), postings_format)
+            for seg, entries in self._live(word)
+        ]
+
+    def postings(self, word: str) -> List[int]:
+        lists = self._lists(word, "docs")
+        return union_postings(lists) if lists else []
+
+    def postings_with_freqs(self, word: str) -> List[Tuple[int, int]]:
+        """
+        Returns [(book_id, tf), ...]; books from docs-only segments count tf=1.
+        """
+        lists = []
+        for seg, entries in self._live(word):
+            fmt = segment_format(seg)
+            if fmt == "docs":
+                lists.append([[book_id, 1] for book_id in entries])
+            else:
+                lists.append(convert_postings(entries, fmt, "freqs"))
+        return [(book_id, tf) for book_id, tf in union_postings(lists)] if lists else []
+
+    def positions(self, word: str) -> Dict[int, List[int]]:
+        """
+        Returns {book_id: [position, ...]} from the segments that store positions.
+        """
+        lists = [entries for seg, entries in self._live(word) if segment_format(seg) == "positions"]
+        if not lists:
+            return {}
+        return {book_id: decode_positions(deltas) for book_id, deltas in union_postings(lists)}
+
+    @property
+    def has_freqs(self) -> bool:
+        return bool(self.segments) and common_format(self.segments) != "docs"
+
+    def doc_length(self, book_id: int) -> int:
+        return self.doc_lengths.get(book_id, 0)
+
+    def terms(self) -> List[str]:
+        words = set()
+        for seg_no, seg in enumerate(self.segments):
+            if not self.replaced:
+                words.update(seg["postings"].keys())
+                continue
+            for word, entries in seg["postings"].items():
+                if word not in words and live_postings(entries, seg_no, self.replaced):
+                    words.add(word)
+        return sorted(words)
+
+    def doc_ids(self) -> List[int]:
+        return union_postings([seg["doc_ids"] for seg in self.segments]) if self.segments else []
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return merge_postings(self.segments)
+
+
+def export_json(segments_dir: str, output_path: str) -> int:
+    """
+    Writes the single-file index (word -> [book_id, ...]) consumed by the Java SearchEngine,
+    streamed from the segment files term by term. Returns the number of words exported.
+    """
+    _, readers = open_segments(segments_dir)
+    words = 0
+    try:
+        with atomic_file(output_path) as f:
+            f.write("{")
+            for word, ids in iter_merged_postings(readers):
+                if words:
+                    f.write(",")
+                f.write(json.dumps(word, ensure_ascii=False))
+                f.write(":")
+                f.write(json.dumps(ids, separators=(",", ":")))
+                words += 1
+            f.write("}")
+    finally:
+        close_segments(readers)
+    return words
+
+
+def import_json_index(segments_dir: str, json_path: str) -> Optional[dict]:
+    """
+    Imports a legacy single-file JSON index as the first segment.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        legacy = json.load(f)
+    postings = {word: sorted(set(ids)) for word, ids in legacy.items()}
+    doc_ids = set(book_id for ids in postings.values() for book_id in ids)
+    return write_segment(segments_dir, postings, doc_ids)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Segmented inverted index maintenance.")
+    ap.add_argument("--segments", default="index/segments", help="Segments directory")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    m = sub.add_parser("merge", help="Compact small segments")
+    m.add_argument("--small-docs", type=int, default=1000)
+    m.add_argument("--merge-factor", type=int, default=4)
+
+    e = sub.add_parser("export", help="Export a single-file JSON index")
+    e.add_argument("--output", default="index/inverted_index.json")
+
+    args = ap.parse_args()
+    if args.cmd == "merge":
+        if merge_segments(args.segments, args.small_docs, args.merge_factor) is None:
+            print("Nothing to merge.")
+    elif args.cmd == "export":
+        n = export_json(args.segments, args.output)
+        print(f"Exported {n} words to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Document-partitioned index shards and a scatter-gather query coordinator.
+
+Books are split into `count` shards by book ID, either by a hash ("hash", the default:
+consecutive IDs spread evenly) or in ranges of `range_size` IDs ("range": shard i holds
+IDs [i * range_size, (i + 1) * range_size), the last shard everything above). Each shard is
+an ordinary segmented index with its own progress cursor:
+
+    index/shards/shards.json                  {"count": 4, "scheme": "hash", "range_size": ..., "hash_version": 2}
+    index/shards/shard_00/segments/ ...
+    index/shards/shard_00/progress.json
+
+Every shard reads the whole datalake manifest and indexes only its own books, so shards
+can be built by separate processes or machines sharing the datalake:
+
+    python -m inverted_index.shards build --shards 4               # all shards, in parallel
+    python -m inverted_index.shards build --shards 4 --shard 2     # just one
+    python -m inverted_index.shards search "whale AND ship" --k 10
+
+ShardedSearcher starts one searcher process per shard and sends each query to all of
+them at once. Scores use the statistics of the whole collection: N and avgdl summed
+from the shards' segment statistics, and the document frequencies of the query's terms
+sent along with the query. Each shard's top k is therefore already globally scored,
+and the coordinator merges them into the global top k.
+"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from inverted_index.analysis import SCHEMES as ANALYSIS_SCHEMES
+from inverted_index.checkpoint import read_json, write_json_atomic
+from inverted_index.dedup import SignatureStore
+from inverted_index.index_stats import collection_stats
+from inverted_index.indexer import build_inverted_index
+from inverted_index.query import QueryEngine, load_index, parse_query, positive_terms
+
+LAYOUT_NAME = "shards.json"
+SHARD_SCHEMES = ("hash", "range")
+DEFAULT_RANGE_SIZE = 25000
+# Hash function of new "hash" layouts. Layouts without "hash_version" were built with
+# version 1, which they keep: changing it would move books to other shards.
+HASH_VERSION = 2
+
+
+def shard_of(book_id: int, count: int, scheme: str = "hash", range_size: int = DEFAULT_RANGE_SIZE,
+             hash_version: int = HASH_VERSION) -> int:
+    if scheme == "range":
+        return min(book_id // range_size, count - 1)
+    h = (book_id * 2654435761) & 0xFFFFFFFF
+    if hash_version < 2:
+        # The low bits of the product: for a power-of-two count, just book_id % count
+        return h % count
+    # Multiplicative (Fibonacci) hash: the high bits of the product depend on every bit
+    # of the ID, so ID patterns (e.g. only even IDs) do not skew it; h * count >> 32
+    # scales them to [0, count) for any count
+    return (h * count) >> 32
+
+
+def shard_paths(root, index: int) -> Dict[str, Path]:
+    shard_dir = Path(root) / f"shard_{index:02d}"
+    return {
+        "dir": shard_dir,
+        "segments": shard_dir / "segments",
+        "progress": shard_dir / "progress.json",
+        # Never written; build_inverted_index only reads it to migrate a legacy index
+        "output": shard_dir / "inverted_index.json",
+    }
+
+
+def _with_hash_version(layout: dict) -> dict:
+    if layout["scheme"] == "hash":
+        return {**layout, "hash_version": layout.get("hash_version", 1)}
+    return layout
+
+
+def load_layout(root) -> dict:
+    layout = read_json(Path(root) / LAYOUT_NAME)
+    if layout is None:
+        raise FileNotFoundError(f"No sharded index in {root} ({LAYOUT_NAME} missing)")
+    return _with_hash_version(layout)
+
+
+def init_layout(root, count: int, scheme: str = "hash", range_size: int = DEFAULT_RANGE_SIZE) -> dict:
+    """
+    Records how books are assigned to shards. Raises ValueError if `root` was sharded
+    differently: books would end up in two shards, or in none. An existing "hash" layout
+    keeps the hash version it was built with.
+    """
+    if count < 1:
+        raise ValueError("The number of shards must be at least 1")
+    if scheme not in SHARD_SCHEMES:
+        raise ValueError(f"Unknown shard scheme {scheme!r} (expected one of {', '.join(SHARD_SCHEMES)})")
+    layout = {"count": count, "scheme": scheme, "range_size": range_size if scheme == "range" else None}
+    path = Path(root) / LAYOUT_NAME
+    current = read_json(path)
+    if current is None:
+        if scheme == "hash":
+            layout["hash_version"] = HASH_VERSION
+        write_json_atomic(path, layout, indent=2)
+        return layout
+    if {key: current.get(key) for key in layout} != layout:
+        raise ValueError(
+            f"Index in {root} is sharded as {current}, not {layout}; delete it to re-shard"
+        )
+    return _with_hash_version(current)
+
+
+def build_shard(
+    datalake_path: str,
+    root: str,
+    index: int,
+    count: int,
+    scheme: str = "hash",
+    range_size: int = DEFAULT_RANGE_SIZE,
+    workers: int = 1,
+    postings_format: str = "docs",
+    memory_budget_mb: float = None,
+    analysis: str = "none",
+    dedup_db: str = None,
+) -> None:
+    """
+    Indexes the new books of shard `index` of `count`, like build_inverted_index.
+    With `dedup_db` (inverted_index.dedup), known near-duplicates are left out.
+    """
+    layout = init_layout(root, count, scheme, range_size)
+    if not 0 <= index < count:
+        raise ValueError(f"Shard {index} does not exist (shards 0-{count - 1})")
+    paths = shard_paths(root, index)
+    store = SignatureStore(dedup_db) if dedup_db else None
+
+    def in_shard(book_id: int) -> bool:
+        if shard_of(book_id, layout["count"], layout["scheme"], layout["range_size"],
+                    layout.get("hash_version", HASH_VERSION)) != index:
+            return False
+        return store is None or store.should_index(book_id)
+
+    try:
+        build_inverted_index(
+            datalake_path, str(paths["output"]), str(paths["progress"]), str(paths["segments"]), workers,
+            postings_format, memory_budget_mb, analysis, book_filter=in_shard,
+        )
+    finally:
+        if store is not None:
+            store.close()
+
+
+def build_shards(
+    datalake_path: str,
+    root: str,
+    count: int,
+    scheme: str = "hash",
+    range_size: int = DEFAULT_RANGE_SIZE,
+    workers: int = 1,
+    postings_format: str = "docs",
+    memory_budget_mb: float = None,
+    analysis: str = "none",
+    dedup_db: str = None,
+) -> None:
+    """
+    Builds every shard at once, one process each (`workers` more per shard).
+    """
+    init_layout(root, count, scheme, range_size)
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(
+            target=build_shard, name=f"shard-{i}",
+            args=(datalake_path, root, i, count, scheme, range_size, workers, postings_format,
+                  memory_budget_mb, analysis, dedup_db),
+        )
+        for i in range(count)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    failed = [proc.name for proc in procs if proc.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Shard builds failed: {', '.join(failed)}")
+
+
+def load_collection(root) -> dict:
+    """
+    Statistics of the whole collection, combined from the shards' segment statistics:
+    {"N": ..., "avgdl": ..., "df": {word: df}, "analysis": ...}.
+    """
+    layout = load_layout(root)
+    n = 0
+    total_length = 0
+    df: Dict[str, int] = {}
+    analyses = set()
+    for i in range(layout["count"]):
+        stats = collection_stats(str(shard_paths(root, i)["segments"]))
+        lengths = stats["doc_lengths"]
+        n += len(lengths)
+        total_length += sum(lengths.values())
+        for word, count in stats["df"].items():
+            df[word] = df.get(word, 0) + count
+        analyses.add(stats["analysis"])
+    if len(analyses) > 1:
+        raise ValueError(f"Shards in {root} were built with different analysis schemes: {sorted(analyses)}")
+    return {
+        "N": n,
+        "avgdl": total_length / n if n else 0.0,
+        "df": df,
+        "analysis": analyses.pop() if analyses else "none",
+    }
+
+
+def _serve_shard(segments_dir: str, collection: dict, k1: float, b: float, conn) -> None:
+    # One shard searcher process: answers batches of queries until it receives None
+    try:
+        engine = QueryEngine(load_index(segments_dir), k1, b, collection.get("analysis"), collection)
+        conn.send(("ready", engine.N))
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        queries, k, mode, dfs = request
+        try:
+            conn.send(("ok", [engine.search(q, k, mode, df=df) for q, df in zip(queries, dfs)]))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+
+class ShardedSearcher:
+    """
+    Scatter-gather search over all shards of `root`, one process per shard.
+    """
+
+    def __init__(self, root, k1: float = 1.2, b: float = 0.75):
+        self.root = root
+        self.layout = load_layout(root)
+        collection = load_collection(root)
+        self.df = collection.pop("df")
+        self.analysis = collection["analysis"]
+        self.N = collection["N"]
+
+        ctx = multiprocessing.get_context("spawn")
+        self._conns = []
+        self._procs = []
+        for i in range(self.layout["count"]):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_serve_shard, name=f"shard-search-{i}", daemon=True,
+                args=(str(shard_paths(root, i)["segments"]), collection, k1, b, child),
+            )
+            proc.start()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self.shard_sizes = [self._receive(conn) for conn in self._conns]
+
+    def _receive(self, conn):
+        status, payload = conn.recv()
+        if status == "error":
+            raise RuntimeError(f"Shard searcher failed: {payload}")
+        return payload
+
+    def _query_df(self, query: str, mode: str) -> Dict[str, int]:
+        # Global document frequencies of the terms the shards will score
+        node = parse_query(query, mode, self.analysis)
+        return {term: self.df.get(term, 0) for term in set(positive_terms(node))}
+
+    def search_batch(self, queries: List[str], k: int = 10, mode: str = "and") -> List[List[Tuple[int, float]]]:
+        dfs = [self._query_df(q, mode) for q in queries]
+        # Scatter to every shard first, so they all work at the same time
+        for conn in self._conns:
+            conn.send((queries, k, mode, dfs))
+        per_shard = [self._receive(conn) for conn in self._conns]
+        return [
+            heapq.nsmallest(k, (hit for shard in per_shard for hit in shard[i]), key=lambda h: (-h[1], h[0]))
+            for i in range(len(queries))
+        ]
+
+    def search(self, query: str, k: int = 10, mode: str = "and") -> List[Tuple[int, float]]:
+        return self.search_batch([query], k, mode)[0]
+
+    def close(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._conns, self._procs = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and search a document-partitioned (sharded) index.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Index the new books of one shard or of all shards")
+    b.add_argument("--datalake", default="datalake")
+    b.add_argument("--root", default="index/shards", help="Directory of the sharded index")
+    b.add_argument("--shards", type=int, required=True, help="Number of shards")
+    b.add_argument("--shard", type=int, default=None, help="Build only this shard (default: all, in parallel)")
+    b.add_argument("--scheme", choices=SHARD_SCHEMES, default="hash")
+    b.add_argument("--range-size", type=int, default=DEFAULT_RANGE_SIZE, help="Book IDs per shard with --scheme range")
+    b.add_argument("--workers", type=int, default=1, help="Worker processes per shard")
+    b.add_argument("--postings", choices=["docs", "freqs", "positions"], default="docs")
+    b.add_argument("--memory-budget-mb", type=float, default=None)
+    b.add_argument("--analysis", choices=ANALYSIS_SCHEMES, default="none")
+    b.add_argument("--dedup-db", default=None, help="Leave out the near-duplicates recorded in this signature store")
+
+    s = sub.add_parser("search", help="Query all shards")
+    s.add_argument("query", nargs="?")
+    s.add_argument("--root", default="index/shards")
+    s.add_argument("--mode", choices=["and", "or"], default="and")
+    s.add_argument("--k", type=int, default=10)
+    s.add_argument("--batch", type=Path, help="File with one query per line")
+    s.add_argument("--benchmark", action="store_true", help="Time the batch queries instead of printing results")
+    args = ap.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        build_args = (args.scheme, args.range_size, args.workers, args.postings, args.memory_budget_mb, args.analysis,
+                      args.dedup_db)
+        if args.shard is None:
+            build_shards(args.datalake, args.root, args.shards, *build_args)
+        else:
+            build_shard(args.datalake, args.root, args.shard, args.shards, *build_args)
+        print(f"Built in {time.perf_counter() - start:.2f}s -> {args.root}")
+        return
+
+    if args.batch:
+        queries = [q.strip() for q in args.batch.read_text(encoding="utf-8").splitlines() if q.strip()]
+    elif args.query:
+        queries = [args.query]
+    else:
+        ap.error("give a query or --batch")
+
+    t0 = time.perf_counter()
+    with ShardedSearcher(args.root) as searcher:
+        print(f"{len(searcher.shard_sizes)} shards loaded in {time.perf_counter() - t0:.3f}s "
+              f"({searcher.N} books: {searcher.shard_sizes}, analysis {searcher.analysis})")
+        t0 = time.perf_counter()
+        results = searcher.search_batch(queries, args.k, args.mode)
+        seconds = time.perf_counter() - t0
+    if args.benchmark:
+        print(json.dumps({"queries": len(queries), "seconds": round(seconds, 4),
+                          "qps": round(len(queries) / seconds, 2) if seconds else 0.0}))
+        return
+    for q, hits in zip(queries, results):
+        print(f"# {q}")
+        for book_id, score in hits:
+            print(f"{book_id}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
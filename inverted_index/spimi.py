@@ -0,0 +1,133 @@
+import heapq
+import json
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from inverted_index.postings import TermPostings, merge_into
+from inverted_index.segments import live_postings, replaced_books, union_postings, write_segment_stream
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Highest resident set size since the process started, in MB: the larger of this
+    process's own peak and that of its largest finished child (worker pools), not their
+    sum. It is a lifetime high-water mark, so in a long-running process (Control) it
+    never goes down from one indexer run to the next.
+    Returns None where the platform does not expose it (e.g. Windows without psutil).
+    """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = max(self_kb, children_kb)
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _read_run(path: Path, run_no: int) -> Iterator[Tuple[str, int, list]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            word, entries = json.loads(line)
+            yield word, run_no, entries
+
+
+class SpimiBuilder:
+    """
+    Single-pass in-memory indexing with a memory budget: postings accumulate in a dict
+    until the estimated size exceeds the budget, then are flushed as a sorted run file.
+    finish() k-way merges all runs into one segment, streaming term by term.
+
+    Each run holds sorted postings; the final merge unions a term's postings across
+    runs. A batch that indexes a book again flushes the pending postings first, so each
+    run holds one version of a book and the final merge keeps only the latest run's
+    entries for it, as segments do.
+    """
+
+    def __init__(self, segments_dir: str, memory_budget_mb: float, postings_format: str = "docs"):
+        self.segments_dir = segments_dir
+        self.budget = int(memory_budget_mb * 1024 * 1024)
+        self.postings_format = postings_format
+        Path(segments_dir).mkdir(parents=True, exist_ok=True)
+        self.run_dir = Path(tempfile.mkdtemp(prefix="spimi_", dir=segments_dir))
+        self.runs: List[Path] = []
+        # Book IDs in each run, and in the postings not flushed yet
+        self.run_doc_ids: List[List[int]] = []
+        self.pending_ids: set = set()
+        self.postings: Dict[str, TermPostings] = {}
+        self.doc_ids: List[int] = []
+        self.doc_lengths: Dict[int, int] = {}
+        self.estimated = 0
+
+    def add(self, postings: Dict[str, TermPostings], doc_ids: List[int], doc_lengths: Dict[int, int]):
+        """
+        Adds the partial postings of a batch of books (as returned by indexer.index_books).
+        """
+        if not self.pending_ids.isdisjoint(doc_ids):
+            self.flush()
+        self.estimated += merge_into(self.postings, postings)
+        self.pending_ids.update(doc_ids)
+        self.doc_ids.extend(doc_ids)
+        self.doc_lengths.update(doc_lengths)
+
+        if self.estimated >= self.budget:
+            self.flush()
+
+    def flush(self):
+        if not self.postings:
+            return
+        path = self.run_dir / f"run_{len(self.runs):05d}.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for word in sorted(self.postings):
+                entries = self.postings[word].to_list()
+                f.write(json.dumps([word, entries], ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+        self.runs.append(path)
+        self.run_doc_ids.append(sorted(self.pending_ids))
+        print(f"SPIMI run flushed: {path.name} ({len(self.postings)} words, ~{self.estimated // (1024 * 1024)} MB)")
+        self.postings = {}
+        self.pending_ids = set()
+        self.estimated = 0
+
+    def _merged(self) -> Iterator[Tuple[str, list]]:
+        # (word, run_no) is unique per stream, so ties never compare the postings themselves
+        streams = [_read_run(path, run_no) for run_no, path in enumerate(self.runs)]
+        replaced = replaced_books(self.run_doc_ids)
+        current_word, lists = None, []
+        for word, run_no, entries in heapq.merge(*streams):
+            entries = live_postings(entries, run_no, replaced)
+            if not entries:
+                continue
+            if word != current_word:
+                if current_word is not None:
+                    yield current_word, union_postings(lists)
+                current_word, lists = word, []
+            lists.append(entries)
+        if current_word is not None:
+            yield current_word, union_postings(lists)
+
+    def finish(self, checkpoint: Optional[dict] = None) -> Optional[dict]:
+        """
+        Merges all runs into a new segment and removes the run files.
+        `checkpoint` is committed with the segment (see segments.write_segment).
+        Returns the manifest entry of the segment (None if nothing was added).
+        """
+        try:
+            self.flush()
+            if not self.runs:
+                return None
+            return write_segment_stream(
+                self.segments_dir, self._merged(), sorted(set(self.doc_ids)), self.postings_format, self.doc_lengths,
+                checkpoint,
+            )
+        finally:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -4,21 +4,139 @@ from control.control import Control
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Data pipeline that downloads, indexes, and processes metadata in batches of 10 books."
+        description="Data pipeline that downloads, indexes, and processes metadata in adaptively sized batches of books."
     )
     parser.add_argument("--datalake", default="datalake", help="Datalake root directory")
-    parser.add_argument("--catalog", default="metadata/catalog.json", help="Path to output JSON catalog")
+    parser.add_argument("--catalog", default="metadata/catalog.jsonl", help="Path to the JSON-lines metadata catalog")
     parser.add_argument(
         "--progress-parser", default="metadata/progress_parser.json", help="Path to parser progress JSON"
     )
     parser.add_argument("--db", default="datamart/datamart.db", help="Path to SQLite database file")
     parser.add_argument("--index-output", default="index/inverted_index.json", help="Path to inverted index JSON")
+    parser.add_argument("--index-segments", default="index/segments", help="Directory of inverted index segments")
+    parser.add_argument(
+        "--json-export", action="store_true",
+        help="Also export the single-file JSON index (for the Java search service) when the segments change"
+    )
+    parser.add_argument(
+        "--binary-index", default=None, help="Also export a compressed binary index to this path each cycle"
+    )
+    parser.add_argument(
+        "--storage", choices=["loose", "pack"], default="loose",
+        help="Store new books as loose .txt files or in one compressed pack per hour folder",
+    )
     parser.add_argument("--progress-indexer", default="indexer/progress.json", help="Path to indexer progress JSON")
+    parser.add_argument("--fts", action="store_true", help="Also index book bodies into an FTS5 table in the datamart")
+    parser.add_argument(
+        "--progress-fts", default="indexer/progress_fts.json", help="Path to FTS indexer progress JSON"
+    )
+    parser.add_argument(
+        "--dedup", action="store_true", help="Compute MinHash signatures of new books and flag near-duplicates"
+    )
+    parser.add_argument(
+        "--skip-duplicates", action="store_true",
+        help="Only index the canonical copy of near-duplicate books (implies --dedup)",
+    )
+    parser.add_argument(
+        "--dedup-threshold", type=float, default=0.8, help="Estimated similarity from which books count as duplicates"
+    )
+    parser.add_argument("--dedup-db", default="index/signatures.db", help="Signature store and alias mapping")
+    parser.add_argument(
+        "--progress-dedup", default="indexer/progress_dedup.json", help="Path to signature stage progress JSON"
+    )
     parser.add_argument("--progress-crawler", default="crawler/progress.json", help="Path to crawler progress JSON")
-    parser.add_argument("--batch-size", type=int, default=10, help="Batch size for crawler")
-    parser.add_argument("--sleep-seconds", type=int, default=120, help="Sleep seconds between cycles")
+    parser.add_argument(
+        "--full-rebuild", action="store_true", help="Re-apply the whole catalog to the datamart on the first cycle"
+    )
+    parser.add_argument("--batch-size", type=int, default=10, help="Batch size for crawler (initial size if adaptive)")
+    parser.add_argument(
+        "--sleep-seconds", type=float, default=120,
+        help="Sleep seconds between cycles (the longest pause if adaptive)",
+    )
+    parser.add_argument(
+        "--crawl-schedule", choices=["adaptive", "fixed"], default="adaptive",
+        help="Adapt crawler batch size and pause to the server's latency, errors and 429/503 answers, or keep them fixed",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=200, help="Largest adaptive crawler batch")
+    parser.add_argument("--min-sleep-seconds", type=float, default=1.0, help="Shortest adaptive pause between cycles")
+    parser.add_argument(
+        "--target-latency", type=float, default=5.0,
+        help="Median request seconds above which the adaptive crawler backs off",
+    )
+    parser.add_argument(
+        "--gap-limit", type=int, default=100,
+        help="Missing IDs in a row past the newest stored book that mark the end of the catalog",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Indexer and header parser worker processes (1 = single process)")
+    parser.add_argument(
+        "--postings",
+        choices=["docs", "freqs", "positions"],
+        default="docs",
+        help="Postings detail: book IDs only, + term frequencies (BM25), or + positions (phrase queries)",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        default=None,
+        help="Build the index SPIMI-style, spilling sorted runs to disk above this memory budget",
+    )
+    parser.add_argument(
+        "--analysis",
+        choices=["none", "light"],
+        default="none",
+        help="Text analysis: every word, or per-language stopword removal + light stemming (English, Spanish)",
+    )
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="Split the index into this many document-partitioned shards, built in parallel (see --shards-dir)",
+    )
+    parser.add_argument("--shard-scheme", choices=["hash", "range"], default="hash", help="How books map to shards")
+    parser.add_argument("--shard-range-size", type=int, default=25000, help="Book IDs per shard with --shard-scheme range")
+    parser.add_argument("--shards-dir", default="index/shards", help="Directory of the sharded index (--shards > 1)")
+    parser.add_argument("--crawler-concurrency", type=int, default=4, help="Concurrent book downloads")
+    parser.add_argument("--crawl-rate", type=float, default=5.0, help="Max crawler requests per second")
+    parser.add_argument(
+        "--pipeline", action="store_true", help="Run crawler, indexer and metadata stages concurrently"
+    )
+    parser.add_argument("--queue-size", type=int, default=64, help="Bounded queue size between pipeline stages")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--watch",
+        action="store_true",
+        help="Only index: follow the datalake manifest and index new books within seconds (crawl elsewhere)",
+    )
+    mode.add_argument(
+        "--crawl-only", action="store_true", help="Only download; pair with a --watch process for indexing"
+    )
+    parser.add_argument(
+        "--watch-window", type=float, default=2.0, help="Seconds to collect new books into one batch in --watch mode"
+    )
+    parser.add_argument(
+        "--watch-max-batch", type=int, default=256, help="Index at once when this many new books are waiting (--watch)"
+    )
+    parser.add_argument("--base-url", default=None, help="Alternative Gutenberg mirror (e.g. http://127.0.0.1:8000)")
+    parser.add_argument("--crawler-state", default="crawler/state.db", help="Per-ID crawl state database")
+    parser.add_argument(
+        "--missing-ttl-hours", type=float, default=168.0, help="Do not re-request IDs that returned 404 for this long"
+    )
+    parser.add_argument(
+        "--refresh-batch", type=int, default=0, help="Stored books re-checked per cycle with conditional requests"
+    )
+    parser.add_argument(
+        "--refresh-after-hours", type=float, default=24.0, help="Only re-check books not checked for this long"
+    )
+    parser.add_argument(
+        "--metrics-file", default=None, help="Prometheus text file rewritten after every cycle (e.g. metrics/gutenberg.prom)"
+    )
+    parser.add_argument("--metrics-log", default=None, help="JSON-lines file with one metrics snapshot per cycle")
+    parser.add_argument(
+        "-v", "--verbosity", type=int, choices=[0, 1, 2], default=1,
+        help="0: cycle summaries only, 1: per-batch progress, 2: one line per book",
+    )
 
     args = parser.parse_args()
+    if args.pipeline and (args.watch or args.crawl_only):
+        parser.error("--pipeline already runs every stage; it cannot be combined with --watch or --crawl-only")
 
     control = Control(
         datalake=args.datalake,
@@ -26,10 +144,51 @@ def main():
         progress_parser=args.progress_parser,
         db=args.db,
         index_output=args.index_output,
+        index_segments=args.index_segments,
+        json_export=args.json_export,
+        binary_output=args.binary_index,
         progress_indexer=args.progress_indexer,
         progress_crawler=args.progress_crawler,
         batch_size=args.batch_size,
         sleep_seconds=args.sleep_seconds,
+        crawl_schedule=args.crawl_schedule,
+        max_batch_size=args.max_batch_size,
+        min_sleep_seconds=args.min_sleep_seconds,
+        target_latency=args.target_latency,
+        gap_limit=args.gap_limit,
+        workers=args.workers,
+        postings_format=args.postings,
+        memory_budget_mb=args.memory_budget_mb,
+        analysis=args.analysis,
+        shards=args.shards,
+        shard_scheme=args.shard_scheme,
+        shard_range_size=args.shard_range_size,
+        shards_dir=args.shards_dir,
+        crawler_concurrency=args.crawler_concurrency,
+        crawl_rate=args.crawl_rate,
+        base_url=args.base_url,
+        pipelined=args.pipeline,
+        queue_size=args.queue_size,
+        watch=args.watch,
+        crawl_only=args.crawl_only,
+        watch_window=args.watch_window,
+        watch_max_batch=args.watch_max_batch,
+        full_rebuild=args.full_rebuild,
+        fts=args.fts,
+        progress_fts=args.progress_fts,
+        dedup=args.dedup,
+        skip_duplicates=args.skip_duplicates,
+        dedup_threshold=args.dedup_threshold,
+        dedup_db=args.dedup_db,
+        progress_dedup=args.progress_dedup,
+        storage=args.storage,
+        metrics_file=args.metrics_file,
+        metrics_log=args.metrics_log,
+        verbosity=args.verbosity,
+        crawler_state=args.crawler_state,
+        missing_ttl_hours=args.missing_ttl_hours,
+        refresh_batch=args.refresh_batch,
+        refresh_after_hours=args.refresh_after_hours,
     )
     control.run()
 
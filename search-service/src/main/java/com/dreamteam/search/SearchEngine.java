@@ -14,23 +14,39 @@ import java.util.stream.Collectors;
  * Loads an inverted index from JSON (term -> list of book IDs).
  * Provides simple AND/OR search with IDF-based scoring.
  * If TF is not available, TF is implicitly 1 per term-doc presence.
+ * N and document frequencies come from the stats.json exported next to the index
+ * when it exists; otherwise they are computed by scanning every posting list.
  */
 public class SearchEngine {
 
     private Map<String, List<Integer>> index;
     private Map<String, Double> idf;
     private int N;
+    private Set<String> stopwords = Set.of();
+
+    /** Subset of the exported stats.json (inverted_index/index_stats.py). */
+    private static class IndexStats {
+        int N;
+        Map<String, Integer> df;
+        List<String> stopwords;
+    }
 
     public SearchEngine(Path indexPath) {
-        this.index = loadIndex(indexPath);
-        this.N = estimateDocCount(index);
-        this.idf = computeIdf(index, N);
+        reload(indexPath);
     }
 
     public void reload(Path indexPath) {
         this.index = loadIndex(indexPath);
-        this.N = estimateDocCount(index);
-        this.idf = computeIdf(index, N);
+        IndexStats stats = loadStats(indexPath.resolveSibling("stats.json"));
+        if (stats != null && stats.df != null) {
+            this.N = stats.N;
+            this.idf = idfFromDf(stats.df, N);
+            this.stopwords = stats.stopwords == null ? Set.of() : Set.copyOf(stats.stopwords);
+        } else {
+            this.N = estimateDocCount(index);
+            this.idf = computeIdf(index, N);
+            this.stopwords = Set.of();
+        }
     }
 
     public static class ScoredDoc {
@@ -78,9 +94,10 @@ public class SearchEngine {
                 .collect(Collectors.toList());
     }
 
-    private static List<String> tokenize(String q) {
+    private List<String> tokenize(String q) {
+        // Stopwords were not indexed (analysis "light"), so they must not be required
         return Arrays.stream(q.toLowerCase(Locale.ROOT).split("\\W+"))
-                .filter(s -> !s.isBlank()).toList();
+                .filter(s -> !s.isBlank() && !stopwords.contains(s)).toList();
     }
 
     private static Map<String, List<Integer>> loadIndex(Path p) {
@@ -95,6 +112,23 @@ public class SearchEngine {
         }
     }
 
+    private static IndexStats loadStats(Path p) {
+        if (!Files.exists(p)) return null;
+        try {
+            return new Gson().fromJson(Files.readString(p), IndexStats.class);
+        } catch (IOException | RuntimeException e) {
+            return null; // fall back to scanning the index
+        }
+    }
+
+    private static Map<String, Double> idfFromDf(Map<String, Integer> df, int N) {
+        Map<String, Double> m = new HashMap<>();
+        for (var e : df.entrySet()) {
+            m.put(e.getKey(), Math.log((N + 1.0) / (e.getValue() + 1.0)) + 1.0); // smoothed IDF
+        }
+        return m;
+    }
+
     private static int estimateDocCount(Map<String, List<Integer>> idx) {
         Set<Integer> docs = new HashSet<>();
         for (var v : idx.values()) docs.addAll(v);
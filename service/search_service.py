@@ -0,0 +1,494 @@
+"""
+Python search service over the indexer's output, with the Java search-service contract:
+
+    GET  /health
+    GET  /book/{id}
+    GET  /search?q=whale+ship&mode=and&author=melville&language=en&page=1&pageSize=20
+    POST /admin/reload
+
+    python -m service.search_service --index index/segments --db datamart/datamart.db --port 8082
+
+A plain asyncio HTTP/1.1 server (keep-alive, JSON only); queries and SQLite lookups run
+in a thread pool so the event loop keeps accepting requests.
+
+Every request uses the index Snapshot current when it arrived. A reload (POST
+/admin/reload, or the background check every --reload-interval seconds when the index
+changed on disk) builds the next snapshot in a separate thread while queries keep
+running on the old one, then swaps the reference and bumps the generation; the old
+snapshot is closed once its last request finishes.
+
+A search only ranks as many hits as the requested page needs: the engine is asked for that
+many and, when the datamart and the author and language filters drop some, for twice as
+many until the page is full. "total" is exact, as in the Java service: every book the
+query matches is checked against the datamart and the filters, without being scored.
+Pages past --max-results come back empty. As in the Java service, only books with a row
+in the datamart are returned.
+
+Results are cached in an LRU keyed on (generation, normalized query, mode, author,
+language), so a swap invalidates them. An entry holds the hits ranked so far; a later
+page beyond them ranks the query again, deeper, and replaces it. The datamart is read through a pool of
+read-only connections, which see the pipeline's WAL commits without reopening.
+
+With --dedup-db (the signature store of inverted_index.dedup), every hit also lists the
+IDs of its near-duplicate copies under "aliases", so books left out of the index by
+--skip-duplicates can still be found.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import signal
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from control.metrics import log
+from inverted_index.query import QueryEngine, load_index
+
+VERSION = "1.0.0"
+OPERATORS = ("AND", "OR", "NOT")
+IN_CHUNK = 500
+MAX_BODY = 1 << 20
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def normalize_query(q: str) -> str:
+    # Words are lowercased by the parser anyway; operators are case-sensitive
+    return " ".join(t if t in OPERATORS else t.lower() for t in q.split())
+
+
+def index_version(path: str) -> Optional[tuple]:
+    """
+    Cheap fingerprint of the index on disk: the segment manifest for a segments
+    directory (rewritten whenever a segment is added or merged), else the file itself.
+    """
+    p = Path(path)
+    if p.is_dir():
+        p = p / "manifest.json"
+    try:
+        st = p.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class ResultCache:
+    """
+    LRU of search results. Only touched from the event loop thread.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._items: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple, value: tuple) -> None:
+        if self.capacity <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+class ConnectionPool:
+    """
+    Read-only SQLite connections shared by the worker threads.
+    """
+
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except sqlite3.Error:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        self._idle.put(conn)
+
+    def fetch(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        conn = self.acquire()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Snapshot:
+    """
+    One loaded index version. `active` counts the requests still using it.
+    """
+
+    def __init__(self, generation: int, engine: QueryEngine, version: Optional[tuple]):
+        self.generation = generation
+        self.engine = engine
+        self.version = version
+        self.loaded_at = time.time()
+        self.active = 0
+        self.retired = False
+
+    def close(self) -> None:
+        close = getattr(self.engine.index, "close", None)
+        if close is not None:
+            close()
+
+
+def _book(row: sqlite3.Row) -> dict:
+    return {"bookId": row["book_id"], "title": row["title"], "author": row["author"], "language": row["language"]}
+
+
+class SearchService:
+    def __init__(self, index_path: str, db_path: str, threads: int = 4, cache_size: int = 1024,
+                 max_results: int = 1000, reload_interval: float = 5.0, dedup_db: Optional[str] = None):
+        self.index_path = index_path
+        self.db_path = db_path
+        self.max_results = max_results
+        self.reload_interval = reload_interval
+        self.cache = ResultCache(cache_size)
+        self.pool = ConnectionPool(db_path, threads)
+        self.alias_pool = ConnectionPool(dedup_db, threads) if dedup_db else None
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="search")
+        # Builds never compete with queries for the query threads
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self.snapshot: Optional[Snapshot] = None
+        self.generation = 0
+        self._connections = set()
+
+    # ------------------------------------------------------------ index versions
+
+    def _build(self, generation: int) -> Snapshot:
+        version = index_version(self.index_path)
+        try:
+            index = load_index(self.index_path)
+        except FileNotFoundError:
+            # A background merge removed a segment between reading the manifest and the segment
+            version = index_version(self.index_path)
+            index = load_index(self.index_path)
+        return Snapshot(generation, QueryEngine(index), version)
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Builds the next snapshot off the event loop and swaps it in. Without `force`,
+        only if the index changed on disk. Returns whether a swap happened.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            old = self.snapshot
+            if not force and old is not None and index_version(self.index_path) == old.version:
+                return False
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            new = await loop.run_in_executor(self._builder, self._build, self.generation + 1)
+            self.snapshot = new
+            self.generation = new.generation
+            self.cache.clear()
+            if old is not None:
+                old.retired = True
+                if not old.active:
+                    old.close()
+            log(1, f"[service] Index generation {new.generation} loaded in {time.perf_counter() - start:.2f}s "
+                   f"({new.engine.N} books)")
+            return True
+
+    async def watch_index(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                # Keep serving the current snapshot; retried at the next check
+                print(f"[service] Reload failed: {e!r}")
+
+    async def _with_snapshot(self, fn, *args):
+        snapshot = self.snapshot
+        snapshot.active += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, snapshot, *args)
+        finally:
+            snapshot.active -= 1
+            if snapshot.retired and not snapshot.active:
+                snapshot.close()
+
+    # ------------------------------------------------------------ queries
+
+    def _aliases(self, book_ids: List[int]) -> Dict[int, List[int]]:
+        aliases: Dict[int, List[int]] = {}
+        for i in range(0, len(book_ids), IN_CHUNK):
+            chunk = book_ids[i:i + IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            sql = (f"SELECT canonical, book_id FROM signatures WHERE canonical IN ({placeholders}) "
+                   f"AND book_id != canonical ORDER BY book_id")
+            for row in self.alias_pool.fetch(sql, tuple(chunk)):
+                aliases.setdefault(row["canonical"], []).append(row["book_id"])
+        return aliases
+
+    def _shown(self, book_ids: List[int], author: str, language: str) -> set:
+        # The books a search may return: with a datamart row that passes the filters
+        shown = set()
+        columns = "book_id, author, language" if author or language else "book_id"
+        for i in range(0, len(book_ids), IN_CHUNK):
+            chunk = book_ids[i:i + IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            sql = f"SELECT {columns} FROM books WHERE book_id IN ({placeholders})"
+            for row in self.pool.fetch(sql, tuple(chunk)):
+                if author and author not in (row["author"] or "").lower():
+                    continue
+                if language and not (row["language"] or "").lower().startswith(language):
+                    continue
+                shown.add(row["book_id"])
+        return shown
+
+    def _search(self, snapshot: Snapshot, q: str, mode: str, author: str, language: str,
+                limit: int) -> Tuple[int, list]:
+        """
+        Returns (total, the best `limit` hits). total counts every match the datamart and
+        the filters keep; the engine ranks `limit` hits, then twice as many each time the
+        filters leave fewer than `limit`.
+        """
+        engine = snapshot.engine
+        shown = self._shown(engine.matches(q, mode), author, language)
+        total = len(shown)
+        k = max(1, limit)
+        kept = []
+        seen = 0
+        while total:
+            # Top-k results are a prefix of the top-2k ones, so only the new tail is checked
+            hits = engine.search(q, k=k, mode=mode)
+            kept += [{"bookId": book_id, "score": score} for book_id, score in hits[seen:] if book_id in shown]
+            seen = len(hits)
+            if len(kept) >= min(limit, total) or len(hits) < k or k >= engine.N:
+                break
+            k = min(k * 2, engine.N)
+        top = kept[:limit]
+        if self.alias_pool is not None:
+            aliases = self._aliases([hit["bookId"] for hit in top])
+            for hit in top:
+                hit["aliases"] = aliases.get(hit["bookId"], [])
+        return total, top
+
+    async def search(self, params: Dict[str, str]) -> Tuple[int, dict]:
+        q = params.get("q", "")
+        if not q.strip():
+            return 400, {"error": "missing query param 'q'"}
+        mode = params.get("mode", "and")
+        if mode not in ("and", "or"):
+            return 400, {"error": "mode must be 'and' or 'or'"}
+        try:
+            page = int(params.get("page", "1"))
+            page_size = int(params.get("pageSize", "20"))
+        except ValueError:
+            return 400, {"error": "page and pageSize must be integers"}
+        author = params.get("author", "").strip().lower()
+        language = params.get("language", "").strip().lower()
+
+        start = max(0, (page - 1) * page_size)
+        end = min(start + max(0, page_size), self.max_results)
+        key = (self.generation, normalize_query(q), mode, author, language)
+        cached = self.cache.get(key)
+        # Usable if it ranked up to the end of the page (or all hits there are)
+        if cached is None or not (len(cached[1]) >= end or len(cached[1]) == cached[0]):
+            cached = await self._with_snapshot(self._search, q, mode, author, language, end)
+            # Only cache what the current generation produced
+            if key[0] == self.generation:
+                self.cache.put(key, cached)
+        total, hits = cached
+
+        items = hits[start:end]
+        return 200, {"query": q, "mode": mode, "page": page, "pageSize": page_size, "total": total,
+                     "items": items}
+
+    async def book(self, raw_id: str) -> Tuple[int, dict]:
+        try:
+            book_id = int(raw_id)
+        except ValueError:
+            return 400, {"error": "invalid id"}
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(
+            self.executor, self.pool.fetch,
+            "SELECT book_id, title, author, language FROM books WHERE book_id = ?", (book_id,),
+        )
+        if not rows:
+            return 404, {"error": "book not found"}
+        return 200, _book(rows[0])
+
+    def health(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "status": "ok", "service": "search", "version": VERSION,
+            "generation": self.generation, "books": snapshot.engine.N if snapshot else 0,
+            "cache": self.cache.stats(),
+        }
+
+    async def dispatch(self, method: str, target: str) -> Tuple[int, dict]:
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if path == "/health" and method == "GET":
+                return 200, self.health()
+            if path == "/search" and method == "GET":
+                return await self.search(params)
+            if path.startswith("/book/") and method == "GET":
+                return await self.book(path[len("/book/"):])
+            if path == "/admin/reload" and method == "POST":
+                try:
+                    await self.reload(force=True)
+                except Exception as e:
+                    return 500, {"message": f"reload failed: {e}"}
+                return 200, {"message": "reloaded", "generation": self.generation}
+            if path in ("/health", "/search", "/admin/reload") or path.startswith("/book/"):
+                return 405, {"error": "method not allowed"}
+            return 404, {"error": "not found"}
+        except sqlite3.Error as e:
+            return 500, {"error": f"datamart: {e}"}
+
+    # ------------------------------------------------------------ HTTP
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, http_version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    break
+                if length:
+                    await reader.readexactly(length)
+
+                status, payload = await self.dispatch(method.upper(), target)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if http_version == "HTTP/1.0" else connection != "close"
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def serve(self, host: str = "0.0.0.0", port: int = 8082) -> None:
+        await self.reload(force=True)
+        server = await asyncio.start_server(self.handle, host, port)
+        watcher = asyncio.create_task(self.watch_index()) if self.reload_interval > 0 else None
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+
+        print(f"[service] Listening on http://{host}:{port} (index {self.index_path}, db {self.db_path})")
+        async with server:
+            await stop.wait()
+            # Idle keep-alive connections would otherwise hold their handlers open
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.sleep(0.1)
+        if watcher is not None:
+            watcher.cancel()
+        self.executor.shutdown(wait=True)
+        self._builder.shutdown(wait=True)
+        self.pool.close()
+        if self.alias_pool is not None:
+            self.alias_pool.close()
+        print("[service] Stopped.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Async HTTP search service over the inverted index and datamart.")
+    ap.add_argument("--index", default=os.environ.get("INDEX_PATH", "index/segments"),
+                    help="Segments dir, binary index (.bin) or JSON export")
+    ap.add_argument("--db", default=os.environ.get("DB_PATH", "datamart/datamart.db"))
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8082")))
+    ap.add_argument("--threads", type=int, default=4, help="Query threads and pooled SQLite connections")
+    ap.add_argument("--cache-size", type=int, default=1024, help="Cached search results (0 = off)")
+    ap.add_argument("--max-results", type=int, default=1000, help="Hits kept per query for paging")
+    ap.add_argument("--reload-interval", type=float, default=5.0,
+                    help="Seconds between checks for a new index on disk (0 = only on /admin/reload)")
+    ap.add_argument("--dedup-db", default=None, help="Signature store: list near-duplicate IDs with each hit")
+    args = ap.parse_args()
+
+    service = SearchService(args.index, args.db, args.threads, args.cache_size, args.max_results,
+                            args.reload_interval, args.dedup_db)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("[service] Stopped.")
+
+
+if __name__ == "__main__":
+    main()
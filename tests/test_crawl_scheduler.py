@@ -0,0 +1,24 @@
+"""
+Retry bookkeeping of the crawl scheduler.
+"""
+
+from crawler.engine import TrafficStats
+from crawler.scheduler import MAX_ATTEMPTS, CrawlScheduler
+
+
+def _fail(scheduler: CrawlScheduler, **result) -> None:
+    ids, _ = scheduler.next_batch()
+    scheduler.record([{"ok": False, "book_id": book_id, **result} for book_id in ids], TrafficStats(), 1.0)
+
+
+def test_throttled_ids_do_not_spend_attempts():
+    scheduler = CrawlScheduler(batch_size=3, adaptive=False)
+    for _ in range(MAX_ATTEMPTS + 2):
+        _fail(scheduler, reason="throttled", retry_after=0)
+    assert sorted((book_id, attempts) for _, book_id, attempts in scheduler.retries) == [(1, 0), (2, 0), (3, 0)]
+
+
+def test_failed_requests_spend_attempts():
+    scheduler = CrawlScheduler(batch_size=3, adaptive=False)
+    _fail(scheduler, reason="http_error:503", status=503, retry_after=0)
+    assert sorted(attempts for _, _, attempts in scheduler.retries) == [1, 1, 1]
@@ -0,0 +1,109 @@
+"""
+DownloadEngine against the local stand-in for gutenberg.org (crawler.fake_gutenberg):
+pooled connections, the politeness rate, Retry-After, the retry budget and 404s.
+"""
+
+import time
+
+import pytest
+
+from crawler.engine import DownloadEngine, RetryBudget
+from crawler.fake_gutenberg import serve
+
+
+@pytest.fixture
+def datalake(tmp_path):
+    return tmp_path / "datalake"
+
+
+def _engine(server, datalake, **kwargs) -> DownloadEngine:
+    kwargs.setdefault("rate", 0)
+    return DownloadEngine(datalake=datalake, url_template=server.url_template, **kwargs)
+
+
+def test_connections_are_reused(datalake):
+    server = serve()
+    try:
+        with _engine(server, datalake, concurrency=2) as engine:
+            results = engine.download_many(range(1, 21))
+    finally:
+        server.shutdown()
+    assert all(res["ok"] for res in results)
+    assert server.requests_served == 20
+    assert server.connections <= 2
+
+
+def test_rate_limit_keeps_under_the_server_limit(datalake):
+    server = serve(rate_limit=10, retry_after=1)
+    try:
+        with _engine(server, datalake, concurrency=3, rate=8) as engine:
+            start = time.monotonic()
+            results = engine.download_many(range(1, 7))
+            elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+    assert all(res["ok"] for res in results)
+    # Six requests at 8 per second: five intervals of 1/8 s
+    assert elapsed >= 5 / 8 - 0.05
+    assert server.throttled == 0
+
+
+def test_retry_after_is_waited_out(datalake):
+    server = serve(rate_limit=2, retry_after=1)
+    try:
+        with _engine(server, datalake, concurrency=1) as engine:
+            start = time.monotonic()
+            results = engine.download_many(range(1, 5))
+            elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+    assert all(res["ok"] for res in results)
+    assert server.throttled >= 1
+    assert elapsed >= 1.0
+    assert engine.last_stats.throttled == server.throttled
+    assert engine.last_stats.retry_after == 1.0
+
+
+def test_long_retry_after_stops_the_batch(datalake):
+    server = serve(rate_limit=1, retry_after=120)
+    try:
+        with _engine(server, datalake, concurrency=1) as engine:
+            start = time.monotonic()
+            results = engine.download_many(range(1, 6))
+            elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+    assert results[0]["ok"]
+    assert results[1]["reason"] == "throttled:429"
+    # The rest of the batch is never sent
+    assert [res["reason"] for res in results[2:]] == ["throttled"] * 3
+    assert server.requests_served == 2
+    assert elapsed < 5
+
+
+def test_retry_budget_is_shared_by_the_batch(datalake):
+    server = serve(error_rate=1.0, retry_after=1)
+    try:
+        with _engine(server, datalake, concurrency=1, retry_budget=2, max_retries=4) as engine:
+            results = engine.download_many(range(1, 4))
+    finally:
+        server.shutdown()
+    assert all(res["reason"].startswith("retry_budget_exhausted:") for res in results)
+    # One request per book plus the two retries the budget allowed
+    assert server.requests_served == 3 + 2
+
+
+def test_missing_book_fails_fast(datalake):
+    server = serve(missing_ids={5})
+    try:
+        with _engine(server, datalake) as engine:
+            budget = RetryBudget(10)
+            start = time.monotonic()
+            res = engine.download(5, budget)
+            elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+    assert res == {"ok": False, "book_id": 5, "reason": "http_error:404", "status": 404}
+    assert server.requests_served == 1
+    assert budget.spent(server.url_template.split("/")[2]) == 0
+    assert elapsed < 1.0
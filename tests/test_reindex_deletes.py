@@ -0,0 +1,131 @@
+"""
+Re-indexing a book replaces it everywhere: the words its old version had and the new
+one lacks must disappear from the segmented index, the exports, the statistics and
+merged segments, not only the words both versions share.
+"""
+
+import json
+
+import pytest
+
+from crawler.config import END_MARKERS, START_MARKERS
+from crawler import downloader
+from crawler.downloader import store_book
+from crawler.engine import DownloadEngine
+from crawler.fake_gutenberg import serve
+from crawler.state import CrawlState
+from inverted_index.binary_index import BinaryIndex, export_binary
+from inverted_index.index_stats import collection_stats, compute_stats
+from inverted_index.indexer import build_inverted_index
+from inverted_index.segments import SegmentedIndex, export_json, load_manifest, merge_segments
+
+
+def _store(datalake, book_id: int, body: str) -> None:
+    text = (
+        f"Title: Book {book_id}\n\n"
+        f"{START_MARKERS[0]} BOOK {book_id} ***\n\n{body}\n\n{END_MARKERS[0]} BOOK {book_id} ***\n"
+    )
+    assert store_book(book_id, text, datalake=datalake)["ok"]
+
+
+def _build(tmp_path, postings_format: str, **kwargs) -> None:
+    build_inverted_index(
+        str(tmp_path / "datalake"),
+        str(tmp_path / "index" / "inverted_index.json"),
+        progress_path=str(tmp_path / "index" / "progress.json"),
+        postings_format=postings_format,
+        **kwargs,
+    )
+
+
+def _assert_replaced(tmp_path) -> None:
+    seg_dir = str(tmp_path / "index" / "segments")
+    index = SegmentedIndex(seg_dir)
+    assert index.postings("alpha") == []
+    assert index.postings("beta") == [2]
+    assert index.postings("delta") == [1, 3]
+    assert "alpha" not in index.terms()
+    assert "alpha" not in index.to_dict()
+    if index.has_freqs:
+        assert index.postings_with_freqs("beta") == [(2, 1)]
+        assert index.doc_length(1) == index.doc_length(3) + 1
+
+    json_path = tmp_path / "export.json"
+    export_json(seg_dir, str(json_path))
+    exported = json.loads(json_path.read_text(encoding="utf-8"))
+    assert "alpha" not in exported
+    assert exported["beta"] == [2]
+
+    bin_path = tmp_path / "export.bin"
+    export_binary(seg_dir, str(bin_path))
+    with BinaryIndex(str(bin_path)) as binary:
+        assert "alpha" not in binary
+        assert binary.postings("beta") == [2]
+
+    stats = compute_stats(seg_dir)
+    assert "alpha" not in stats["df"]
+    assert stats["df"]["beta"] == 1
+    assert stats["df"]["delta"] == 2
+    assert collection_stats(seg_dir) == stats
+
+
+@pytest.mark.parametrize("postings_format", ["docs", "freqs", "positions"])
+def test_reindexed_book_loses_old_terms(tmp_path, postings_format):
+    datalake = tmp_path / "datalake"
+    _store(datalake, 1, "alpha beta")
+    _store(datalake, 2, "beta gamma")
+    _build(tmp_path, postings_format)
+
+    _store(datalake, 1, "delta delta")
+    _build(tmp_path, postings_format)
+    _store(datalake, 3, "delta")
+    _build(tmp_path, postings_format)
+
+    _assert_replaced(tmp_path)
+
+    seg_dir = str(tmp_path / "index" / "segments")
+    assert merge_segments(seg_dir, small_docs=1000, merge_factor=2)
+    assert len(load_manifest(seg_dir)["segments"]) == 1
+    _assert_replaced(tmp_path)
+
+
+def test_spimi_build_keeps_latest_version(tmp_path, monkeypatch):
+    # Both versions of book 1 (different hours) end up in the same SPIMI segment
+    datalake = tmp_path / "datalake"
+    monkeypatch.setattr(downloader, "now_parts_utc", lambda: ("20240101", "00"))
+    _store(datalake, 1, "alpha beta")
+    _store(datalake, 2, "beta gamma")
+    monkeypatch.setattr(downloader, "now_parts_utc", lambda: ("20240101", "01"))
+    _store(datalake, 1, "delta delta")
+    _store(datalake, 3, "delta")
+    _build(tmp_path, "positions", memory_budget_mb=64)
+
+    assert len(load_manifest(str(tmp_path / "index" / "segments"))["segments"]) == 1
+    assert SegmentedIndex(str(tmp_path / "index" / "segments")).doc_ids() == [1, 2, 3]
+    _assert_replaced(tmp_path)
+
+
+def test_refreshed_download_replaces_old_terms(tmp_path):
+    # Book 1 is first served as a re-release of book 2, then corrected upstream
+    server = serve(duplicates={1: 2})
+    state = CrawlState(str(tmp_path / "crawl_state.db"))
+    seg_dir = str(tmp_path / "index" / "segments")
+    try:
+        with DownloadEngine(rate=0, datalake=tmp_path / "datalake", url_template=server.url_template,
+                            state=state) as engine:
+            assert all(res["ok"] for res in engine.download_many([1, 2]))
+            _build(tmp_path, "freqs")
+            assert SegmentedIndex(seg_dir).postings("volunteer") == [1]
+
+            del server.duplicates[1]
+            [res] = engine.download_many([1])
+            assert res["ok"] and not res.get("unchanged")
+        _build(tmp_path, "freqs")
+    finally:
+        state.close()
+        server.shutdown()
+
+    index = SegmentedIndex(seg_dir)
+    assert index.postings("volunteer") == []
+    assert index.doc_ids() == [1, 2]
+    assert "volunteer" not in collection_stats(seg_dir)["df"]
@@ -0,0 +1,32 @@
+"""
+How book IDs map to hash shards, and layouts written before the current hash version.
+"""
+
+import json
+from collections import Counter
+
+from inverted_index.shards import HASH_VERSION, LAYOUT_NAME, init_layout, load_layout, shard_of
+
+
+def test_hash_spreads_id_patterns():
+    for count in (2, 3, 4, 8, 10):
+        for stride in (1, 2, 4, 8):
+            ids = range(stride, 4000 * stride + 1, stride)
+            sizes = Counter(shard_of(book_id, count) for book_id in ids)
+            assert sorted(sizes) == list(range(count))
+            assert min(sizes.values()) > 0.8 * len(ids) / count, (count, stride, sizes)
+
+
+def test_new_layout_records_hash_version(tmp_path):
+    assert init_layout(tmp_path, 4)["hash_version"] == HASH_VERSION
+    assert load_layout(tmp_path)["hash_version"] == HASH_VERSION
+    assert "hash_version" not in init_layout(tmp_path / "range", 4, "range", 100)
+
+
+def test_old_layout_keeps_its_hash(tmp_path):
+    (tmp_path / LAYOUT_NAME).write_text(json.dumps({"count": 4, "scheme": "hash", "range_size": None}))
+    layout = init_layout(tmp_path, 4)
+    assert layout["hash_version"] == 1
+    assert load_layout(tmp_path)["hash_version"] == 1
+    # Version 1 kept the low bits: book_id % count for a power-of-two count
+    assert [shard_of(book_id, 4, hash_version=1) for book_id in range(1, 9)] == [1, 2, 3, 0, 1, 2, 3, 0]
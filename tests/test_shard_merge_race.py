@@ -0,0 +1,72 @@
+"""
+A shard build must not lose segments to a background merge of the same shard.
+
+Control merges each shard's segments in a thread of its own process while the next
+cycle's shard processes start up and run crash recovery on the same directories;
+recovery used to delete the segment a merge had written but not yet registered.
+"""
+
+import threading
+import time
+from pathlib import Path
+
+from crawler.downloader import store_book
+from crawler.fake_gutenberg import fake_book
+from inverted_index import segments
+from inverted_index.segments import SegmentedIndex, load_manifest
+from inverted_index.shards import build_shards, shard_paths
+
+SHARDS = 2
+
+
+def _add_books(datalake: Path, ids) -> None:
+    for book_id in ids:
+        assert store_book(book_id, fake_book(book_id, words=50), datalake=datalake)["ok"]
+
+
+def _assert_intact(root: Path, expected_ids) -> None:
+    indexed = []
+    for i in range(SHARDS):
+        seg_dir = shard_paths(root, i)["segments"]
+        for entry in load_manifest(str(seg_dir))["segments"]:
+            assert (seg_dir / entry["name"]).exists(), f"{entry['name']} is in the manifest but missing"
+        indexed += SegmentedIndex(str(seg_dir)).doc_ids()
+    assert sorted(indexed) == sorted(expected_ids)
+
+
+def test_shard_build_during_merge(tmp_path, monkeypatch):
+    datalake = tmp_path / "datalake"
+    root = tmp_path / "shards"
+
+    # Four small segments per shard, enough for a merge
+    book_ids = []
+    for batch in range(4):
+        ids = range(batch * 10 + 1, batch * 10 + 11)
+        _add_books(datalake, ids)
+        book_ids += ids
+        build_shards(str(datalake), str(root), SHARDS)
+
+    # Stall the merge right after it wrote its segment, before the manifest names it
+    written = threading.Event()
+    write_segment_file = segments._write_segment_file
+
+    def slow_write(*args):
+        entry = write_segment_file(*args)
+        written.set()
+        time.sleep(2.0)
+        return entry
+
+    monkeypatch.setattr(segments, "_write_segment_file", slow_write)
+    seg_dir = str(shard_paths(root, 0)["segments"])
+    merge = segments.start_background_merge(seg_dir, small_docs=1000, merge_factor=4)
+    assert written.wait(30)
+
+    # The next cycle: new books, fresh shard processes recovering the same directories
+    _add_books(datalake, range(41, 51))
+    book_ids += range(41, 51)
+    build_shards(str(datalake), str(root), SHARDS)
+    merge.join(30)
+    assert not merge.is_alive()
+
+    assert len(load_manifest(seg_dir)["segments"]) < 5
+    _assert_intact(root, book_ids)